@@ -1,32 +1,62 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from os import environ
-from urllib.parse import quote
-from flask_migrate import Migrate
-from flask_cors import CORS
-from dotenv import dotenv_values, load_dotenv
-from logging import warning
+from threading import Lock
+from app.database import generate_database_uri, engine_options, configure_engine, replicas, RoutingSession, env_flag
 
 
-app = None
-db = SQLAlchemy()  # Create an instance of SQLAlchemy
-migrate = Migrate()
-def create_app():
+db = SQLAlchemy(session_options={"class_": RoutingSession})  # Create an instance of SQLAlchemy
+_default_app_lock = Lock()
+
+
+def create_app(config=None):
+    # Build an application; everything environment-dependent is read here,
+    # not at import. ``config`` overrides the values taken from the environment
+    from flask_migrate import Migrate
+    from flask_cors import CORS
+    from app.json_provider import json_provider
+    from app import instrumentation, metrics, slow_queries
     substitution_dict = environ
     from app.models.tag import Tag
     from app.models.project import Project
     from app.models.description import Description
     app = Flask(__name__)
+    app.json = json_provider(substitution_dict.get("JSON_PROVIDER", "auto"))(app)
     CORS(app, supports_credentials=True, resources={
             r"/*": {"origins": substitution_dict.get("CORS_ORIGINS").split(",")}
         })
     # Configuration and other app setup
     app.config['SQLALCHEMY_DATABASE_URI'] = generate_database_uri()
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-    
+    app.config['VERIFY_URL'] = substitution_dict.get("VERIFY_URL")
+    app.config['ADMIN_LIST'] = {name for name in substitution_dict.get("ADMIN_LIST", "").split(",") if name}
+    # Server-Timing header and a log line with SQL/auth/serialize timings per request
+    app.config['REQUEST_TIMING'] = env_flag("REQUEST_TIMING", False)
+    # Prometheus metrics at /metrics, off unless asked for; METRICS_ALLOW
+    # limits scrapes to comma-separated addresses or networks
+    app.config['METRICS'] = env_flag("METRICS", False)
+    app.config['METRICS_ALLOW'] = [network.strip() for network in substitution_dict.get("METRICS_ALLOW", "").split(",") if network.strip()]
+    # Directory the worker processes share their series through (gunicorn.conf.py sets one)
+    app.config['METRICS_DIR'] = substitution_dict.get("METRICS_DIR")
+    # Statements slower than SLOW_QUERY_MS are logged with their plan; 0 turns the log off
+    app.config['SLOW_QUERY_MS'] = float(substitution_dict.get("SLOW_QUERY_MS", 0))
+    app.config['SLOW_QUERY_EXPLAIN'] = env_flag("SLOW_QUERY_EXPLAIN", True)
+    app.config['SLOW_QUERY_LOG_PER_MINUTE'] = int(substitution_dict.get("SLOW_QUERY_LOG_PER_MINUTE", 60))
+    app.config.update(config or {})
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
+
     # Initialize the db object with your Flask application
     db.init_app(app)
-    migrate.init_app(app, db)
+    with app.app_context():
+        configure_engine(db.engine)
+    # Comma-separated replica URLs that read-only routes may use
+    replica_urls = [url for url in substitution_dict.get("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+    replicas.configure(replica_urls, substitution_dict.get("REPLICA_STRATEGY", "round_robin"),
+                       float(substitution_dict.get("REPLICA_RETRY_AFTER", 30)))
+    Migrate(app, db)
+    instrumentation.init_app(app)
+    metrics.init_app(app)
+    slow_queries.init_app(app)
     from app.controller.controller import controller_bp
 
     app.register_blueprint(controller_bp, url_prefix='/projects')
@@ -34,18 +64,15 @@ def create_app():
     return app
 
 
-def generate_database_uri():
-    db_username = environ.get('DB_USERNAME')
-    db_password = environ.get('DB_PASSWORD')
-    db_host = environ.get('DB_HOST')
-    db_name = environ.get('DB_NAME')
-    db_port = "3306"
-
-
-    # Encode the username and password as bytes
-    encoded_username = quote(db_username.encode('utf-8'), safe='')
-    encoded_password = quote(db_password.encode('utf-8'), safe='')
-    # Construct the database URI with encoded username and password
-    return f'mysql+pymysql://{encoded_username}:{encoded_password}@{db_host}:{db_port}/{db_name}'
-
-app = create_app()
+def __getattr__(name):
+    # ``from app import app`` builds the default application on first use
+    if name != "app":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _default_app_lock:
+        if "app" not in globals():
+            try:
+                globals()["app"] = create_app()
+            except AttributeError as error:
+                # Would otherwise surface as "cannot import name 'app'" and hide the cause
+                raise RuntimeError("create_app() failed") from error
+    return globals()["app"]
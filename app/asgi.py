@@ -0,0 +1,292 @@
+# ASGI entry point: ``uvicorn app.asgi:application``.
+#
+# The read routes (listing, find/<title>, tag/<name>, tags and tags/facets)
+# run on an async engine, so a request waiting on the database doesn't hold a
+# thread. Every other request goes to the Flask app, which WsgiToAsgi runs in
+# a thread pool; admin tokens are verified with an async HTTP client first so
+# the Flask route finds them in the token cache.
+import asyncio
+import re
+from hashlib import sha1
+from urllib.parse import parse_qsl
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from werkzeug.datastructures import MultiDict
+
+try:
+    import httpx
+    from asgiref.wsgi import WsgiToAsgi
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+except ImportError as error:  # optional, see requirements-async.txt
+    raise ImportError("The ASGI serving mode needs the packages in requirements-async.txt") from error
+
+from app import app as flask_app, db
+from app.database import environment, engine_options, configure_engine
+from app.models.project import Project, dump_snapshot
+from app.models.tag import Tag, project_tags
+from app.controller.auth import AUTH_MODE, VERIFY_TIMEOUT, token_cache, remember_verification
+from app.controller.cache import catalog_version, catalog_sync, response_cache
+from app.controller.fieldsets import FieldsetError, fieldset, FULL
+from app.controller.pagination import PaginationError, page_args, encode_cursor
+
+ASYNC_DRIVERS = {"mysql": "aiomysql", "postgresql": "asyncpg", "sqlite": "aiosqlite"}
+CORS_ORIGINS = environment.get("CORS_ORIGINS", "").split(",")
+
+
+def in_memory_sqlite(url):
+    # Every connection to such a database gets a new, empty one
+    return url.get_backend_name() == 'sqlite' and (url.database in (None, "", ":memory:")
+                                                   or url.query.get("mode") == "memory")
+
+
+def async_database_url(url):
+    # The primary's URL with the async driver of its backend; ASYNC_DATABASE_URL overrides it
+    override = environment.get("ASYNC_DATABASE_URL")
+    url = make_url(override) if override else url
+    if in_memory_sqlite(url):
+        raise ValueError("The async engine can't share an in-memory SQLite database; "
+                         "give DATABASE_URL (or ASYNC_DATABASE_URL) a file")
+    if override:
+        return url
+    backend = url.get_backend_name()
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+
+def create_engine_for(url):
+    backend = url.get_backend_name()
+    # aiosqlite opens a connection per checkout (NullPool), there's no pool to size
+    options = {} if backend == 'sqlite' else engine_options(url.render_as_string(hide_password=False))
+    if backend == 'postgresql' and "connect_args" in options:
+        # asyncpg takes server settings instead of libpq options
+        timeout = options.pop("connect_args")["options"].rsplit("=", 1)[1]
+        options["connect_args"] = {"server_settings": {"statement_timeout": timeout}}
+    engine = create_async_engine(url, **options)
+    configure_engine(engine.sync_engine)
+    return engine
+
+
+# Reads, mirroring the routes in app/controller/controller.py
+
+def _reader(fields):
+    # Same split as project_reader(): stored snapshots for full payloads, the
+    # column-pruned ORM load for sparse ones
+    if fields == FULL:
+        return select(Project.id, Project.snapshot)
+    return select(Project).options(*Project.eager_options(*fields))
+
+
+async def _render(session, fields, statement):
+    if fields == FULL:
+        rows = (await session.execute(statement)).all()
+        missing = Project.missing_snapshots(rows)
+        projects = []
+        if missing:
+            load = select(Project).options(*Project.eager_options()).where(Project.id.in_(missing))
+            projects = (await session.scalars(load)).all()
+        snapshots = Project.load_snapshots(rows)
+        tags_statement = Project.snapshot_tags_statement(snapshots)
+        tags = Project.snapshot_tags(await session.execute(tags_statement)) if tags_statement is not None else {}
+        return rows, Project.snapshot_texts(rows, projects, snapshots, tags)
+    projects = (await session.scalars(statement)).all()
+    return projects, [dump_snapshot(data) for data in Project.serialize_many(projects, *fields)]
+
+
+async def _page(session, fields, statement, limit, after):
+    if after is not None:
+        statement = statement.where(Project.id > after)
+    rows, texts = await _render(session, fields, statement.order_by(Project.id).limit(limit + 1))
+    if len(rows) > limit:
+        return texts[:limit], encode_cursor(rows[limit - 1].id)
+    return texts, None
+
+
+def _list(texts):
+    return "[" + ",".join(texts) + "]"
+
+
+def _page_body(texts, next_cursor):
+    return '{"items":[' + ",".join(texts) + '],"next":' + dump_snapshot(next_cursor) + "}"
+
+
+def _message(text):
+    return dump_snapshot({"message": text})
+
+
+async def get_projects(session, args):
+    fields = fieldset(Project.FIELDS, args)
+    page = page_args(args)
+    if page:
+        return 200, _page_body(*await _page(session, fields, _reader(fields), *page))
+    _, texts = await _render(session, fields, _reader(fields))
+    return 200, _list(texts)
+
+
+async def get_project_by_title(session, args, title):
+    fields = fieldset(Project.FIELDS, args)
+    statement = _reader(fields).where(Project.slug == Project.slugify(title)).limit(1)
+    _, texts = await _render(session, fields, statement)
+    if texts:
+        return 200, texts[0]
+    return 404, _message("Project not found")
+
+
+async def get_projects_by_tag(session, args, tag_name):
+    tag_name = re.sub(r'_+', '_', tag_name)
+    tag_id = (await session.execute(select(Tag.id).where(Tag.name.like(tag_name)).limit(1))).scalar()
+    if tag_id is None:
+        return 404, _message("No tags found with the specified name")
+    fields = fieldset(Project.FIELDS, args)
+    statement = _reader(fields).where(Project.id.in_(select(project_tags.c.project_id).where(project_tags.c.tag_id == tag_id)))
+    page = page_args(args)
+    if page:
+        texts, next_cursor = await _page(session, fields, statement, *page)
+        if texts or page[1] is not None:
+            return 200, _page_body(texts, next_cursor)
+    else:
+        _, texts = await _render(session, fields, statement)
+    if not texts:
+        return 404, _message("No projects found with the specified tag")
+    return 200, _list(texts)
+
+
+async def get_tags_with_projects(session, args):
+    fields = fieldset(Tag.FIELDS, args).fields
+    page = page_args(args)
+    limit, after = page or (None, None)
+    rows = await session.execute(Tag.in_use_statement(fields, limit, after))
+    tags, last_id = Tag.group_in_use(rows, fields, limit)
+    if page and (tags or after is not None):
+        next_cursor = encode_cursor(last_id) if last_id is not None else None
+        return 200, dump_snapshot({"items": tags, "next": next_cursor})
+    if tags:
+        return 200, dump_snapshot(tags)
+    return 404, _message("No tags with projects found")
+
+
+async def get_tag_facets(session, args):
+    rows = await session.execute(Tag.facets_statement())
+    return 200, dump_snapshot([{"id": tag_id, "name": name, "count": count} for tag_id, name, count in rows])
+
+
+ROUTES = [
+    (re.compile(r"/projects/"), get_projects),
+    (re.compile(r"/projects/find/(?P<title>[^/]+)"), get_project_by_title),
+    (re.compile(r"/projects/tag/(?P<tag_name>[^/]+)"), get_projects_by_tag),
+    (re.compile(r"/projects/tags"), get_tags_with_projects),
+    (re.compile(r"/projects/tags/facets"), get_tag_facets),
+]
+
+
+class ProjectsASGI:
+    """ASGI application serving the read routes natively and the rest through Flask."""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.wsgi = WsgiToAsgi(wsgi_app)
+        self.engine = None
+        self.sessions = None
+        self.client = None
+
+    def start(self):
+        # Called from lifespan startup, or by the first request when the server has no lifespan
+        if self.engine is None:
+            with self.wsgi_app.app_context():
+                url = async_database_url(db.engine.url)
+            self.engine = create_engine_for(url)
+            self.sessions = async_sessionmaker(self.engine, expire_on_commit=False)
+            pool_size = int(environment.get("AUTH_POOL_SIZE", 10))
+            self.client = httpx.AsyncClient(limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size))
+
+    async def close(self):
+        if self.engine is not None:
+            await self.client.aclose()
+            await self.engine.dispose()
+            self.engine = self.sessions = self.client = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        if scope["type"] == "http":
+            self.start()
+            args = MultiDict(parse_qsl(scope["query_string"].decode("utf-8", "replace"), keep_blank_values=True))
+            headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope["headers"]}
+            # Streams are left to Flask, which already writes them batch by batch
+            if scope["method"] == "GET" and "stream" not in args:
+                for pattern, view in ROUTES:
+                    match = pattern.fullmatch(scope["path"])
+                    if match:
+                        return await self.serve(view, match.groupdict(), scope, args, headers, send)
+            if scope["method"] not in ("GET", "HEAD", "OPTIONS") or scope["path"] == "/projects/admin":
+                await self.verify(headers.get("authorization", ""))
+        return await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self.start()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def verify(self, jwt_token):
+        # Ask VERIFY_URL without blocking and leave the answer in the token
+        # cache; on errors the Flask route verifies again itself
+        if AUTH_MODE == "local" or token_cache.get(jwt_token)[0]:
+            return
+        try:
+            verify_url = self.wsgi_app.config['VERIFY_URL']
+            response = await self.client.get(verify_url, headers={'Authorization': jwt_token}, timeout=VERIFY_TIMEOUT)
+        except httpx.HTTPError:
+            return
+        remember_verification(jwt_token, response.status_code, response.json)
+
+    def sync(self):
+        with self.wsgi_app.app_context():
+            catalog_sync.sync()
+
+    async def serve(self, view, params, scope, args, headers, send):
+        # What the blueprint's before_request does for the Flask routes
+        if catalog_sync.due():
+            await asyncio.to_thread(self.sync)
+        # Same response cache, key and ETag as the @cached Flask routes
+        key = (scope["path"], tuple(sorted(args.items(multi=True))))
+        version = catalog_version.value
+        entry = response_cache.get(key, version) if response_cache.enabled else None
+        if entry is not None:
+            return await self.respond(send, 200, entry.body, headers, entry.etag)
+
+        with self.wsgi_app.app_context():
+            try:
+                async with self.sessions() as session:
+                    status, text = await view(session, args, **params)
+            except (FieldsetError, PaginationError) as error:
+                status, text = 400, _message(str(error))
+        body = (text + "\n").encode("utf-8")
+        if status != 200:
+            return await self.respond(send, status, body, headers)
+        etag = sha1(body).hexdigest()
+        if response_cache.enabled:
+            response_cache.put(key, version, body, etag, "application/json")
+        await self.respond(send, status, body, headers, etag)
+
+    async def respond(self, send, status, body, headers, etag=None):
+        response_headers = [(b"content-type", b"application/json")]
+        if etag is not None:
+            response_headers.append((b"etag", f'"{etag}"'.encode("ascii")))
+            if etag in (tag.strip().removeprefix("W/").strip('"') for tag in headers.get("if-none-match", "").split(",")):
+                status, body = 304, b""
+        if status != 304:
+            response_headers.append((b"content-length", str(len(body)).encode("ascii")))
+        origin = headers.get("origin")
+        if origin and ("*" in CORS_ORIGINS or origin in CORS_ORIGINS):
+            # What flask_cors sends with supports_credentials=True
+            response_headers += [(b"access-control-allow-origin", origin.encode("latin-1")),
+                                 (b"access-control-allow-credentials", b"true"), (b"vary", b"Origin")]
+        await send({"type": "http.response.start", "status": status, "headers": response_headers})
+        await send({"type": "http.response.body", "body": body})
+
+
+application = ProjectsASGI(flask_app)
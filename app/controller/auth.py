@@ -0,0 +1,251 @@
+from base64 import urlsafe_b64decode
+from collections import OrderedDict
+from hashlib import sha256, sha384, sha512
+from os import environ, path
+from threading import Lock
+from time import monotonic, time
+import hmac
+import json
+import requests
+from flask import current_app
+from requests.adapters import HTTPAdapter
+from logging import warning
+
+try:
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding, rsa
+    from cryptography.exceptions import InvalidSignature
+except ImportError:  # RS* keys are only usable when cryptography is installed
+    rsa = None
+
+environment = environ
+# "remote" asks VERIFY_URL about every token, "local" checks signatures against AUTH_JWKS_PATH
+AUTH_MODE = environment.get("AUTH_MODE", "remote")
+VERIFY_TIMEOUT = float(environment.get("VERIFY_TIMEOUT", 5))
+AUTH_USERNAME_CLAIM = environment.get("AUTH_USERNAME_CLAIM", "sub")
+AUTH_LEEWAY = float(environment.get("AUTH_LEEWAY", 30))
+
+
+class TokenCache:
+    """Bounded TTL cache of token -> verified username.
+
+    Rejected tokens are cached as well (as None) with a shorter TTL so a client
+    retrying a bad token does not hammer the auth service. A token stays
+    accepted for at most ``ttl`` seconds after it was verified, so keep the TTL
+    well below the token lifetime.
+    """
+
+    def __init__(self, ttl=60, negative_ttl=10, max_size=1024):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    @staticmethod
+    def _key(token):
+        # Only keep a digest of the token in memory
+        return sha256(token.encode('utf-8')).digest()
+
+    def get(self, token):
+        # Returns (hit, username); username is None for a cached rejection
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def set(self, token, username):
+        if self.max_size <= 0:
+            return
+        ttl = self.ttl if username else self.negative_ttl
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (monotonic() + ttl, username)
+            self._entries.move_to_end(key)
+            # Evict the least recently used tokens once the cache is full
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+token_cache = TokenCache(
+    ttl=float(environment.get("AUTH_CACHE_TTL", 60)),
+    negative_ttl=float(environment.get("AUTH_CACHE_NEGATIVE_TTL", 10)),
+    max_size=int(environment.get("AUTH_CACHE_SIZE", 1024)),
+)
+
+# Keep-alive connections to the auth service shared by all requests
+session = requests.Session()
+_pool_size = int(environment.get("AUTH_POOL_SIZE", 10))
+session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=_pool_size))
+session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=_pool_size))
+
+
+def _b64decode(segment):
+    if isinstance(segment, str):
+        segment = segment.encode('ascii')
+    return urlsafe_b64decode(segment + b'=' * (-len(segment) % 4))
+
+
+def _b64int(segment):
+    return int.from_bytes(_b64decode(segment), 'big')
+
+
+_HMAC_DIGESTS = {"HS256": sha256, "HS384": sha384, "HS512": sha512}
+_RSA_HASHES = {"RS256": "SHA256", "RS384": "SHA384", "RS512": "SHA512"}
+
+
+class LocalKeySet:
+    """JSON Web Key Set read from a local file.
+
+    The parsed keys are kept in memory and the file is only re-read when its
+    modification time changes, checked at most every ``reload_interval``
+    seconds. When the file is missing or unreadable the keys read last stay
+    in use; until a first read succeeds there are none and every token is
+    rejected.
+    """
+
+    def __init__(self, key_path, reload_interval=60):
+        self.key_path = key_path
+        self.reload_interval = reload_interval
+        self._keys = []
+        self._mtime = None
+        self._checked = None
+        self._lock = Lock()
+
+    def keys(self):
+        now = monotonic()
+        if self._checked is None or now - self._checked >= self.reload_interval:
+            with self._lock:
+                self._checked = now
+                try:
+                    mtime = path.getmtime(self.key_path)
+                    if mtime != self._mtime:
+                        self.reload()
+                        self._mtime = mtime
+                except (OSError, ValueError, KeyError, AttributeError) as error:
+                    warning(f"Could not read the key set {self.key_path}: {error!r}")
+        return self._keys
+
+    def reload(self):
+        with open(self.key_path, 'r') as key_file:
+            data = json.load(key_file)
+        keys = []
+        for jwk in data.get("keys", []):
+            kty = jwk.get("kty")
+            if kty == "oct":
+                key = _b64decode(jwk["k"])
+            elif kty == "RSA" and rsa is not None:
+                key = rsa.RSAPublicNumbers(_b64int(jwk["e"]), _b64int(jwk["n"])).public_key()
+            else:
+                warning(f"Skipping unsupported key {jwk.get('kid')} of type {kty}")
+                continue
+            keys.append((jwk.get("kid"), jwk.get("alg"), kty, key))
+        self._keys = keys
+
+    def candidates(self, kid, alg):
+        kty = "oct" if alg in _HMAC_DIGESTS else "RSA"
+        return [key for key_id, key_alg, key_type, key in self.keys()
+                if key_type == kty and (key_alg in (None, alg)) and (kid is None or key_id == kid)]
+
+
+def _signature_valid(alg, key, signing_input, signature):
+    if alg in _HMAC_DIGESTS:
+        expected = hmac.new(key, signing_input, _HMAC_DIGESTS[alg]).digest()
+        return hmac.compare_digest(expected, signature)
+    try:
+        key.verify(signature, signing_input, padding.PKCS1v15(), getattr(hashes, _RSA_HASHES[alg])())
+        return True
+    except InvalidSignature:
+        return False
+
+
+def verify_local(jwt_token):
+    # Returns the username claim of a correctly signed, unexpired token, or None
+    if jwt_token.startswith('Bearer '):
+        jwt_token = jwt_token[len('Bearer '):]
+    try:
+        header_segment, payload_segment, signature_segment = jwt_token.split('.')
+        header = json.loads(_b64decode(header_segment))
+        claims = json.loads(_b64decode(payload_segment))
+        signature = _b64decode(signature_segment)
+    except ValueError:
+        return None
+    if not (isinstance(header, dict) and isinstance(claims, dict)):
+        return None
+    alg = header.get("alg")
+    if alg not in _HMAC_DIGESTS and (alg not in _RSA_HASHES or rsa is None):
+        return None
+
+    signing_input = f'{header_segment}.{payload_segment}'.encode('ascii')
+    if not any(_signature_valid(alg, key, signing_input, signature)
+               for key in key_set.candidates(header.get("kid"), alg)):
+        return None
+
+    # exp is required, nbf optional; both must be numbers of seconds
+    exp, nbf = claims.get("exp"), claims.get("nbf", 0)
+    if not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in (exp, nbf)):
+        return None
+    now = time()
+    if now > exp + AUTH_LEEWAY or now < nbf - AUTH_LEEWAY:
+        return None
+    username = claims.get(AUTH_USERNAME_CLAIM)
+    return username if isinstance(username, str) else None
+
+
+key_set = LocalKeySet(
+    environment.get("AUTH_JWKS_PATH", "jwks.json"),
+    reload_interval=float(environment.get("AUTH_JWKS_RELOAD", 60)),
+)
+
+
+def verify_token(jwt_token):
+    # Returns the username the token belongs to, or None
+    if AUTH_MODE == "local":
+        return verify_local(jwt_token)
+
+    hit, username = token_cache.get(jwt_token)
+    if hit:
+        return username
+
+    try:
+        response = session.get(current_app.config['VERIFY_URL'], headers={'Authorization': f'{jwt_token}'}, timeout=VERIFY_TIMEOUT)
+    except requests.RequestException as error:
+        # An unreachable or slow auth service rejects the token, uncached
+        warning(f"Could not reach VERIFY_URL: {error}")
+        return None
+    return remember_verification(jwt_token, response.status_code, response.json)
+
+
+def remember_verification(jwt_token, status_code, read_json):
+    # Cache and return the outcome of asking VERIFY_URL about a token;
+    # read_json is only called for a 200 response
+    if status_code in (401, 403):
+        token_cache.set(jwt_token, None)
+        return None
+    if status_code != 200:
+        # Don't remember failures of the auth service itself
+        return None
+    try:
+        username = read_json().get('username')
+    except (ValueError, AttributeError):
+        warning("VERIFY_URL answered 200 without a JSON object")
+        return None
+    token_cache.set(jwt_token, username)
+    return username
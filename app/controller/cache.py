@@ -0,0 +1,322 @@
+import json
+from collections import OrderedDict, namedtuple, deque
+from functools import wraps
+from hashlib import sha1
+from itertools import chain
+from logging import warning
+from os import environ
+from threading import Lock
+from time import monotonic
+from flask import request, make_response, current_app
+from sqlalchemy import event, select, insert, update, delete
+from sqlalchemy.exc import SQLAlchemyError
+from app import db
+from app.database import env_flag
+from app.models.catalog import catalog_version_row, catalog_changes
+from app.models.project import Project
+from app.models.tag import Tag
+from app.models.description import Description
+
+environment = environ
+
+CachedResponse = namedtuple('CachedResponse', ['version', 'expires', 'body', 'etag', 'mimetype'])
+
+
+class CatalogVersion:
+    """Counter bumped whenever the catalog may have changed.
+
+    Anything derived from the database (cached responses, in-memory indexes)
+    records the version it was built from and is stale once it differs. Each
+    bump also records which project ids changed, when that is known, and
+    whether tags were renamed or deleted, so indexes can catch up
+    incrementally instead of rebuilding.
+    """
+
+    def __init__(self, history=1024):
+        self.value = 0
+        self._changes = deque(maxlen=history)
+        self._lock = Lock()
+        self._listeners = []
+
+    def bump(self, changes=None, tags=False):
+        # changes: ids of the projects written, or None when unknown; tags:
+        # whether a tag was renamed or deleted, which touches every project carrying it
+        with self._lock:
+            self.value += 1
+            self._changes.append((self.value, None if changes is None else frozenset(changes), tags))
+        for listener in self._listeners:
+            listener()
+
+    def changes_since(self, version, tags=True):
+        # Ids changed after ``version``, or None if any change is unknown or
+        # forgotten; renamed or deleted tags only count as unknown with tags=True
+        with self._lock:
+            entries = [(changes, tag_writes) for bumped, changes, tag_writes in self._changes if bumped > version]
+            if len(entries) != self.value - version:
+                return None
+            if any(changes is None or (tags and tag_writes) for changes, tag_writes in entries):
+                return None
+            return set().union(*(changes for changes, _ in entries))
+
+    def subscribe(self, listener):
+        self._listeners.append(listener)
+
+
+catalog_version = CatalogVersion()
+
+
+@event.listens_for(db.session, 'after_flush')
+def _track_changes(session, flush_context):
+    changes = session.info.get('catalog_changes', set())
+    if changes is None:
+        return
+    for instance in chain(session.new, session.dirty, session.deleted):
+        if isinstance(instance, Project):
+            changes.add(instance.id)
+        elif isinstance(instance, Description):
+            changes.add(instance.project_id)
+        elif isinstance(instance, Tag) and instance not in session.new:
+            # Renaming or deleting a tag touches every project carrying it
+            session.info['catalog_tag_writes'] = True
+    session.info['catalog_changes'] = changes
+
+
+@event.listens_for(db.session, 'do_orm_execute')
+def _track_core_writes(orm_execute_state):
+    # INSERT/UPDATE/DELETE statements bypass the flush; new tag rows alone
+    # don't change any project
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        if getattr(orm_execute_state.statement, 'table', None) is not Tag.__table__:
+            orm_execute_state.session.info['catalog_core_writes'] = True
+
+
+class CatalogSync:
+    """Carries catalog versions across worker processes through the database.
+
+    ``catalog_version`` only moves in the process that committed a write.
+    With the sync on, each such commit also increments the shared
+    ``catalog_version`` row and logs the project ids it changed and whether
+    it renamed or deleted tags, in the same transaction; before a request a process applies the versions the others
+    committed since it last looked. It looks at most every ``interval``
+    seconds, so another worker's write may go unseen, and cached answers
+    from before it may be served, for up to that long.
+    """
+
+    def __init__(self, enabled=False, history=1024, interval=1.0):
+        self.enabled = enabled
+        self.history = history
+        self.interval = interval
+        self.synced = None
+        self._checked = None
+        self._own = set()
+        self._lock = Lock()
+
+    def record(self, connection, changes, tags=False):
+        # Runs inside the writing transaction; returns the shared version it committed as
+        counter = catalog_version_row.c
+        if not connection.execute(update(catalog_version_row).where(counter.id == 1).values(value=counter.value + 1)).rowcount:
+            connection.execute(insert(catalog_version_row).values(id=1, value=1))
+        version = connection.scalar(select(counter.value).where(counter.id == 1))
+        project_ids = None if changes is None else json.dumps(sorted(changes))
+        connection.execute(insert(catalog_changes).values(version=version, project_ids=project_ids, tags=tags))
+        connection.execute(delete(catalog_changes).where(catalog_changes.c.version <= version - self.history))
+        return version
+
+    def committed(self, version):
+        # This process already bumped for its own writes
+        with self._lock:
+            self._own.add(version)
+
+    def due(self):
+        # Whether sync() would look at the shared version now
+        return self.enabled and (self._checked is None or monotonic() - self._checked >= self.interval)
+
+    def sync(self):
+        # before_request hook; the first call only records where this process starts
+        if not self.due():
+            return
+        self._checked = monotonic()
+        try:
+            with db.engine.connect() as connection:
+                current = connection.scalar(select(catalog_version_row.c.value).where(catalog_version_row.c.id == 1)) or 0
+                if current == self.synced:
+                    return
+                with self._lock:
+                    synced = self.synced
+                    if synced is None or current == synced:
+                        self.synced = current
+                        return
+                    changes, tags = (None, True) if current < synced else self._changes(connection, synced, current)
+                    self.synced = current
+                    self._own = {version for version in self._own if version > current}
+        except SQLAlchemyError as error:
+            warning(f"Catalog sync skipped: {error}")
+            return
+        if changes is None or changes or tags:
+            catalog_version.bump(changes, tags)
+
+    def _changes(self, connection, synced, current):
+        # (ids the other processes changed in (synced, current], None if unknown
+        # or pruned; whether they renamed or deleted tags)
+        rows = connection.execute(select(catalog_changes).where(
+            catalog_changes.c.version > synced, catalog_changes.c.version <= current)).all()
+        if len(rows) < current - synced:
+            return None, True
+        changes, tags = set(), False
+        for version, project_ids, tag_writes in rows:
+            if version in self._own:
+                continue
+            if project_ids is None:
+                return None, True
+            changes.update(json.loads(project_ids))
+            tags = tags or tag_writes
+        return changes, tags
+
+
+catalog_sync = CatalogSync(enabled=env_flag("CATALOG_SYNC", False),
+                           interval=float(environment.get("CATALOG_SYNC_INTERVAL", 1)))
+
+
+def _written(info):
+    # What the transaction changed: project ids, an empty set, or None when unknown.
+    # The model methods flag the projects their Core statements touch, so Core
+    # writes without a flushed project are unknown (backfills, seeding)
+    changes = info.get('catalog_changes', set())
+    if info.get('catalog_core_writes') and not changes:
+        return None
+    return changes
+
+
+@event.listens_for(db.session, 'before_commit')
+def _share_changes(session):
+    if not catalog_sync.enabled:
+        return
+    session.flush()
+    changes, tags = _written(session.info), session.info.get('catalog_tag_writes', False)
+    if changes is None or changes or tags:
+        session.info['catalog_shared_version'] = catalog_sync.record(session.connection(), changes, tags)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _bump_on_commit(session):
+    # A commit that wrote nothing relevant doesn't bump at all
+    changes, tags = _written(session.info), session.info.get('catalog_tag_writes', False)
+    shared = session.info.pop('catalog_shared_version', None)
+    _forget_changes(session)
+    if shared is not None:
+        catalog_sync.committed(shared)
+    if changes is None or changes or tags:
+        catalog_version.bump(changes, tags)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_changes(session):
+    session.info.pop('catalog_changes', None)
+    session.info.pop('catalog_core_writes', None)
+    session.info.pop('catalog_tag_writes', None)
+    session.info.pop('catalog_shared_version', None)
+
+
+class ResponseCache:
+    """LRU cache of rendered GET responses, bounded by entry count and bytes."""
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024, ttl=0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.version != version or (entry.expires and entry.expires < monotonic()):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, version, body, etag, mimetype):
+        if len(body) > self.max_bytes:
+            return None
+        expires = monotonic() + self.ttl if self.ttl else None
+        entry = CachedResponse(version, expires, body, etag, mimetype)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old.body)
+            self._entries[key] = entry
+            self.size += len(body)
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted.body)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+response_cache = ResponseCache(
+    max_entries=int(environment.get("RESPONSE_CACHE_SIZE", 256)),
+    max_bytes=int(environment.get("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+    # Other processes' writes are only seen with CATALOG_SYNC on; otherwise set a TTL
+    ttl=float(environment.get("RESPONSE_CACHE_TTL", 0)),
+)
+# Every entry is stale after a write, so free the memory right away
+catalog_version.subscribe(response_cache.clear)
+
+
+def _render(entry):
+    response = current_app.response_class(entry.body, mimetype=entry.mimetype)
+    response.set_etag(entry.etag)
+    return response.make_conditional(request)
+
+
+def cached(view):
+    # Serve GET responses from the response cache with a strong ETag, answering
+    # If-None-Match with 304 and rebuilding only after the catalog changes
+    @wraps(view)
+    def decorated_function(*args, **kwargs):
+        if not response_cache.enabled:
+            return view(*args, **kwargs)
+        key = (request.path, tuple(sorted(request.args.items(multi=True))))
+        version = catalog_version.value
+        entry = response_cache.get(key, version)
+        if entry is None:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed:
+                return response
+            body = response.get_data()
+            etag = sha1(body).hexdigest()
+            entry = response_cache.put(key, version, body, etag, response.mimetype)
+            if entry is None:
+                response.set_etag(etag)
+                return response.make_conditional(request)
+        return _render(entry)
+
+    return decorated_function
+
+
+def invalidates_cache(view):
+    @wraps(view)
+    def decorated_function(*args, **kwargs):
+        try:
+            return view(*args, **kwargs)
+        finally:
+            # The commit already recorded what changed; this only drops cached responses
+            catalog_version.bump(changes=())
+
+    return decorated_function
@@ -0,0 +1,59 @@
+from abc import ABC, abstractmethod
+from threading import RLock
+from app import db
+from app.controller.cache import catalog_version
+
+
+class CatalogIndex(ABC):
+    """Base for in-memory indexes derived from the catalog.
+
+    ``refresh()`` brings the index up to the current catalog version: projects
+    whose changes are known are removed and re-read, anything else triggers a
+    full rebuild. Subclasses implement ``_clear``, ``_load`` and ``_remove``
+    and hold ``self._lock`` while reading their structures; those that don't
+    read tag names set ``reads_tags`` to False and skip tag renames and
+    deletes.
+    """
+
+    reads_tags = True
+
+    def __init__(self):
+        self.version = None
+        self._lock = RLock()
+
+    def reset(self):
+        # Force a full rebuild on the next refresh
+        with self._lock:
+            self.version = None
+
+    def refresh(self):
+        version = catalog_version.value
+        if self.version == version:
+            return
+        with self._lock:
+            if self.version == version:
+                return
+            changed = None if self.version is None else catalog_version.changes_since(self.version, self.reads_tags)
+            # Read through a fresh connection so the request's transaction snapshot doesn't matter
+            with db.engine.connect() as connection:
+                if changed is None:
+                    self._clear()
+                    self._load(connection, None)
+                elif changed:
+                    for project_id in changed:
+                        self._remove(project_id)
+                    self._load(connection, changed)
+            self.version = version
+
+    @abstractmethod
+    def _clear(self):
+        pass
+
+    @abstractmethod
+    def _load(self, connection, project_ids):
+        # project_ids is None for a full load
+        pass
+
+    @abstractmethod
+    def _remove(self, project_id):
+        pass
@@ -1,21 +1,30 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app, stream_with_context
 from functools import wraps
-import requests
-from re import sub
+from re import sub, match
+import json
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
 from app import db
 from os import environ
 
 from app.models.project import Project
-from app.models.tag import Tag
-from app.models.description import Description
-from logging import warning
+from app.models.tag import Tag, project_tags
+from app.models.project import dump_snapshot
+from app.controller.auth import verify_token
+from app.controller.cache import cached, invalidates_cache, catalog_sync
+from app.controller.pagination import PaginationError, page_args, paginate, encode_cursor, DEFAULT_PAGE_SIZE
+from app.controller.search import search_index, highlight, tokenize
+from app.controller.tag_index import tag_index
+from app.controller.fieldsets import FieldsetError, fieldset, FULL
+from app.controller.routing import read_only, stick_to_primary, release_replica
+from app.instrumentation import timed
 
 # Create a Blueprint for the controller
 controller_bp = Blueprint('controller', __name__)
 
 environment = environ
-VERIFY_URL = environment["VERIFY_URL"]
-ADMIN_LIST = set(environment["ADMIN_LIST"].split(","))
+BULK_MAX_ITEMS = int(environment.get("BULK_MAX_ITEMS", 1000))
+STREAM_BATCH_SIZE = int(environment.get("STREAM_BATCH_SIZE", 500))
 
 def check_admin_permission(f):
     @wraps(f)
@@ -23,15 +32,14 @@ def check_admin_permission(f):
         # Get the JWT token from the Authorization header
         jwt_token = request.headers.get('Authorization', '')
 
-        # Verify the JWT token with the authentication service
-        response = requests.get(VERIFY_URL, headers={'Authorization': f'{jwt_token}'})
-        if response.status_code != 200:
+        # Verify the JWT token with the authentication service (cached per token)
+        with timed("auth"):
+            username = verify_token(jwt_token)
+        if not username:
             return jsonify({"error": "Unauthorized"}), 401
-        data = response.json()
-        username = data.get('username')
 
         # Check if the username exists in the admin list
-        if username and username in ADMIN_LIST:
+        if username and username in current_app.config['ADMIN_LIST']:
             return f(*args, **kwargs)
 
         # If the JWT is invalid or the user is not an admin, return an error response
@@ -39,6 +47,72 @@ def check_admin_permission(f):
     return decorated_function
 
 
+# Pick up writes other worker processes committed
+controller_bp.before_request(catalog_sync.sync)
+controller_bp.after_request(stick_to_primary)
+controller_bp.teardown_request(release_replica)
+
+
+@controller_bp.errorhandler(PaginationError)
+@controller_bp.errorhandler(FieldsetError)
+def handle_query_error(error):
+    return jsonify({"message": str(error)}), 400
+
+
+def project_reader(fields):
+    # (query, render): full payloads are the stored snapshots, read from the
+    # project table with their tags joined in by one more query; sparse ones
+    # are serialized from just the columns and relationships they need.
+    # render turns rows into JSON texts
+    if fields == FULL:
+        return Project.snapshot_query(), timed("serialize")(Project.render_snapshots)
+    return Project.with_relations(*fields), timed("serialize")(lambda rows: [dump_snapshot(data) for data in Project.serialize_many(rows, *fields)])
+
+
+def json_response(body):
+    return current_app.response_class(body + "\n", mimetype="application/json")
+
+
+def list_response(texts):
+    return json_response("[" + ",".join(texts) + "]")
+
+
+def project_page_response(texts, next_cursor):
+    # {"items": [...], "next": cursor} assembled from already encoded projects
+    return json_response('{"items":[' + ",".join(texts) + '],"next":' + dump_snapshot(next_cursor) + "}")
+
+
+def wants_stream():
+    if request.args.get('stream') not in ('1', 'true'):
+        return False
+    if page_args():
+        raise PaginationError("stream can't be combined with limit or cursor")
+    return True
+
+
+def stream_projects(query, render):
+    # Emit a JSON array while walking the query in keyset batches, dropping
+    # each batch from the session once it is written so memory stays flat.
+    # Returns None when there are no rows at all, before anything is sent
+    projects, next_cursor = paginate(query, Project.id, STREAM_BATCH_SIZE)
+    if not projects:
+        return None
+
+    def generate(projects, next_cursor):
+        separator = '['
+        while True:
+            yield separator + ','.join(render(projects))
+            separator = ','
+            after = projects[-1].id
+            db.session.expunge_all()
+            if not next_cursor:
+                break
+            projects, next_cursor = paginate(query, Project.id, STREAM_BATCH_SIZE, after)
+        yield ']'
+
+    return current_app.response_class(stream_with_context(generate(projects, next_cursor)), mimetype='application/json')
+
+
 @controller_bp.route('/admin', methods=['GET'])
 @check_admin_permission
 def check_admin():
@@ -47,85 +121,294 @@ def check_admin():
 #CREATE
 @controller_bp.route('/', methods=['POST'])
 @check_admin_permission
+@invalidates_cache
 def create_project():
     data = request.get_json()
     title, overview = data.get('title'), data.get('overview')
-    if not (title and overview):
-        return jsonify({"message":"Project must include a title and overview"}), 400
+    error = _text_error(data) or _list_error(data) or _date_error(data)
+    if error:
+        return jsonify({"message": error}), 400
+    if title_taken(title):
+        return TITLE_TAKEN
+    # Tags are resolved (and missing ones created) in one batch by the constructor
     project = Project(
         title=title,
         github_link=data.get('github_link'),
         overview=overview,
         start_date=data.get('start_date'),
-        end_date=data.get('end_date')
+        end_date=data.get('end_date'),
+        tags=data.get("tags", []),
+        descriptions=data.get("description", []),
     )
-
-    for tag_name in data.get("tags", []):
-        tag = Tag.query.filter_by(name=tag_name).first()
-        if not tag:
-            tag = Tag(name=tag_name)
-            tag.save()
-        project.tags.append(tag)
-
-    # Add descriptions to the project if any are provided
-    for description_text in data.get("description", []):
-        description = Description(description=description_text, project=project)
-        project.descriptions.append(description)
     # Save the project to the database
-    project.save()
+    try:
+        project.save()
+    except IntegrityError:
+        # Another request created the same slug after our check
+        db.session.rollback()
+        return TITLE_TAKEN
 
     return jsonify(project.serialize()), 201  # Return the created project with status code 201
 
 
+TITLE_TAKEN = {"message": "A project with this title already exists"}, 409
+
+
+def title_taken(title, project_id=None):
+    query = Project.query.filter(Project.slug == Project.slugify(title))
+    if project_id is not None:
+        query = query.filter(Project.id != project_id)
+    return db.session.query(query.exists()).scalar()
+
+
+def _read_bulk_items():
+    # Yields (item, error) for a JSON array body or an NDJSON stream
+    if request.mimetype == 'application/x-ndjson':
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line), None
+            except ValueError:
+                yield None, "Line is not valid JSON"
+        return
+    data = request.get_json(silent=True)
+    if not isinstance(data, list):
+        raise ValueError("Body must be a JSON array or NDJSON")
+    for item in data:
+        yield item, None
+
+
+def _validate_bulk_item(item):
+    if not isinstance(item, dict):
+        return "Project must be a JSON object"
+    return _text_error(item) or _list_error(item) or _date_error(item)
+
+
+def _text_error(data, partial=False):
+    # title and overview are required non-blank strings; an update may leave them out
+    keys = [key for key in ('title', 'overview') if not partial or key in data]
+    if not partial and not all(data.get(key) for key in keys):
+        return "Project must include a title and overview"
+    if not all(isinstance(data[key], str) and data[key].strip() for key in keys):
+        return "Title and overview must be non-empty strings"
+    return None
+
+
+def _list_error(data, keys=('tags', 'description')):
+    # tags and descriptions are optional lists of non-empty strings
+    for key in keys:
+        values = data.get(key, [])
+        if not (isinstance(values, list) and all(isinstance(value, str) and value for value in values)):
+            return f"{key} must be a list of strings"
+    return None
+
+
+def _date_error(data):
+    # start_date and end_date are optional yyyy-mm or yyyy-mm-dd strings naming a real day
+    for key in ('start_date', 'end_date'):
+        value = data.get(key)
+        if value is None:
+            continue
+        try:
+            if not (isinstance(value, str) and match(r'^\d{4}-\d{2}(-\d{2})?$', value)):
+                raise ValueError(value)
+            Project._complete_date(value)
+        except (ValueError, TypeError):
+            return f"{key} must look like yyyy-mm or yyyy-mm-dd"
+    return None
+
+
+@controller_bp.route('/bulk', methods=['POST'])
+@check_admin_permission
+@invalidates_cache
+def create_projects_bulk():
+    valid, errors = [], []
+    try:
+        for index, (item, error) in enumerate(_read_bulk_items()):
+            if index >= BULK_MAX_ITEMS:
+                return jsonify({"message": f"At most {BULK_MAX_ITEMS} projects per request"}), 413
+            error = error or _validate_bulk_item(item)
+            if error:
+                errors.append({"index": index, "message": error})
+            else:
+                valid.append((index, item))
+    except ValueError as error:
+        return jsonify({"message": str(error)}), 400
+
+    # Titles must map to distinct slugs, both within the batch and against the table
+    slugs = [Project.slugify(item['title']) for _, item in valid]
+    taken = set()
+    if slugs:
+        taken = {slug for (slug,) in db.session.query(Project.slug).filter(Project.slug.in_(slugs))}
+    accepted = []
+    for (index, item), slug in zip(valid, slugs):
+        if slug in taken:
+            errors.append({"index": index, "message": TITLE_TAKEN[0]["message"]})
+        else:
+            taken.add(slug)
+            accepted.append((index, item))
+    errors.sort(key=lambda error: error["index"])
+    valid = accepted
+
+    created = []
+    if valid:
+        try:
+            ids = Project.bulk_create([item for _, item in valid])
+        except IntegrityError:
+            db.session.rollback()
+            return TITLE_TAKEN
+        created = [{"index": index, "id": project_id, "title": item['title']}
+                   for (index, item), project_id in zip(valid, ids)]
+    if not created:
+        return jsonify({"created": created, "errors": errors}), 400
+    # 207 tells the client that part of the batch was rejected
+    return jsonify({"created": created, "errors": errors}), 207 if errors else 201
+
+
 #READ
 # Define routes and their corresponding functions
 @controller_bp.route('/', methods=['GET'])
+@cached
+@read_only
 def get_projects():
-    # Retrieve all projects from the database
-    projects = Project.query.all()
-    # Serialize the projects to JSON and return the response
-    return jsonify([project.serialize() for project in projects])
+    # Full payloads come from the stored snapshots
+    query, render = project_reader(fieldset(Project.FIELDS))
+    if wants_stream():
+        return stream_projects(query, render) or jsonify([])
+    page = page_args()
+    if page:
+        projects, next_cursor = paginate(query, Project.id, *page)
+        return project_page_response(render(projects), next_cursor)
+    return list_response(render(query.all()))
 
 @controller_bp.route('find/<string:title>', methods=['GET'])
+@cached
+@read_only
 def get_project_by_title(title):
-    title = sub(r'_+', '_', title)
-    # Retrieve the project that matches the formatted title
-    project = Project.query.filter(Project.title.like(title)).first()
+    # Retrieve the project through the unique slug index
+    query, render = project_reader(fieldset(Project.FIELDS))
+    project = query.filter(Project.slug == Project.slugify(title)).first()
 
     if project:
-        # Serialize the project to JSON and return the response
-        return jsonify(project.serialize())
+        return json_response(render([project])[0])
     else:
         return jsonify({"message": "Project not found"}), 404
 
 
+@controller_bp.route('/search', methods=['GET'])
+@cached
+def search_projects():
+    query = request.args.get('q', '')
+    if not tokenize(query):
+        return jsonify({"message": "Query parameter q is required"}), 400
+    fields = fieldset(Project.FIELDS)
+    # The cursor of a search page is the offset into the ranked results
+    limit, offset = page_args() or (DEFAULT_PAGE_SIZE, None)
+    offset = offset or 0
+    ranked, total = search_index.search(query, limit, offset)
+
+    # Highlighting reads the text columns whatever the client asked for
+    load_fields = fields.fields and tuple(set(fields.fields) | {'title', 'overview', 'description'})
+    projects = Project.with_relations(load_fields, fields.tag_projects).filter(Project.id.in_([project_id for project_id, _ in ranked]))
+    projects = {project.id: project for project in projects}
+    with timed("serialize"):
+        items = [
+            {"project": projects[project_id].serialize(*fields), "score": round(score, 4),
+             "highlights": highlight(projects[project_id], query)}
+            for project_id, score in ranked if project_id in projects
+        ]
+    next_cursor = encode_cursor(offset + limit) if offset + limit < total else None
+    return jsonify({"items": items, "next": next_cursor, "total": total})
+
+
 @controller_bp.route('/tag/<string:tag_name>', methods=['GET'])
+@cached
+@read_only
 def get_projects_by_tag(tag_name):
     tag_name = sub(r'_+', '_', tag_name)
     # Retrieve projects that have the specified tag
     tag = Tag.query.filter(Tag.name.like(tag_name)).first()
     if not tag:
         return jsonify({"message": "No tags found with the specified name"}), 404
-    if not tag.projects:
+    query, render = project_reader(fieldset(Project.FIELDS))
+    query = query.filter(Project.id.in_(select(project_tags.c.project_id).where(project_tags.c.tag_id == tag.id)))
+    if wants_stream():
+        response = stream_projects(query, render)
+        if response:
+            return response
+        return jsonify({"message": "No projects found with the specified tag"}), 404
+    page = page_args()
+    if page:
+        projects, next_cursor = paginate(query, Project.id, *page)
+        if projects or page[1] is not None:
+            return project_page_response(render(projects), next_cursor)
+    else:
+        projects = query.all()
+    if not projects:
         return jsonify({"message": "No projects found with the specified tag"}), 404
-    return jsonify([project.serialize() for project in tag.projects])
+    return list_response(render(projects))
 
 
 @controller_bp.route('/tags', methods=['GET'])
+@cached
+@read_only
 def get_tags_with_projects():
-    # Retrieve all tags that have at least one project associated with them
-    tags_with_projects = Tag.query.filter(Tag.projects.any()).all()
+    # Retrieve all tags that have at least one project associated with them,
+    # together with their project titles, in a single query
+    fields = fieldset(Tag.FIELDS).fields
+    page = page_args()
+    if page:
+        tags_with_projects, last_id = Tag.in_use(fields, *page)
+        if tags_with_projects or page[1] is not None:
+            next_cursor = encode_cursor(last_id) if last_id is not None else None
+            return jsonify({"items": tags_with_projects, "next": next_cursor})
+    else:
+        tags_with_projects, _ = Tag.in_use(fields)
 
     if tags_with_projects:
-        # Serialize the tags to JSON and return the response
-        return jsonify([tag.serialize() for tag in tags_with_projects])
+        return jsonify(tags_with_projects)
     else:
         return jsonify({"message": "No tags with projects found"}), 404
 
 
+@controller_bp.route('/tags/facets', methods=['GET'])
+@cached
+@read_only
+def get_tag_facets():
+    # Project count per tag for the tag cloud, from one grouped query
+    facets = [{"id": tag_id, "name": name, "count": count} for tag_id, name, count in Tag.facets()]
+    return jsonify(facets)
+
+
+@controller_bp.route('/tags/query', methods=['GET'])
+@cached
+def query_projects_by_tags():
+    # Projects carrying every tag in all=, at least one in any= and none in none=
+    def names(key):
+        return [name for name in request.args.get(key, '').split(',') if name.strip()]
+    all_tags, any_tags, no_tags = names('all'), names('any'), names('none')
+    if not (all_tags or any_tags or no_tags):
+        return jsonify({"message": "Provide at least one of all, any or none"}), 400
+
+    query, render = project_reader(fieldset(Project.FIELDS))
+    page = page_args()
+    if page:
+        limit, after = page
+        ids, more = tag_index.query(all_tags, any_tags, no_tags, limit=limit, after=after)
+    else:
+        ids, more = tag_index.query(all_tags, any_tags, no_tags)
+    projects = query.filter(Project.id.in_(ids)).order_by(Project.id).all() if ids else []
+    if page:
+        return project_page_response(render(projects), encode_cursor(ids[-1]) if more else None)
+    return list_response(render(projects))
+
+
 #UPDATE
 @controller_bp.route('/<int:project_id>', methods=['PUT'])
 @check_admin_permission
+@invalidates_cache
 def update_project(project_id):
     # Retrieve the project from the database by its ID
     project = Project.query.filter(Project.id==project_id).first()
@@ -135,12 +418,18 @@ def update_project(project_id):
     data = request.json
     if not data:
         return jsonify({"message": "Body not readable"}), 400 
+    error = _text_error(data, partial=True) or _list_error(data, ('tags', 'descriptions')) or _date_error(data)
+    if error:
+        return jsonify({"message": error}), 400
+    if data.get('title') and title_taken(data['title'], project.id):
+        return TITLE_TAKEN
     project.update(args=data)
     return jsonify({"message": project.serialize()}), 200
 
 
 @controller_bp.route('/tag/<int:tag_id>', methods=['PUT'])
 @check_admin_permission
+@invalidates_cache
 def update_tag(tag_id):
     # Retrieve the tag from the database by its ID
     tag = db.session.get(Tag, tag_id)
@@ -162,6 +451,7 @@ def update_tag(tag_id):
 #DELETE
 @controller_bp.route('/<int:project_id>', methods=['DELETE'])
 @check_admin_permission
+@invalidates_cache
 def delete_project(project_id):
     # Retrieve the project by its ID
     project = db.session.get(Project, project_id)
@@ -177,6 +467,7 @@ def delete_project(project_id):
 
 @controller_bp.route('/tag/<string:tag_name>', methods=['DELETE'])
 @check_admin_permission
+@invalidates_cache
 def delete_tag(tag_name):
     # Retrieve the tag by its ID
     tag = Tag.query.filter(Tag.name.like(tag_name)).first()
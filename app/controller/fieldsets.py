@@ -0,0 +1,41 @@
+from collections import namedtuple
+from flask import request
+
+# fields: keys to serialize, None for the full payload; tag_projects: whether
+# tags nested in a project list their projects' titles
+Fieldset = namedtuple('Fieldset', ['fields', 'tag_projects'])
+FULL = Fieldset(None, True)
+INCLUDES = ('tags.projects',)
+
+
+class FieldsetError(ValueError):
+    pass
+
+
+def _names(value):
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+def fieldset(allowed, args=None):
+    # Parse ?fields= and ?include= against the keys a resource can produce.
+    # Without either parameter the payload is unchanged; once a client asks
+    # for a sparse payload, nested tag -> project lists are opt-in via
+    # include=tags.projects. args defaults to the current request's
+    args = request.args if args is None else args
+    fields, include = args.get('fields'), args.get('include')
+    if fields is None and include is None:
+        return FULL
+
+    selected = tuple(allowed)
+    if fields is not None:
+        names = _names(fields)
+        unknown = [name for name in names if name not in allowed]
+        if unknown or not names:
+            raise FieldsetError(f"Unknown fields: {', '.join(unknown) or fields!r}; choose from {', '.join(allowed)}")
+        selected = tuple(name for name in allowed if name in names)
+
+    includes = _names(include or '')
+    unknown = [name for name in includes if name not in INCLUDES]
+    if unknown:
+        raise FieldsetError(f"Unknown include: {', '.join(unknown)}; choose from {', '.join(INCLUDES)}")
+    return Fieldset(selected, 'tags.projects' in includes)
@@ -0,0 +1,58 @@
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from binascii import Error as DecodeError
+from os import environ
+from flask import request
+import json
+
+environment = environ
+DEFAULT_PAGE_SIZE = int(environment.get("DEFAULT_PAGE_SIZE", 50))
+MAX_PAGE_SIZE = int(environment.get("MAX_PAGE_SIZE", 500))
+# Largest id a BIGINT column (and the database drivers) can take
+MAX_ID = 2 ** 63 - 1
+
+
+class PaginationError(ValueError):
+    pass
+
+
+def encode_cursor(last_id):
+    return urlsafe_b64encode(json.dumps([last_id]).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        (last_id,) = json.loads(urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (DecodeError, ValueError, TypeError):
+        raise PaginationError("Invalid cursor")
+    # Ids are non-negative 64-bit integers; True is an int too
+    if isinstance(last_id, bool) or not isinstance(last_id, int) or not 0 <= last_id <= MAX_ID:
+        raise PaginationError("Invalid cursor")
+    return last_id
+
+
+def page_args(args=None):
+    # Returns (limit, after_id), or None when the client didn't ask for a page
+    args = request.args if args is None else args
+    limit, cursor = args.get('limit'), args.get('cursor')
+    if limit is None and cursor is None:
+        return None
+    try:
+        limit = int(limit) if limit is not None else DEFAULT_PAGE_SIZE
+    except ValueError:
+        raise PaginationError("limit must be an integer")
+    if limit < 1:
+        raise PaginationError("limit must be positive")
+    return min(limit, MAX_PAGE_SIZE), decode_cursor(cursor) if cursor else None
+
+
+def paginate(query, key, limit, after=None):
+    # Keyset pagination: seek past the last key instead of using OFFSET, so
+    # every page is an index range scan of the same size
+    if after is not None:
+        query = query.filter(key > after)
+    rows = query.order_by(key).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].id)
+    return rows, next_cursor
@@ -0,0 +1,68 @@
+from functools import wraps
+from os import environ
+from time import time, monotonic
+from flask import request
+from sqlalchemy.exc import OperationalError
+from app import db
+from app.database import replicas
+from app.controller.cache import catalog_version
+
+environment = environ
+
+# After a write, its author reads from the primary for this long (cookie) and
+# so does this process, so responses it caches don't come from a lagging replica
+STICKY_SECONDS = float(environment.get("REPLICA_STICKY_SECONDS", 5))
+STICKY_COOKIE = "primary_until"
+_last_write = [float("-inf")]
+
+
+def _note_write():
+    _last_write[0] = monotonic()
+
+
+catalog_version.subscribe(_note_write)
+
+
+def _sticky():
+    if monotonic() - _last_write[0] < STICKY_SECONDS:
+        return True
+    try:
+        return float(request.cookies.get(STICKY_COOKIE, 0)) > time()
+    except ValueError:
+        return False
+
+
+def read_only(view):
+    # Run a read-only route against a replica when one is configured and the
+    # client hasn't just written; if the replica fails the route is retried
+    # on the primary and the replica is skipped for a while
+    @wraps(view)
+    def decorated_function(*args, **kwargs):
+        replica = replicas.choose() if replicas and not _sticky() else None
+        if replica is None:
+            return view(*args, **kwargs)
+        db.session.info['replica'] = replica
+        try:
+            return view(*args, **kwargs)
+        except OperationalError:
+            db.session.rollback()
+            db.session.info.pop('replica', None)
+            replicas.mark_down(replica)
+            return view(*args, **kwargs)
+
+    return decorated_function
+
+
+def stick_to_primary(response):
+    # after_request hook: send the author of a successful write to the primary for a while
+    if replicas and request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+        response.set_cookie(STICKY_COOKIE, str(int(time() + STICKY_SECONDS) + 1), max_age=int(STICKY_SECONDS) + 1,
+                            httponly=True, samesite='Lax')
+    return response
+
+
+def release_replica(exception=None):
+    # teardown_request hook; runs after a streamed body is finished, so every
+    # batch of a stream reads from the same replica
+    if db.session.info.pop('replica', None) is not None:
+        db.session.rollback()
@@ -0,0 +1,131 @@
+from collections import defaultdict
+from heapq import nlargest
+from math import log
+import re
+from markupsafe import escape
+from sqlalchemy import select
+from app.models.project import Project
+from app.models.description import Description
+from app.controller.catalog_index import CatalogIndex
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+# Matches in a title count for more than matches in the body text
+FIELD_WEIGHTS = {"title": 3.0, "overview": 1.0, "description": 1.0}
+SNIPPET_LENGTH = 160
+
+
+def tokenize(text):
+    return [token.lower() for token in TOKEN_RE.findall(text or "")]
+
+
+class SearchIndex(CatalogIndex):
+    """In-process inverted index over project titles, overviews and descriptions.
+
+    Postings map each term to the weighted term frequency per project id, so a
+    query only touches the posting lists of its own terms. The index follows
+    the catalog version: after a write it re-reads just the projects that
+    changed, or everything when the change isn't known. Tags aren't indexed,
+    so renaming or deleting one changes nothing here.
+    """
+
+    reads_tags = False
+
+    def __init__(self):
+        super().__init__()
+        self._postings = defaultdict(dict)
+        self._doc_terms = {}
+
+    def __len__(self):
+        return len(self._doc_terms)
+
+    def _clear(self):
+        self._postings.clear()
+        self._doc_terms.clear()
+
+    def _load(self, connection, project_ids):
+        projects = select(Project.id, Project.title, Project.overview)
+        descriptions = select(Description.project_id, Description.description)
+        if project_ids is not None:
+            projects = projects.where(Project.id.in_(project_ids))
+            descriptions = descriptions.where(Description.project_id.in_(project_ids))
+        weights = defaultdict(lambda: defaultdict(float))
+        for project_id, title, overview in connection.execute(projects):
+            document = weights[project_id]
+            for field, text in (("title", title), ("overview", overview)):
+                for term in tokenize(text):
+                    document[term] += FIELD_WEIGHTS[field]
+        for project_id, text in connection.execute(descriptions):
+            if project_id in weights:
+                for term in tokenize(text):
+                    weights[project_id][term] += FIELD_WEIGHTS["description"]
+        for project_id, terms in weights.items():
+            for term, weight in terms.items():
+                self._postings[term][project_id] = weight
+            self._doc_terms[project_id] = tuple(terms)
+
+    def _remove(self, project_id):
+        for term in self._doc_terms.pop(project_id, ()):
+            postings = self._postings[term]
+            postings.pop(project_id, None)
+            if not postings:
+                del self._postings[term]
+
+    def search(self, query, limit, offset=0):
+        # Returns ([(project_id, score)], total) ranked by tf-idf, best first
+        self.refresh()
+        terms = list(dict.fromkeys(tokenize(query)))
+        with self._lock:
+            total_docs = len(self._doc_terms) or 1
+            scores = defaultdict(float)
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = log(1 + total_docs / len(postings))
+                for project_id, weight in postings.items():
+                    scores[project_id] += (1 + log(weight)) * idf
+        ranked = nlargest(offset + limit, scores.items(), key=lambda item: (item[1], -item[0]))
+        return ranked[offset:], len(scores)
+
+
+search_index = SearchIndex()
+
+
+def _term_pattern(query):
+    terms = sorted(set(tokenize(query)), key=len, reverse=True)
+    if not terms:
+        return None
+    return re.compile(r"\b(" + "|".join(re.escape(term) for term in terms) + r")\b", re.IGNORECASE | re.UNICODE)
+
+
+def _mark(text, pattern):
+    # HTML-escape the text and wrap every query term in <mark>; split() puts
+    # the matched terms at the odd positions
+    parts = pattern.split(text)
+    return "".join(f"<mark>{escape(part)}</mark>" if i % 2 else str(escape(part)) for i, part in enumerate(parts))
+
+
+def _snippet(text, pattern):
+    found = pattern.search(text)
+    if not found:
+        return None
+    start = max(0, found.start() - SNIPPET_LENGTH // 3)
+    snippet = text[start:start + SNIPPET_LENGTH]
+    return ("…" if start else "") + _mark(snippet, pattern) + ("…" if start + SNIPPET_LENGTH < len(text) else "")
+
+
+def highlight(project, query):
+    pattern = _term_pattern(query)
+    if pattern is None:
+        return {}
+    highlights = {}
+    if pattern.search(project.title):
+        highlights["title"] = _mark(project.title, pattern)
+    overview = _snippet(project.overview, pattern)
+    if overview:
+        highlights["overview"] = overview
+    descriptions = [_snippet(d.description, pattern) for d in project.descriptions]
+    descriptions = [d for d in descriptions if d]
+    if descriptions:
+        highlights["description"] = descriptions
+    return highlights
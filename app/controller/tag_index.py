@@ -0,0 +1,118 @@
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from heapq import merge
+from itertools import groupby, islice
+from sqlalchemy import select
+from app.models.project import Project
+from app.models.tag import Tag, project_tags
+from app.controller.catalog_index import CatalogIndex
+
+
+def tag_key(name):
+    # Same leniency as the tag/<name> route: case-insensitive, "_" matches a space
+    return re.sub(r'[\s_]+', ' ', name.strip().casefold())
+
+
+def _contains(ids, project_id):
+    index = bisect_left(ids, project_id)
+    return index < len(ids) and ids[index] == project_id
+
+
+def _add(ids, new):
+    # Merges unsorted ids into a sorted array: one sort when it was empty,
+    # an insert per id otherwise
+    if not ids:
+        ids.extend(sorted(set(new)))
+        return
+    for project_id in new:
+        index = bisect_left(ids, project_id)
+        if index == len(ids) or ids[index] != project_id:
+            ids.insert(index, project_id)
+
+
+def _discard(ids, project_id):
+    index = bisect_left(ids, project_id)
+    if index < len(ids) and ids[index] == project_id:
+        del ids[index]
+
+
+def _after(ids, after):
+    # The ids of a sorted array above ``after``, in order
+    return islice(ids, 0 if after is None else bisect_right(ids, after), None)
+
+
+class TagIndex(CatalogIndex):
+    """Posting lists of project ids per tag, kept as sorted arrays.
+
+    all/any/none queries walk the smallest posting list involved and look the
+    other tags up by bisection, instead of joining over ``project_tags``. A
+    page stops once it is full, so a query costs what its posting lists and
+    page size cost, not what the whole catalog does.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._postings = {}
+        self._project_tags = {}
+        self._universe = array('q')
+
+    def _clear(self):
+        self._postings.clear()
+        self._project_tags.clear()
+        del self._universe[:]
+
+    def _load(self, connection, project_ids):
+        projects = select(Project.id)
+        links = select(project_tags.c.project_id, Tag.name).join(Tag, Tag.id == project_tags.c.tag_id)
+        if project_ids is not None:
+            projects = projects.where(Project.id.in_(project_ids))
+            links = links.where(project_tags.c.project_id.in_(project_ids))
+        loaded = []
+        for (project_id,) in connection.execute(projects):
+            loaded.append(project_id)
+            self._project_tags.setdefault(project_id, ())
+        _add(self._universe, loaded)
+        postings = {}
+        for project_id, name in connection.execute(links):
+            key = tag_key(name)
+            postings.setdefault(key, []).append(project_id)
+            self._project_tags[project_id] += (key,)
+        for key, new in postings.items():
+            _add(self._postings.setdefault(key, array('q')), new)
+
+    def _remove(self, project_id):
+        _discard(self._universe, project_id)
+        for key in self._project_tags.pop(project_id, ()):
+            ids = self._postings[key]
+            _discard(ids, project_id)
+            if not ids:
+                del self._postings[key]
+
+    def query(self, all_tags=(), any_tags=(), no_tags=(), limit=None, after=None):
+        # Returns (project ids in ascending order, whether more ids follow)
+        self.refresh()
+        empty = array('q')
+        with self._lock:
+            required = sorted((self._postings.get(tag_key(name), empty) for name in all_tags), key=len)
+            alternatives = [self._postings.get(tag_key(name), empty) for name in any_tags]
+            excluded = [self._postings.get(tag_key(name), empty) for name in no_tags]
+            # Walk the smallest list of the query and check the others per id
+            if required:
+                candidates, required = _after(required[0], after), required[1:]
+            elif alternatives:
+                candidates = (key for key, _ in groupby(merge(*(_after(ids, after) for ids in alternatives))))
+                alternatives = []
+            else:
+                candidates = _after(self._universe, after)
+            matches = (project_id for project_id in candidates
+                       if all(_contains(ids, project_id) for ids in required)
+                       and (not alternatives or any(_contains(ids, project_id) for ids in alternatives))
+                       and not any(_contains(ids, project_id) for ids in excluded))
+            ids = list(matches if limit is None else islice(matches, limit + 1))
+        if limit is None:
+            return ids, False
+        return ids[:limit], len(ids) > limit
+
+
+tag_index = TagIndex()
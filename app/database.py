@@ -0,0 +1,191 @@
+from os import environ
+from urllib.parse import quote
+from logging import info, warning
+from threading import Lock
+from time import monotonic
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+
+environment = environ
+
+# Driver used for each DB_BACKEND unless DB_DRIVER names another one
+DRIVERS = {"mysql": "pymysql", "postgresql": "psycopg2"}
+DEFAULT_PORTS = {"mysql": 3306, "postgresql": 5432}
+
+
+def env_flag(name, default):
+    # Boolean setting from the environment: 1, true, yes or on
+    value = environment.get(name)
+    return default if value is None else value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def generate_database_uri():
+    # DATABASE_URL wins; otherwise the URI is assembled from DB_BACKEND
+    # (mysql, postgresql or sqlite), DB_DRIVER and the DB_* credentials.
+    # DB_CONNECT_PORT is the port the app connects to, not the DB_PORT the
+    # compose files publish on the host
+    url = environment.get('DATABASE_URL')
+    if url:
+        return url
+    backend = environment.get('DB_BACKEND', 'mysql')
+    if backend == 'sqlite':
+        # Relative paths end up in the Flask instance folder
+        return f"sqlite:///{environment.get('DB_PATH', 'projects.db')}"
+    if backend not in DRIVERS:
+        raise ValueError(f"Unsupported DB_BACKEND {backend!r}; choose from mysql, postgresql, sqlite")
+    driver = environment.get('DB_DRIVER', DRIVERS[backend])
+    db_username = environment.get('DB_USERNAME')
+    db_password = environment.get('DB_PASSWORD')
+    db_host = environment.get('DB_HOST')
+    db_name = environment.get('DB_NAME')
+    db_port = environment.get('DB_CONNECT_PORT', DEFAULT_PORTS[backend])
+
+    # Encode the username and password as bytes
+    encoded_username = quote(db_username.encode('utf-8'), safe='')
+    encoded_password = quote(db_password.encode('utf-8'), safe='')
+    # Construct the database URI with encoded username and password
+    return f'{backend}+{driver}://{encoded_username}:{encoded_password}@{db_host}:{db_port}/{db_name}'
+
+
+def _in_memory(url):
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def engine_options(uri):
+    # SQLALCHEMY_ENGINE_OPTIONS for the URI. Size the pool so that
+    # workers * threads * (DB_POOL_SIZE + DB_MAX_OVERFLOW) stays under the
+    # server's connection limit
+    url = make_url(uri)
+    if _in_memory(url):
+        # One shared connection (Flask-SQLAlchemy uses a StaticPool), nothing to size
+        return {}
+    options = {
+        "pool_size": int(environment.get("DB_POOL_SIZE", 5)),
+        "max_overflow": int(environment.get("DB_MAX_OVERFLOW", 10)),
+        "pool_timeout": float(environment.get("DB_POOL_TIMEOUT", 30)),
+        # Recycle before the server drops idle connections (MySQL wait_timeout)
+        "pool_recycle": int(environment.get("DB_POOL_RECYCLE", 1800)),
+        "pool_pre_ping": env_flag("DB_POOL_PRE_PING", True),
+    }
+    timeout = int(environment.get("DB_STATEMENT_TIMEOUT", 0))
+    if timeout and url.get_backend_name() == 'postgresql':
+        options["connect_args"] = {"options": f"-c statement_timeout={timeout}"}
+    return options
+
+
+def configure_engine(engine):
+    # Per-connection settings, then log the pool the app ended up with
+    url = engine.url
+    backend = url.get_backend_name()
+    timeout = int(environment.get("DB_STATEMENT_TIMEOUT", 0))
+
+    if backend == 'sqlite':
+        busy_timeout = int(environment.get("DB_BUSY_TIMEOUT", 5000))
+        wal = env_flag("DB_SQLITE_WAL", True) and not _in_memory(url)
+
+        @event.listens_for(engine, "connect")
+        def _sqlite_pragmas(connection, record):
+            cursor = connection.cursor()
+            if wal:
+                # Readers don't block the writer and vice versa
+                cursor.execute("PRAGMA journal_mode=WAL")
+                cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute(f"PRAGMA busy_timeout={busy_timeout}")
+            cursor.close()
+
+        if timeout:
+            warning("DB_STATEMENT_TIMEOUT is not supported on SQLite and is ignored")
+    elif backend == 'mysql' and timeout:
+        @event.listens_for(engine, "connect")
+        def _mysql_timeout(connection, record):
+            # Only applies to SELECT statements
+            cursor = connection.cursor()
+            cursor.execute(f"SET SESSION max_execution_time={timeout}")
+            cursor.close()
+
+    info(f"Database {url.render_as_string(hide_password=True)}: {pool_status(engine)}")
+
+
+def pool_status(engine):
+    pool = engine.pool
+    status = {"pool": type(pool).__name__}
+    if hasattr(pool, "timeout"):
+        status.update(size=pool.size(), max_overflow=pool._max_overflow, timeout=pool.timeout())
+    status.update(recycle=pool._recycle, pre_ping=pool._pre_ping,
+                  statement_timeout_ms=int(environment.get("DB_STATEMENT_TIMEOUT", 0)) or None)
+    return ", ".join(f"{key}={value}" for key, value in status.items())
+
+
+class ReplicaSet:
+    """Read replicas the routing session can send read-only requests to.
+
+    ``choose()`` picks a replica round-robin, or the one with the fewest
+    checked-out connections with the ``least_loaded`` strategy. A replica
+    that failed is skipped for ``retry_after`` seconds.
+    """
+
+    def __init__(self, engines=(), strategy="round_robin", retry_after=30):
+        self.engines = list(engines)
+        self.strategy = strategy
+        self.retry_after = retry_after
+        self._down = {}
+        self._next = 0
+        self._lock = Lock()
+
+    def __bool__(self):
+        return bool(self.engines)
+
+    def configure(self, urls, strategy="round_robin", retry_after=30):
+        for engine in self.engines:
+            engine.dispose()
+        self.engines = []
+        for url in urls:
+            engine = create_engine(url, **engine_options(url))
+            configure_engine(engine)
+            self.engines.append(engine)
+        self.strategy = strategy
+        self.retry_after = retry_after
+        self._down.clear()
+
+    def choose(self):
+        # A healthy replica, or None when every replica is down
+        now = monotonic()
+        with self._lock:
+            healthy = [engine for engine in self.engines if self._down.get(engine, 0) <= now]
+            if not healthy:
+                return None
+            if self.strategy == "least_loaded":
+                return min(healthy, key=_checked_out)
+            engine = healthy[self._next % len(healthy)]
+            self._next += 1
+            return engine
+
+    def mark_down(self, engine):
+        warning(f"Replica {engine.url.render_as_string(hide_password=True)} failed, "
+                f"using the primary for {self.retry_after}s")
+        with self._lock:
+            self._down[engine] = monotonic() + self.retry_after
+
+
+def _checked_out(engine):
+    pool = engine.pool
+    return pool.checkedout() if hasattr(pool, "checkedout") else 0
+
+
+replicas = ReplicaSet()
+
+
+class RoutingSession(Session):
+    """Session that sends a read-only request's statements to a replica.
+
+    The replica is chosen per request and kept in ``session.info['replica']``
+    by the controller's ``read_only`` decorator; flushes and explicit binds
+    always go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = self.info.get('replica')
+        if replica is not None and bind is None and not self._flushing:
+            return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
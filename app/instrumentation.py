@@ -0,0 +1,111 @@
+import json
+from contextlib import contextmanager
+from logging import getLogger, StreamHandler, INFO
+from time import perf_counter
+from flask import g, request, current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = getLogger(__name__)
+
+
+class RequestTimings:
+    """Counts and durations of the phases of one request.
+
+    ``db`` is filled in by the engine events; other phases (``auth``,
+    ``serialize``) are timed by the controller with ``timed()``. Phases may
+    overlap: a lazy load during serialization counts for both.
+    """
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.phases = {}
+
+    def add(self, name, seconds):
+        count, total = self.phases.get(name, (0, 0.0))
+        self.phases[name] = (count + 1, total + seconds)
+
+    def elapsed(self):
+        return perf_counter() - self.started
+
+    def server_timing(self):
+        # Server-Timing header value, durations in milliseconds
+        metrics = [f'{name};dur={seconds * 1000:.2f};desc="{count}"' for name, (count, seconds) in self.phases.items()]
+        return ", ".join(metrics + [f"total;dur={self.elapsed() * 1000:.2f}"])
+
+    def record(self):
+        data = {"total_ms": round(self.elapsed() * 1000, 2)}
+        for name, (count, seconds) in self.phases.items():
+            data[f"{name}_count"] = count
+            data[f"{name}_ms"] = round(seconds * 1000, 2)
+        return data
+
+
+def current_timings():
+    # The timings of the request being handled, None when it isn't instrumented
+    return g.get("timings") if has_app_context() else None
+
+
+@contextmanager
+def timed(name):
+    # Time a block (or, as a decorator, a function) as a phase of the current request
+    timings = current_timings()
+    if timings is None:
+        yield
+        return
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, perf_counter() - started)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timings = current_timings()
+    if timings is not None and context is not None:
+        context._request_timing = (timings, perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_request_timing", None)
+    if started is not None:
+        timings, started = started
+        timings.add("db", perf_counter() - started)
+
+
+def start_timing():
+    # app.metrics reads the timings too
+    if current_app.config.get("REQUEST_TIMING") or current_app.config.get("METRICS"):
+        g.timings = RequestTimings()
+
+
+def add_server_timing(response):
+    # For a streamed response this only covers the work done before the first byte
+    timings = current_timings()
+    if timings is not None:
+        g.timing_status = response.status_code
+        if current_app.config.get("REQUEST_TIMING"):
+            response.headers["Server-Timing"] = timings.server_timing()
+    return response
+
+
+def log_timing(exception=None):
+    # Runs once a streamed body is finished, so the log line covers all of it
+    timings = current_timings()
+    if timings is not None and current_app.config.get("REQUEST_TIMING"):
+        line = {"method": request.method, "path": request.path, "endpoint": request.endpoint,
+                "status": g.get("timing_status", 500), **timings.record()}
+        logger.info(json.dumps(line))
+
+
+def init_app(app):
+    # Always installed; requests are only timed while app.config["REQUEST_TIMING"] or ["METRICS"] is set
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    app.before_request(start_timing)
+    app.after_request(add_server_timing)
+    app.teardown_request(log_timing)
+    if app.config.get("REQUEST_TIMING") and not logger.handlers:
+        logger.addHandler(StreamHandler())
+        logger.setLevel(INFO)
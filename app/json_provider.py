@@ -0,0 +1,37 @@
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional, responses fall back to the stdlib encoder
+    orjson = None
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """JSON provider that encodes with orjson when it is installed.
+
+    Output follows the default provider's settings (sorted keys, compact
+    separators, indentation in debug); the only difference is that non-ASCII
+    text is written as UTF-8 rather than escaped. Without orjson it is the
+    stdlib encoder unchanged.
+    """
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None:
+            return super().dumps(obj, **kwargs)
+        # Dates and dataclasses go through self.default, as with the stdlib encoder
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if kwargs.get("sort_keys", self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=kwargs.get("default", self.default), option=option).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+
+def json_provider(name):
+    # JSON_PROVIDER=stdlib keeps Flask's provider; anything else picks the fast one
+    return DefaultJSONProvider if name == "stdlib" else FastJSONProvider
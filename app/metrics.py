@@ -0,0 +1,286 @@
+import json
+from bisect import bisect_left
+from ipaddress import ip_address, ip_network
+from os import getpid, kill, listdir, makedirs, remove, replace
+from os.path import join
+from threading import Lock, local
+from time import monotonic
+from flask import g, request, current_app, abort
+from app import db
+from app.database import replicas
+from app.controller.auth import token_cache
+from app.controller.cache import response_cache
+
+# Prometheus' default latency buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+METRICS = {
+    "projects_http_requests_total": ("counter", "Requests handled, by route, method and status code."),
+    "projects_http_request_duration_seconds": ("histogram", "Time spent handling a request, by route."),
+    "projects_db_queries_total": ("counter", "SQL statements executed, by route."),
+    "projects_db_query_duration_seconds_total": ("counter", "Time spent in SQL statements, by route."),
+    "projects_auth_verify_duration_seconds": ("histogram", "Time spent verifying the token of an admin request."),
+}
+
+
+class Registry:
+    """Counters and histograms sharded per thread.
+
+    Each thread only ever updates its own shard, so recording takes no lock;
+    the lock is only taken when a thread records for the first time. A
+    scrape adds the shards up.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._local = local()
+        self._shards = []
+        self._lock = Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = ({}, {})
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def inc(self, name, labels, value=1):
+        counters = self._shard()[0]
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        # One slot per bucket plus +Inf, then the sum
+        histograms = self._shard()[1]
+        key = (name, labels)
+        entry = histograms.get(key)
+        if entry is None:
+            entry = histograms[key] = [0] * (len(self.buckets) + 2)
+        entry[bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+    def collect(self):
+        # ({(name, labels): value}, {(name, labels): [slots..., sum]}) over all threads
+        with self._lock:
+            shards = list(self._shards)
+        counters, histograms = {}, {}
+        for shard_counters, shard_histograms in shards:
+            # copy() runs without releasing the GIL, the owner can't change the dict meanwhile
+            for key, value in shard_counters.copy().items():
+                counters[key] = counters.get(key, 0) + value
+            for key, entry in shard_histograms.copy().items():
+                total = histograms.setdefault(key, [0] * len(entry))
+                for index, value in enumerate(entry):
+                    total[index] += value
+        return counters, histograms
+
+    def clear(self):
+        with self._lock:
+            for counters, histograms in self._shards:
+                counters.clear()
+                histograms.clear()
+
+
+registry = Registry()
+
+
+class SharedMetrics:
+    """Series of every worker process, exchanged through a directory.
+
+    Under gunicorn each worker has its own registry and caches, and a scrape
+    is answered by whichever worker accepts it. With a directory set, each
+    process writes its series to ``<pid>.json`` there, at most every
+    ``interval`` seconds and before it answers a scrape, and the scrape adds
+    up all the files. Files of exited workers stay so counters don't go
+    backwards when a worker is recycled; only their gauges are left out.
+    """
+
+    def __init__(self, directory=None, interval=1.0):
+        self.directory = directory
+        self.interval = interval
+        self._written = float("-inf")
+        self._lock = Lock()
+
+    def __bool__(self):
+        return self.directory is not None
+
+    def configure(self, directory, interval=1.0):
+        self.directory = directory or None
+        self.interval = interval
+        if self.directory:
+            makedirs(self.directory, exist_ok=True)
+
+    def clear(self):
+        for name in self._files():
+            remove(join(self.directory, name))
+
+    def _files(self):
+        return [name for name in listdir(self.directory) if name.endswith(".json")]
+
+    def write(self, force=False):
+        if not force and monotonic() - self._written < self.interval:
+            return
+        with self._lock:
+            self._written = monotonic()
+            counters, histograms = registry.collect()
+            data = {"counters": [[name, labels, value] for (name, labels), value in counters.items()],
+                    "histograms": [[name, labels, entry] for (name, labels), entry in histograms.items()],
+                    "gauges": list(gauges())}
+            path = join(self.directory, f"{getpid()}.json")
+            # Readers never see a half-written file
+            with open(path + ".tmp", "w") as file:
+                json.dump(data, file)
+            replace(path + ".tmp", path)
+
+    def collect(self):
+        # (counters, histograms, gauges) like registry.collect() and gauges(), over all processes;
+        # counters add up, gauges of live workers get a worker label
+        counters, histograms, rows = {}, {}, {}
+        for name in self._files():
+            try:
+                with open(join(self.directory, name)) as file:
+                    data = json.load(file)
+            except (OSError, ValueError):
+                continue
+            pid = int(name[:-len(".json")])
+            alive = _alive(pid)
+            for metric, labels, value in data["counters"]:
+                key = (metric, _key(labels))
+                counters[key] = counters.get(key, 0) + value
+            for metric, labels, entry in data["histograms"]:
+                total = histograms.setdefault((metric, _key(labels)), [0] * len(entry))
+                for index, value in enumerate(entry):
+                    total[index] += value
+            for metric, kind, description, labels, value in data["gauges"]:
+                if kind == "counter":
+                    key = (metric, kind, description, _key(labels))
+                    rows[key] = rows.get(key, 0) + value
+                elif alive:
+                    rows[(metric, kind, description, _key(labels) + (("worker", str(pid)),))] = value
+        return counters, histograms, [(*key, value) for key, value in sorted(rows.items())]
+
+
+def _key(labels):
+    # JSON turns the label tuples into lists
+    return tuple(tuple(label) for label in labels)
+
+
+def _alive(pid):
+    try:
+        kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+shared_metrics = SharedMetrics()
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def gauges():
+    # Values read at scrape time: (name, type, help, labels, value)
+    # Replicas go by their position in DATABASE_REPLICA_URLS; their URLs would leak hosts and users
+    engines = [("primary", db.engine)] + [(f"replica_{index}", engine) for index, engine in enumerate(replicas.engines)]
+    for name, engine in engines:
+        pool, labels = engine.pool, (("engine", name),)
+        # SingletonThreadPool/NullPool (SQLite) have nothing to report
+        if hasattr(pool, "checkedout"):
+            yield "projects_db_pool_checked_out", "gauge", "Connections checked out of the pool.", labels, pool.checkedout()
+            yield "projects_db_pool_size", "gauge", "Configured size of the pool.", labels, pool.size()
+            yield "projects_db_pool_overflow", "gauge", "Connections beyond the pool size; negative while the pool isn't full.", labels, pool.overflow()
+    yield "projects_response_cache_hits_total", "counter", "Response cache lookups that found a fresh entry.", (), response_cache.hits
+    yield "projects_response_cache_misses_total", "counter", "Response cache lookups that missed.", (), response_cache.misses
+    yield "projects_response_cache_entries", "gauge", "Responses held in the response cache.", (), len(response_cache)
+    yield "projects_response_cache_bytes", "gauge", "Size of the cached response bodies.", (), response_cache.size
+    yield "projects_token_cache_hits_total", "counter", "Token verifications answered from the token cache.", (), token_cache.hits
+    yield "projects_token_cache_misses_total", "counter", "Token verifications that missed the token cache.", (), token_cache.misses
+    yield "projects_token_cache_entries", "gauge", "Tokens held in the token cache.", (), len(token_cache)
+
+
+def render():
+    # The registry and the gauges in the Prometheus text exposition format
+    if shared_metrics:
+        shared_metrics.write(force=True)
+        counters, histograms, rows = shared_metrics.collect()
+    else:
+        (counters, histograms), rows = registry.collect(), gauges()
+    lines = []
+    for name, (kind, description) in METRICS.items():
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+        if kind == "counter":
+            lines += [f"{name}{_labels(labels)} {_number(value)}"
+                      for (metric, labels), value in sorted(counters.items()) if metric == name]
+            continue
+        for (metric, labels), entry in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(registry.buckets + ("+Inf",), entry[:-1]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines += [f"{name}_sum{_labels(labels)} {_number(entry[-1])}", f"{name}_count{_labels(labels)} {cumulative}"]
+    described = set()
+    for name, kind, description, labels, value in rows:
+        if name not in described:
+            described.add(name)
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+        lines.append(f"{name}{_labels(labels)} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def record_request(exception=None):
+    # teardown_request hook; reads the timings app.instrumentation collected
+    timings = g.get("timings")
+    if timings is None or not current_app.config.get("METRICS") or request.endpoint == "metrics":
+        return
+    route = request.endpoint or "unmatched"
+    registry.inc("projects_http_requests_total",
+                 (("route", route), ("method", request.method), ("status", str(g.get("timing_status", 500)))))
+    registry.observe("projects_http_request_duration_seconds", (("route", route),), timings.elapsed())
+    queries, seconds = timings.phases.get("db", (0, 0.0))
+    if queries:
+        registry.inc("projects_db_queries_total", (("route", route),), queries)
+        registry.inc("projects_db_query_duration_seconds_total", (("route", route),), seconds)
+    if "auth" in timings.phases:
+        registry.observe("projects_auth_verify_duration_seconds", (), timings.phases["auth"][1])
+    if shared_metrics:
+        shared_metrics.write()
+
+
+def _allowed(networks):
+    # An empty allow-list lets every client scrape
+    if not networks:
+        return True
+    try:
+        address = ip_address(request.remote_addr)
+    except ValueError:
+        return False
+    return any(address in ip_network(network, strict=False) for network in networks)
+
+
+def metrics_view():
+    if not current_app.config.get("METRICS"):
+        abort(404)
+    if not _allowed(current_app.config.get("METRICS_ALLOW")):
+        abort(403)
+    return current_app.response_class(render(), content_type=CONTENT_TYPE)
+
+
+def init_app(app):
+    shared_metrics.configure(app.config.get("METRICS_DIR"))
+    app.add_url_rule("/metrics", "metrics", metrics_view)
+    app.teardown_request(record_request)
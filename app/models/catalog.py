@@ -0,0 +1,17 @@
+from app import db
+
+# The catalog version shared by every worker process: a single row that
+# writes increment inside their own transaction, so the row lock numbers
+# versions in commit order
+catalog_version_row = db.Table('catalog_version',
+    db.Column('id', db.Integer, primary_key=True, autoincrement=False),
+    db.Column('value', db.Integer, nullable=False)
+)
+
+# The project ids each version changed as a JSON list, null when unknown,
+# and whether it renamed or deleted tags; only the most recent versions are kept
+catalog_changes = db.Table('catalog_change',
+    db.Column('version', db.Integer, primary_key=True, autoincrement=False),
+    db.Column('project_ids', db.Text),
+    db.Column('tags', db.Boolean, nullable=False, default=False)
+)
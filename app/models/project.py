@@ -1,17 +1,64 @@
 from app import db
 import app.models.tag as tag_ns
 from app.models.description import Description
-from sqlalchemy.orm import relationship
+from flask import current_app
+from sqlalchemy import insert, delete, update, select
+from sqlalchemy.orm import subqueryload, validates, load_only, deferred
+from sqlalchemy.orm.attributes import flag_dirty
+from functools import lru_cache
+from app.models.serializers import build_serializer, format_month
 import re
+from datetime import date
 from logging import warning
 import logging
+
+
+def dump_snapshot(data):
+    # Compact JSON, matching what jsonify sends outside debug mode
+    return current_app.json.dumps(data, separators=(',', ':'))
+
+
+def _unique(tags):
+    # Drop repeated Tag objects, keeping the first occurrence
+    return list({id(tag): tag for tag in tags}.values())
+
+
 class Project(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255), nullable=False)
+    # URL form of the title used by find/<title>; nullable until backfill_slugs() has run
+    slug = db.Column(db.String(255), unique=True, index=True)
     github_link = db.Column(db.String(255))
     overview = db.Column(db.Text, nullable=False)
     start_date = db.Column(db.Date)
     end_date = db.Column(db.Date)
+    # serialize() payload as stored JSON with each tag reduced to its id, so
+    # a write only rewrites its own projects' snapshots; tag names and project
+    # titles are joined in at read time. NULL until the first write or backfill
+    snapshot = deferred(db.Column(db.Text))
+    snapshot_version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+    # Keys produced by serialize() and the columns each of them reads
+    FIELDS = {
+        'id': (),
+        'title': ('title',),
+        'overview': ('overview',),
+        'description': (),
+        'githubLink': ('github_link',),
+        'tags': (),
+        'dates': ('start_date', 'end_date'),
+    }
+    # How serialize() computes each key from a project; tag_dict turns a Tag
+    # into its (possibly shared) dict
+    ACCESSORS = {
+        'id': lambda obj, tag_dict: obj.id,
+        'title': lambda obj, tag_dict: obj.title,
+        'overview': lambda obj, tag_dict: obj.overview,
+        'description': lambda obj, tag_dict: [description.description for description in obj.descriptions],
+        'githubLink': lambda obj, tag_dict: obj.github_link,
+        'tags': lambda obj, tag_dict: [tag_dict(tag) for tag in obj.tags],
+        'dates': lambda obj, tag_dict: [format_month(obj.start_date), format_month(obj.end_date)],
+    }
 
     # Define the many-to-many relationship with tags
     tags = db.relationship(tag_ns.Tag, secondary=tag_ns.project_tags, overlaps="projects")
@@ -39,67 +86,269 @@ class Project(db.Model):
                 self.descriptions.append(item)
         self.tags = []
         if tags:
-            for item in tags:
-                if not isinstance(item, tag_ns.Tag):           
-                    in_db = tag_ns.Tag.query.filter_by(name=item).first()
-                    if in_db:
-                        item = in_db
-                    else:
-                        item =tag_ns.Tag(name=item)
-                self.tags.append(item)
+            # Resolve every tag name with one batched lookup
+            names = [item for item in tags if not isinstance(item, tag_ns.Tag)]
+            resolved = iter(tag_ns.Tag.resolve(names))
+            self.tags = _unique(item if isinstance(item, tag_ns.Tag) else next(resolved) for item in tags)
     
+    @validates('title')
+    def _sync_slug(self, key, title):
+        # Keep the slug in step with every title assignment (__init__, update, ...)
+        self.slug = self.slugify(title)
+        return title
+
+    @staticmethod
+    def slugify(title):
+        # Lower-case the title and collapse runs of whitespace and underscores to "_"
+        return re.sub(r'[\s_]+', '_', title.strip().lower())
+
+    @classmethod
+    def backfill_slugs(cls, batch_size=500):
+        # Fill in slugs for rows created before the column existed
+        taken = {slug for (slug,) in db.session.query(cls.slug).filter(cls.slug.isnot(None))}
+        count = 0
+        while True:
+            rows = db.session.query(cls.id, cls.title).filter(cls.slug.is_(None)).order_by(cls.id).limit(batch_size).all()
+            if not rows:
+                return count
+            updates = []
+            for project_id, title in rows:
+                slug = cls.slugify(title)
+                if slug in taken:
+                    warning(f"Project {project_id} ({title!r}) collides with an existing slug, using {slug}_{project_id}")
+                    slug = f"{slug}_{project_id}"
+                taken.add(slug)
+                updates.append({'id': project_id, 'slug': slug})
+            db.session.execute(update(cls), updates)
+            db.session.commit()
+            count += len(updates)
+
     @staticmethod
     def _complete_date(date_str):
-        if date_str is None:
-            return None
+        if date_str is None or isinstance(date_str, date):
+            return date_str
         # Check if the date string is in the format "yyyy-mm"
         if re.match(r'^\d{4}-\d{2}$', date_str):
             # Complete the date to the first day of the month
-            return f"{date_str}-01"
-        return date_str
+            date_str = f"{date_str}-01"
+        # A date object works with every backend (SQLite rejects strings)
+        return date.fromisoformat(date_str)
 
 
     def save(self):
+        # One flush and one commit per call: tags go through the relationship
+        # (association rows are written with one executemany) and new
+        # descriptions are detached and written with one multi-row insert
+        pending = [description.description for description in self.descriptions if description.id is None]
+        self.descriptions = [description for description in self.descriptions if description.id is not None]
         db.session.add(self)
-        db.session.commit()     ###this is the line with the error
+        db.session.flush()
+        self._insert_descriptions(pending)
+        self.refresh_snapshots([self.id])
+        db.session.commit()
 
-        for tag in self.tags:
-            #query the database for the tag
-            in_db = tag_ns.Tag.query.filter_by(name=tag.name).first()
-            if not in_db:  # Check if the tag is not already saved
-                tag.save()
-            else:
-                tag = in_db
-            # Create the relationship record in the project_tags table
-            # if it doesn't exist
-            if not db.session.query(tag_ns.project_tags).filter_by(tag_id=tag.id, project_id=self.id).first():
-                db.session.execute(tag_ns.project_tags.insert().values(tag_id=tag.id, project_id=self.id))
-                db.session.commit()
-
-
-        # Save related descriptions
-        for description in self.descriptions:
-            description.project_id = self.id
-            description.save()
+    def _insert_descriptions(self, texts):
+        if texts:
+            db.session.execute(insert(Description), [{'project_id': self.id, 'description': text} for text in texts])
+            db.session.expire(self, ['descriptions'])
+            # Let flush listeners see the project as changed
+            flag_dirty(self)
+
+    @staticmethod
+    def eager_options(fields=None, tag_projects=True):
+        # Load what serialize(fields, tag_projects) reads with one query per
+        # relationship, so it never falls back to lazy loads; unrequested
+        # columns are deferred and unrequested relationships skipped
+        fields = fields or Project.FIELDS
+        options = []
+        if fields is not Project.FIELDS:
+            columns = [getattr(Project, column) for field in fields for column in Project.FIELDS[field]]
+            options.append(load_only(Project.id, *columns))
+        if 'description' in fields:
+            options.append(subqueryload(Project.descriptions))
+        if 'tags' in fields:
+            tags = subqueryload(Project.tags)
+            if tag_projects:
+                tags = tags.selectinload(tag_ns.Tag.projects).load_only(Project.title)
+            options.append(tags)
+        return tuple(options)
+
+    @classmethod
+    def with_relations(cls, fields=None, tag_projects=True):
+        return cls.query.options(*cls.eager_options(fields, tag_projects))
+
+    @classmethod
+    def bulk_create(cls, rows):
+        # Insert many validated project dicts (the create_project payload) in a
+        # single transaction and return their ids: tags are resolved in one
+        # batch, projects, association rows and descriptions go out as
+        # multi-row inserts and the new ids are read back by slug
+        tag_names = list(dict.fromkeys(name for row in rows for name in row.get('tags', [])))
+        tags = dict(zip(tag_names, tag_ns.Tag.resolve(tag_names)))
+
+        slugs = [cls.slugify(row['title']) for row in rows]
+        db.session.execute(insert(cls), [
+            {'title': row['title'], 'slug': slug, 'overview': row['overview'], 'github_link': row.get('github_link'),
+             'start_date': cls._complete_date(row['start_date']) if row.get('start_date') else None,
+             'end_date': cls._complete_date(row['end_date']) if row.get('end_date') else None}
+            for slug, row in zip(slugs, rows)])
+        ids_by_slug = dict(db.session.execute(select(cls.slug, cls.id).where(cls.slug.in_(slugs))).all())
+        ids = [ids_by_slug[slug] for slug in slugs]
+
+        links = [
+            {'project_id': project_id, 'tag_id': tag_id}
+            for project_id, row in zip(ids, rows)
+            for tag_id in dict.fromkeys(tags[name].id for name in row.get('tags', []))
+        ]
+        if links:
+            db.session.execute(insert(tag_ns.project_tags), links)
+        descriptions = [
+            {'project_id': project_id, 'description': text}
+            for project_id, row in zip(ids, rows)
+            for text in row.get('description', [])
+        ]
+        if descriptions:
+            db.session.execute(insert(Description), descriptions)
+        cls.refresh_snapshots(ids)
+        db.session.commit()
+        return ids
+
+    @staticmethod
+    def carrying(tag_ids):
+        # Ids of the projects carrying any of tag_ids
+        if not tag_ids:
+            return set()
+        query = select(tag_ns.project_tags.c.project_id).where(tag_ns.project_tags.c.tag_id.in_(tag_ids))
+        return set(db.session.scalars(query))
+
+    @classmethod
+    def refresh_snapshots(cls, project_ids):
+        # Re-render the snapshots of project_ids from the flushed state of the
+        # current transaction
+        db.session.flush()
+        ids = set(project_ids)
+        if not ids:
+            return
+        projects = cls.with_relations(tag_projects=False).filter(cls.id.in_(ids)).populate_existing().all()
+        for project, data in zip(projects, cls.serialize_many(projects, tag_projects=False)):
+            data['tags'] = [tag['id'] for tag in data['tags']]
+            project.snapshot = dump_snapshot(data)
+            project.snapshot_version = (project.snapshot_version or 0) + 1
+        db.session.flush()
+
+    @classmethod
+    def backfill_snapshots(cls, batch_size=500):
+        # Write snapshots for rows that have none yet (created before the
+        # column existed or outside the model's write methods)
+        count = 0
+        while True:
+            ids = db.session.scalars(select(cls.id).where(cls.snapshot.is_(None)).order_by(cls.id).limit(batch_size)).all()
+            if not ids:
+                return count
+            cls.refresh_snapshots(ids)
+            db.session.commit()
+            count += len(ids)
+
+    @classmethod
+    def snapshot_query(cls):
+        # (id, snapshot) rows read from the project table alone
+        return db.session.query(cls.id, cls.snapshot)
+
+    @classmethod
+    def render_snapshots(cls, rows):
+        # JSON text of each (id, snapshot) row with its tags joined in by one
+        # query; rows without a stored snapshot yet are serialized from the
+        # ORM in one batch
+        missing = cls.missing_snapshots(rows)
+        projects = cls.with_relations().filter(cls.id.in_(missing)).all() if missing else []
+        snapshots = cls.load_snapshots(rows)
+        statement = cls.snapshot_tags_statement(snapshots)
+        tags = cls.snapshot_tags(db.session.execute(statement)) if statement is not None else {}
+        return cls.snapshot_texts(rows, projects, snapshots, tags)
+
+    @staticmethod
+    def missing_snapshots(rows):
+        return [row.id for row in rows if row.snapshot is None]
+
+    @staticmethod
+    def load_snapshots(rows):
+        # {id: stored payload} of the rows that have a snapshot
+        loads = current_app.json.loads
+        return {row.id: loads(row.snapshot) for row in rows if row.snapshot is not None}
+
+    @staticmethod
+    def snapshot_tags_statement(snapshots):
+        # (tag id, name, title) of every project carrying a tag the snapshots
+        # list, titles in project id order like Tag.projects; None without tags
+        tag_ids = {tag_id for data in snapshots.values() for tag_id in data['tags']}
+        if not tag_ids:
+            return None
+        project_tags = tag_ns.project_tags
+        return (select(project_tags.c.tag_id, tag_ns.Tag.name, Project.title)
+                .join(tag_ns.Tag, tag_ns.Tag.id == project_tags.c.tag_id)
+                .join(Project, Project.id == project_tags.c.project_id)
+                .where(project_tags.c.tag_id.in_(tag_ids))
+                .order_by(project_tags.c.tag_id, Project.id))
+
+    @staticmethod
+    def snapshot_tags(rows):
+        # {tag id: the tag's serialize() dict} from snapshot_tags_statement() rows
+        tags = {}
+        for tag_id, name, title in rows:
+            tag = tags.get(tag_id)
+            if tag is None:
+                tag = tags[tag_id] = {"id": tag_id, "name": name, "projects": []}
+            tag["projects"].append(title)
+        return tags
+
+    @classmethod
+    def snapshot_texts(cls, rows, projects, snapshots, tags):
+        # Stored snapshot of each row with the dicts of its tags put back, or
+        # the serialization of its project in ``projects`` (loaded with
+        # eager_options()) when it has none
+        rendered = {project.id: dump_snapshot(data) for project, data in zip(projects, cls.serialize_many(projects))}
+        texts = []
+        for row in rows:
+            data = snapshots.get(row.id)
+            if data is not None:
+                # A tag deleted since the snapshot was written is left out
+                data['tags'] = [tags[tag_id] for tag_id in data['tags'] if tag_id in tags]
+                texts.append(dump_snapshot(data))
+            elif row.id in rendered:
+                texts.append(rendered[row.id])
+        return texts
 
     def __repr__(self):
         return f'<Project {self.title}>'
 
-    def serialize(self):
-        # Create a dictionary representation of the Project object
-        return {
-            'id': self.id,
-            'title': self.title,
-            'overview': self.overview,
-            'description': [description.description for description in self.descriptions],
-            'githubLink': self.github_link,
-            'tags': [tag.serialize() for tag in self.tags],
-            'dates': [
-                        self.start_date.strftime('%Y-%m') if self.start_date else None,
-                        self.end_date.strftime('%Y-%m') if self.end_date else None
-                    ],
-        }
-    
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def serializer(fields=None):
+        # serialize() for one fieldset, built once per distinct fieldset
+        fields = [key for key in Project.FIELDS if key in (fields or Project.FIELDS)]
+        return build_serializer(Project.ACCESSORS, fields)
+
+    def serialize(self, fields=None, tag_projects=True):
+        # Create a dictionary representation of the Project object, limited to
+        # ``fields`` when given; tag_projects=False leaves out each tag's project list
+        return Project.serialize_many([self], fields, tag_projects)[0]
+
+    @staticmethod
+    def serialize_many(projects, fields=None, tag_projects=True):
+        # Serialize a list of projects with one fieldset's serializer; a tag shared
+        # by several projects is turned into a dict only once
+        serialize = Project.serializer(tuple(fields) if fields else None)
+        serialize_tag = tag_ns.Tag.serializer(None if tag_projects else ('id', 'name'))
+        tags = {}
+
+        def tag_dict(tag):
+            data = tags.get(tag.id)
+            if data is None:
+                data = tags[tag.id] = serialize_tag(tag)
+            return data
+
+        return [serialize(project, tag_dict) for project in projects]
+
     def delete(self):
         # Remove the project from the tags association
         for tag in self.tags:
@@ -126,30 +375,18 @@ class Project(db.Model):
         # Update tags if provided
         tags = kwargs.get('tags')
         if tags:
-            # Clear the existing tags
-            self.tags.clear()
-
-            # Add the new tags
-            for tag_name in tags:
-                tag = tag_ns.Tag.query.filter_by(name=tag_name).first()
-                if not tag:
-                    # If the tag doesn't exist, create a new one
-                    tag = tag_ns.Tag(name=tag_name)
-                    db.session.add(tag)
+            # Replace the existing tags, resolving all names in one batch
+            self.tags = _unique(tag_ns.Tag.resolve(tags))
 
-                self.tags.append(tag)
+        db.session.flush()
 
         # Update descriptions if provided
         descriptions = kwargs.get('descriptions')
         if descriptions:
-            # Clear the existing descriptions
-            for description in self.descriptions:
-                db.session.delete(description)
-
-            # Add the new descriptions
-            for description_text in descriptions:
-                description = Description(description=description_text, project=self)
-                description.save()
+            # Replace the existing descriptions with one delete and one multi-row insert
+            db.session.execute(delete(Description).where(Description.project_id == self.id))
+            self._insert_descriptions(descriptions)
+        self.refresh_snapshots([self.id])
         # Save the changes to the database
         db.session.commit()
         
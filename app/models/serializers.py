@@ -0,0 +1,20 @@
+from functools import lru_cache
+
+
+@lru_cache(maxsize=4096)
+def format_month(value):
+    # date -> "yyyy-mm"; a catalog repeats the same few hundred months, so
+    # each one is formatted once instead of once per row
+    return f"{value.year:04d}-{value.month:02d}" if value else None
+
+
+def build_serializer(accessors, fields):
+    # ``serialize(obj, tag_dict=None)`` returning a dict of the given fields,
+    # each computed by its accessor; the field selection is decided once here
+    # instead of with an ``if`` per key per row
+    getters = tuple((key, accessors[key]) for key in fields)
+
+    def serialize(obj, tag_dict=None):
+        return {key: getter(obj, tag_dict) for key, getter in getters}
+
+    return serialize
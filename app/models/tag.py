@@ -1,5 +1,10 @@
 from app import db
+from sqlalchemy import select, func, null
 from sqlalchemy.orm import relationship
+from itertools import groupby
+from sqlalchemy.exc import IntegrityError
+from functools import lru_cache
+from app.models.serializers import build_serializer
 
 # Define the association table for the many-to-many relationship
 project_tags = db.Table('project_tags',
@@ -10,7 +15,16 @@ project_tags = db.Table('project_tags',
 class Tag(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False, unique=True)
-    projects = relationship("Project", secondary = 'project_tags')
+    # In project id order, the order snapshots list the titles in
+    projects = relationship("Project", secondary = 'project_tags', order_by="Project.id")
+    # Keys produced by serialize()
+    FIELDS = ("id", "name", "projects")
+    # How serialize() computes each key from a tag
+    ACCESSORS = {
+        "id": lambda obj, tag_dict: obj.id,
+        "name": lambda obj, tag_dict: obj.name,
+        "projects": lambda obj, tag_dict: [project.title for project in obj.projects],
+    }
     # Define the many-to-many relationship with the Project model
     def __init__(self, name):
         self.name = name
@@ -36,16 +50,128 @@ class Tag(db.Model):
 
             db.session.add(self)
 
+        # Snapshots hold tag ids, so only projects that gained the tag change;
+        # Project is imported here as it imports this module
+        from app.models.project import Project
+        db.session.flush()
+        Project.refresh_snapshots([project.id for project in new_projects or ()])
         db.session.commit()
 
+    @classmethod
+    def resolve(cls, names):
+        # Return one Tag per name, in input order, creating the missing ones:
+        # existing tags come from one IN query and the rest are inserted with a
+        # single upsert that skips names a concurrent writer inserted first
+        if not names:
+            return []
+        unique_names = list(dict.fromkeys(names))
+        found = {tag.name: tag for tag in cls.query.filter(cls.name.in_(unique_names))}
+        # Case-insensitive collations (MySQL's default) may return a differently cased name
+        folded = {name.casefold(): tag for name, tag in found.items()}
+        missing = [name for name in unique_names if name not in found and name.casefold() not in folded]
+        if missing:
+            cls._insert_missing(missing)
+            # Locking read so rows committed by other writers since our snapshot are visible
+            query = cls.query.filter(cls.name.in_(missing)).with_for_update(read=True)
+            found.update((tag.name, tag) for tag in query)
+            folded = {name.casefold(): tag for name, tag in found.items()}
+        return [found.get(name) or folded[name.casefold()] for name in names]
+
+    @classmethod
+    def _insert_missing(cls, names):
+        rows = [{"name": name} for name in names]
+        dialect = db.session.get_bind().dialect.name
+        if dialect == 'mysql':
+            from sqlalchemy.dialects.mysql import insert
+            statement = insert(cls.__table__)
+            # A no-op update, so an existing tag keeps the casing it was created with
+            statement = statement.on_duplicate_key_update(id=cls.__table__.c.id)
+        elif dialect in ('sqlite', 'postgresql'):
+            if dialect == 'sqlite':
+                from sqlalchemy.dialects.sqlite import insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert
+            statement = insert(cls.__table__).on_conflict_do_nothing(index_elements=['name'])
+        else:
+            # No upsert syntax: insert one by one, each in a savepoint
+            for row in rows:
+                try:
+                    with db.session.begin_nested():
+                        db.session.execute(cls.__table__.insert().values(**row))
+                except IntegrityError:
+                    pass
+            return
+        db.session.execute(statement, rows)
+
     def delete(self):
+        from app.models.project import Project
+        project_ids = Project.carrying([self.id])
         db.session.delete(self)
+        Project.refresh_snapshots(project_ids)
         db.session.commit()
 
-    def serialize(self):
-        return {
-            "id":self.id,
-            "name": self.name, 
-            "projects": [p.title for p in self.projects]
-        }
-    
+    @classmethod
+    def in_use(cls, fields=None, limit=None, after=None):
+        # Serialized tags carrying at least one project, in id order, with one
+        # query: a derived table picks the tags (a page of them when limit is
+        # given) and is joined to their project titles, grouped here.
+        # Returns (tags, id of the last tag when more follow, else None)
+        return cls.group_in_use(db.session.execute(cls.in_use_statement(fields, limit, after)), fields, limit)
+
+    @classmethod
+    def in_use_statement(cls, fields=None, limit=None, after=None):
+        from app.models.project import Project
+        fields = fields or cls.FIELDS
+        tags = select(cls.id, cls.name).where(cls.id.in_(select(project_tags.c.tag_id))).order_by(cls.id)
+        if after is not None:
+            tags = tags.where(cls.id > after)
+        if limit is not None:
+            tags = tags.limit(limit + 1)
+        tags = tags.subquery()
+        if "projects" in fields:
+            return (select(tags.c.id, tags.c.name, Project.title)
+                    .join(project_tags, project_tags.c.tag_id == tags.c.id)
+                    .join(Project, Project.id == project_tags.c.project_id)
+                    .order_by(tags.c.id, Project.id))
+        return select(tags.c.id, tags.c.name, null()).order_by(tags.c.id)
+
+    @classmethod
+    def group_in_use(cls, rows, fields=None, limit=None):
+        fields = fields or cls.FIELDS
+        result, ids = [], []
+        for (tag_id, name), group in groupby(rows, key=lambda row: (row[0], row[1])):
+            data = {"id": tag_id, "name": name, "projects": [title for _, _, title in group]}
+            result.append({key: data[key] for key in cls.FIELDS if key in fields})
+            ids.append(tag_id)
+        if limit is not None and len(result) > limit:
+            return result[:limit], ids[limit - 1]
+        return result, None
+
+    @classmethod
+    def facets(cls):
+        # (id, name, project count) of every tag in use, most used first
+        return db.session.execute(cls.facets_statement()).all()
+
+    @classmethod
+    def facets_statement(cls):
+        count = func.count(project_tags.c.project_id)
+        return (select(cls.id, cls.name, count)
+                .join(project_tags, project_tags.c.tag_id == cls.id)
+                .group_by(cls.id, cls.name)
+                .order_by(count.desc(), cls.name))
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def serializer(fields=None):
+        # serialize() for one fieldset, built once per distinct fieldset
+        fields = [key for key in Tag.FIELDS if key in (fields or Tag.FIELDS)]
+        return build_serializer(Tag.ACCESSORS, fields)
+
+    def serialize(self, fields=None):
+        return Tag.serializer(tuple(fields) if fields else None)(self)
+
+    @staticmethod
+    def serialize_many(tags, fields=None):
+        serialize = Tag.serializer(tuple(fields) if fields else None)
+        return [serialize(tag) for tag in tags]
+
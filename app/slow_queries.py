@@ -0,0 +1,137 @@
+import json
+from logging import getLogger
+from threading import Lock
+from time import monotonic, perf_counter
+from flask import request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = getLogger(__name__)
+
+# How each backend is asked for the plan of a statement
+EXPLAIN = {"mysql": "EXPLAIN ", "sqlite": "EXPLAIN QUERY PLAN ", "postgresql": "EXPLAIN "}
+MAX_PARAMETER_LENGTH = 200
+
+
+class SlowQueryLog:
+    """Logs the statements that take longer than a threshold.
+
+    Each line carries the statement, its parameters, the route it ran for
+    and, for a SELECT, the plan from EXPLAIN run on the same connection. At
+    most ``per_minute`` lines are written a minute; the statements dropped
+    meanwhile are counted and the count goes out with the next line.
+    """
+
+    def __init__(self):
+        self.threshold = None
+        self.explain = True
+        self.per_minute = 60
+        self.suppressed = 0
+        self._allowance = 0.0
+        self._checked = monotonic()
+        self._lock = Lock()
+
+    def __bool__(self):
+        return self.threshold is not None
+
+    def configure(self, threshold_ms, explain=True, per_minute=60):
+        # A threshold of 0 turns the log off
+        self.threshold = threshold_ms / 1000 if threshold_ms > 0 else None
+        self.explain = explain
+        self.per_minute = per_minute
+        self.suppressed = 0
+        self._allowance = float(per_minute)
+        self._checked = monotonic()
+
+    def _allow(self):
+        # Token bucket refilled at per_minute tokens a minute; returns how many
+        # lines were dropped before this one, or None to drop this one too
+        with self._lock:
+            now = monotonic()
+            self._allowance = min(self.per_minute, self._allowance + (now - self._checked) * self.per_minute / 60)
+            self._checked = now
+            if self._allowance < 1:
+                self.suppressed += 1
+                return None
+            self._allowance -= 1
+            suppressed, self.suppressed = self.suppressed, 0
+            return suppressed
+
+    def report(self, connection, statement, parameters, elapsed, executemany):
+        suppressed = self._allow()
+        if suppressed is None:
+            return
+        line = {"duration_ms": round(elapsed * 1000, 2), "statement": " ".join(statement.split()),
+                "parameters": _shorten(parameters)}
+        if has_request_context():
+            line.update(method=request.method, path=request.path, endpoint=request.endpoint)
+        if self.explain and not executemany:
+            plan = explain(connection, statement, parameters)
+            if plan is not None:
+                line["plan"] = plan
+        if suppressed:
+            line["suppressed"] = suppressed
+        logger.warning(json.dumps(line, default=repr))
+
+
+def _shorten(parameters):
+    # Long values (descriptions, overviews) are cut so a line stays readable
+    if isinstance(parameters, dict):
+        return {key: _shorten(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [_shorten(value) for value in parameters]
+    if isinstance(parameters, (str, bytes)) and len(parameters) > MAX_PARAMETER_LENGTH:
+        return parameters[:MAX_PARAMETER_LENGTH] + ("..." if isinstance(parameters, str) else b"...")
+    return parameters
+
+
+def explain(connection, statement, parameters):
+    # The plan rows of a SELECT, through a raw DBAPI cursor so the EXPLAIN
+    # itself isn't timed, logged or counted; None when there is none
+    prefix = EXPLAIN.get(connection.dialect.name)
+    if prefix is None or not statement.lstrip().upper().startswith("SELECT"):
+        return None
+    dbapi_connection = connection.connection.dbapi_connection
+    # A failed statement aborts a PostgreSQL transaction, so there the EXPLAIN
+    # runs in a savepoint that is rolled back when it fails
+    savepoint = connection.dialect.name == "postgresql" and not getattr(dbapi_connection, "autocommit", False)
+    cursor = dbapi_connection.cursor()
+    try:
+        if savepoint:
+            cursor.execute("SAVEPOINT slow_query_explain")
+        try:
+            cursor.execute(prefix + statement, parameters)
+            plan = [list(row) for row in cursor.fetchall()]
+        except connection.dialect.dbapi.Error as error:
+            plan = f"EXPLAIN failed: {error}"
+            if savepoint:
+                cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+        if savepoint:
+            cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+        return plan
+    finally:
+        cursor.close()
+
+
+slow_query_log = SlowQueryLog()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if slow_query_log and context is not None:
+        context._slow_query_start = perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_slow_query_start", None)
+    if started is not None:
+        elapsed = perf_counter() - started
+        if slow_query_log and elapsed >= slow_query_log.threshold:
+            slow_query_log.report(conn, statement, parameters, elapsed, executemany)
+
+
+def init_app(app):
+    slow_query_log.configure(app.config.get("SLOW_QUERY_MS", 0), app.config.get("SLOW_QUERY_EXPLAIN", True),
+                             app.config.get("SLOW_QUERY_LOG_PER_MINUTE", 60))
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
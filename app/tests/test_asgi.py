@@ -0,0 +1,134 @@
+import unittest
+from unittest.mock import patch
+from os import environ
+import requests
+from sqlalchemy import insert
+from sqlalchemy.engine import make_url
+from app import app, db
+from app.models.project import Project
+from app.models.tag import Tag
+from app.controller.auth import token_cache
+from app.controller.cache import response_cache, catalog_sync
+
+try:
+    import httpx
+    from app.asgi import application, async_database_url, in_memory_sqlite
+except ImportError:  # the async mode is optional, see requirements-async.txt
+    application = None
+
+ADMIN = environ["ADMIN_LIST"].split(",")[0]
+# Read URLs answered natively by the ASGI app, compared with the Flask answers
+READ_URLS = [
+    "/projects/",
+    "/projects/?limit=2",
+    "/projects/?fields=title,tags",
+    "/projects/?fields=title,tags&include=tags.projects&limit=2",
+    "/projects/?fields=nope",
+    "/projects/?cursor=garbage",
+    "/projects/find/project_1",
+    "/projects/find/missing",
+    "/projects/tag/Tag_0",
+    "/projects/tag/Tag_0?limit=1",
+    "/projects/tag/Unused",
+    "/projects/tag/missing",
+    "/projects/tags",
+    "/projects/tags?limit=1&fields=name",
+    "/projects/tags/facets",
+]
+
+
+@unittest.skipIf(application is None, "async dependencies from requirements-async.txt are not installed")
+class AsyncDatabaseUrlTestCase(unittest.TestCase):
+    def test_drivers(self):
+        self.assertEqual(async_database_url(make_url("sqlite:////tmp/catalog.db")).drivername, "sqlite+aiosqlite")
+        self.assertEqual(async_database_url(make_url("mysql://u:p@h/db")).drivername, "mysql+aiomysql")
+
+    def test_in_memory_sqlite_is_refused(self):
+        for url in ("sqlite://", "sqlite:///:memory:", "sqlite:///file:catalog?mode=memory&uri=true"):
+            with self.assertRaises(ValueError, msg=url):
+                async_database_url(make_url(url))
+
+
+@unittest.skipIf(application is None, "async dependencies from requirements-async.txt are not installed")
+@unittest.skipIf(application is not None and in_memory_sqlite(make_url(app.config["SQLALCHEMY_DATABASE_URI"])),
+                 "the async engine can't open the tests' in-memory SQLite database")
+class AsgiParityTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        token_cache.clear()
+        response_cache.clear()
+        with app.app_context():
+            db.create_all()
+            for x in range(4):
+                Project(title=f"Project {x}", overview=f"Overview {x}", start_date="2021-0{}".format(x + 1),
+                        tags=[f"Tag {x % 2}", "Tag shared"], descriptions=[f"Description {x}"]).save()
+            Tag(name="Unused").save()
+            # One row without a snapshot takes the fallback path
+            db.session.get(Project, 2).snapshot = None
+            db.session.commit()
+        self.flask = app.test_client()
+
+    async def asyncSetUp(self):
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=application), base_url="http://test")
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+        await application.close()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    async def test_read_parity(self):
+        for url in READ_URLS:
+            response_cache.clear()
+            expected = self.flask.get(url)
+            response_cache.clear()
+            response = await self.client.get(url)
+            self.assertEqual(response.status_code, expected.status_code, url)
+            self.assertEqual(response.json(), expected.get_json(), url)
+            if expected.status_code == 200:
+                self.assertEqual(response.content, expected.get_data(), url)
+                self.assertEqual(response.headers["etag"], expected.headers["ETag"], url)
+
+    async def test_conditional_and_cached(self):
+        response = await self.client.get("/projects/")
+        etag = response.headers["etag"]
+        self.assertEqual((await self.client.get("/projects/", headers={"If-None-Match": etag})).status_code, 304)
+        # Both modes share the response cache
+        self.assertEqual(self.flask.get("/projects/").headers["ETag"], etag)
+
+    async def test_writes_go_through_flask_with_async_verification(self):
+        verified = httpx.Response(200, json={"username": ADMIN})
+        with patch.object(httpx.AsyncClient, "get", return_value=verified) as async_get, \
+                patch.object(requests.Session, "get") as blocking_get:
+            response = await self.client.post("/projects/", json={"title": "New", "overview": "Overview"},
+                                              headers={"Authorization": "Bearer token"})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(async_get.call_count, 1)
+        blocking_get.assert_not_called()
+        # The write invalidated the cache for both modes
+        titles = [project["title"] for project in (await self.client.get("/projects/")).json()]
+        self.assertIn("New", titles)
+
+        # Streams are served by Flask too
+        response = await self.client.get("/projects/?stream=1")
+        self.assertEqual(response.json(), self.flask.get("/projects/").get_json())
+
+    async def test_picks_up_other_workers_writes(self):
+        catalog_sync.enabled, catalog_sync.interval = True, 0
+        try:
+            self.assertEqual(len((await self.client.get("/projects/")).json()), 4)
+            with app.app_context(), db.engine.begin() as connection:
+                project_id = connection.execute(insert(Project).values(
+                    title="Remote", slug="remote", overview="Overview")).inserted_primary_key[0]
+                catalog_sync.record(connection, {project_id})
+            self.assertEqual(len((await self.client.get("/projects/")).json()), 5)
+        finally:
+            catalog_sync.enabled, catalog_sync.interval = False, 1.0
+            catalog_sync.synced = catalog_sync._checked = None
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,232 @@
+import unittest
+from app import app, db
+from app.controller import auth
+from app.controller.auth import TokenCache, LocalKeySet, token_cache
+from requests import Response
+from unittest.mock import patch
+from os import environ, utime
+from base64 import urlsafe_b64encode
+from tempfile import TemporaryDirectory
+from time import time
+import hashlib
+import hmac
+import requests
+import json
+
+JWT_TOKEN_GOOD = 'your_test_token'
+JWT_TOKEN_BAD = 'your_bad_token'
+environment = environ
+VERIFY_URL = environment["VERIFY_URL"]
+
+
+class TokenCacheTestCase(unittest.TestCase):
+    def test_hit_and_miss(self):
+        cache = TokenCache(ttl=60, negative_ttl=60, max_size=10)
+        self.assertEqual(cache.get("token"), (False, None))
+        cache.set("token", "test1")
+        self.assertEqual(cache.get("token"), (True, "test1"))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_negative_entry(self):
+        cache = TokenCache(ttl=60, negative_ttl=60, max_size=10)
+        cache.set("bad", None)
+        self.assertEqual(cache.get("bad"), (True, None))
+
+    def test_expiry(self):
+        cache = TokenCache(ttl=60, negative_ttl=0, max_size=10)
+        cache.set("bad", None)
+        self.assertEqual(cache.get("bad"), (False, None))
+        self.assertEqual(len(cache), 0)
+
+    def test_eviction(self):
+        cache = TokenCache(ttl=60, negative_ttl=60, max_size=2)
+        cache.set("a", "user a")
+        cache.set("b", "user b")
+        # Touch "a" so "b" is the least recently used entry
+        cache.get("a")
+        cache.set("c", "user c")
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get("b"), (False, None))
+        self.assertEqual(cache.get("a"), (True, "user a"))
+        self.assertEqual(cache.get("c"), (True, "user c"))
+
+
+class VerifyCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.patcher = patch.object(requests.Session, 'get', side_effect=self._mocked_get)
+        self.mock_get = self.patcher.start()
+        token_cache.clear()
+        with app.app_context():
+            db.create_all()
+        self.app = app.test_client()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+        self.patcher.stop()
+        token_cache.clear()
+
+    def _mocked_get(self, url, headers, **kwargs):
+        response = Response()
+        if url == VERIFY_URL and headers.get('Authorization') == f'Bearer {JWT_TOKEN_GOOD}':
+            response.status_code = 200
+            data = {"username": environment["ADMIN_LIST"].split(",")[0]}
+            response._content = json.dumps(data).encode('utf-8')
+        else:
+            response.status_code = 401
+            response._content = b'{"msg": "Unauthorized"}'
+        return response
+
+    def test_repeat_admin_calls_skip_verification(self):
+        with app.app_context():
+            for _ in range(3):
+                response = self.app.get("projects/admin", headers={'Authorization': f'Bearer {JWT_TOKEN_GOOD}'})
+                self.assertEqual(response.status_code, 204)
+            self.assertEqual(self.mock_get.call_count, 1)
+
+    def test_rejected_token_is_cached(self):
+        with app.app_context():
+            for _ in range(3):
+                response = self.app.get("projects/admin", headers={'Authorization': f'Bearer {JWT_TOKEN_BAD}'})
+                self.assertEqual(response.status_code, 401)
+            self.assertEqual(self.mock_get.call_count, 1)
+
+    def test_auth_service_errors_are_not_cached(self):
+        with app.app_context():
+            self.mock_get.side_effect = None
+            error = Response()
+            error.status_code = 503
+            self.mock_get.return_value = error
+            for _ in range(2):
+                response = self.app.get("projects/admin", headers={'Authorization': f'Bearer {JWT_TOKEN_GOOD}'})
+                self.assertEqual(response.status_code, 401)
+            self.assertEqual(self.mock_get.call_count, 2)
+
+    def test_unreachable_auth_service(self):
+        with app.app_context():
+            for error in (requests.ConnectionError("refused"), requests.Timeout("timed out")):
+                self.mock_get.side_effect = error
+                with self.assertLogs(level="WARNING"):
+                    response = self.app.get("projects/admin", headers={'Authorization': f'Bearer {JWT_TOKEN_GOOD}'})
+                self.assertEqual(response.status_code, 401)
+            # Once it answers again the token is accepted
+            self.mock_get.side_effect = self._mocked_get
+            response = self.app.get("projects/admin", headers={'Authorization': f'Bearer {JWT_TOKEN_GOOD}'})
+            self.assertEqual(response.status_code, 204)
+
+    def test_auth_service_answers_garbage(self):
+        with app.app_context():
+            self.mock_get.side_effect = None
+            garbage = Response()
+            garbage.status_code = 200
+            garbage._content = b'<html>'
+            self.mock_get.return_value = garbage
+            with self.assertLogs(level="WARNING"):
+                response = self.app.get("projects/admin", headers={'Authorization': f'Bearer {JWT_TOKEN_GOOD}'})
+            self.assertEqual(response.status_code, 401)
+
+
+def _b64(data):
+    return urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def make_token(claims, secret, kid="test-key", alg="HS256"):
+    digest = {"HS256": hashlib.sha256, "HS512": hashlib.sha512}[alg]
+    header = _b64(json.dumps({"alg": alg, "typ": "JWT", "kid": kid}).encode('utf-8'))
+    payload = _b64(json.dumps(claims).encode('utf-8'))
+    signature = hmac.new(secret, f'{header}.{payload}'.encode('ascii'), digest).digest()
+    return f'{header}.{payload}.{_b64(signature)}'
+
+
+class LocalVerifyTestCase(unittest.TestCase):
+    secret = b'local stand-in secret'
+
+    def setUp(self):
+        app.config['TESTING'] = True
+        self.tmp = TemporaryDirectory()
+        self.key_path = f'{self.tmp.name}/jwks.json'
+        self.write_keys(self.secret)
+        self.patchers = [
+            patch.object(auth, 'AUTH_MODE', 'local'),
+            patch.object(auth, 'key_set', LocalKeySet(self.key_path, reload_interval=0)),
+            patch.object(requests.Session, 'get', side_effect=AssertionError("VERIFY_URL must not be called")),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+        self.app = app.test_client()
+        self.admin = environment["ADMIN_LIST"].split(",")[0]
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        self.tmp.cleanup()
+
+    def write_keys(self, secret, kid="test-key"):
+        with open(self.key_path, 'w') as key_file:
+            json.dump({"keys": [{"kty": "oct", "kid": kid, "alg": "HS256", "k": _b64(secret)}]}, key_file)
+
+    def admin_status(self, token):
+        with app.app_context():
+            return self.app.get("projects/admin", headers={'Authorization': f'Bearer {token}'}).status_code
+
+    def test_valid_token(self):
+        token = make_token({"sub": self.admin, "exp": time() + 300}, self.secret)
+        self.assertEqual(self.admin_status(token), 204)
+
+    def test_expired_token(self):
+        token = make_token({"sub": self.admin, "exp": time() - 300}, self.secret)
+        self.assertEqual(self.admin_status(token), 401)
+
+    def test_token_without_expiry(self):
+        token = make_token({"sub": self.admin}, self.secret)
+        self.assertEqual(self.admin_status(token), 401)
+
+    def test_times_that_are_not_numbers(self):
+        for claims in ({"exp": "soon"}, {"exp": True}, {"exp": time() + 300, "nbf": "now"}, {"exp": None}):
+            token = make_token({"sub": self.admin, **claims}, self.secret)
+            self.assertEqual(self.admin_status(token), 401, claims)
+        token = make_token({"sub": self.admin, "exp": int(time()) + 300, "nbf": int(time())}, self.secret)
+        self.assertEqual(self.admin_status(token), 204)
+
+    def test_bad_signature(self):
+        token = make_token({"sub": self.admin, "exp": time() + 300}, b'some other secret')
+        self.assertEqual(self.admin_status(token), 401)
+
+    def test_unknown_algorithm_and_garbage(self):
+        token = make_token({"sub": self.admin, "exp": time() + 300}, self.secret, alg="HS512")
+        self.assertEqual(self.admin_status(token.replace(token.split('.')[0], _b64(b'{"alg": "none"}'))), 401)
+        self.assertEqual(self.admin_status("not.a.jwt"), 401)
+        self.assertEqual(self.admin_status(""), 401)
+
+    def test_key_set_reload(self):
+        token = make_token({"sub": self.admin, "exp": time() + 300}, self.secret)
+        self.assertEqual(self.admin_status(token), 204)
+
+        # Rotate the key; the file is re-read because its mtime changed
+        new_secret = b'rotated secret'
+        self.write_keys(new_secret, kid="rotated-key")
+        utime(self.key_path, (time() + 10, time() + 10))
+        self.assertEqual(self.admin_status(token), 401)
+        new_token = make_token({"sub": self.admin, "exp": time() + 300}, new_secret, kid="rotated-key")
+        self.assertEqual(self.admin_status(new_token), 204)
+
+    def test_missing_key_set(self):
+        token = make_token({"sub": self.admin, "exp": time() + 300}, self.secret)
+        with patch.object(auth, 'key_set', LocalKeySet(f'{self.tmp.name}/missing.json', reload_interval=0)):
+            with self.assertLogs(level="WARNING"):
+                self.assertEqual(self.admin_status(token), 401)
+
+    def test_unreadable_key_set_keeps_last_keys(self):
+        token = make_token({"sub": self.admin, "exp": time() + 300}, self.secret)
+        self.assertEqual(self.admin_status(token), 204)
+        with open(self.key_path, 'w') as key_file:
+            key_file.write('{"keys": [')
+        utime(self.key_path, (time() + 10, time() + 10))
+        with self.assertLogs(level="WARNING"):
+            self.assertEqual(self.admin_status(token), 204)
+
+
+if __name__ == '__main__':
+    unittest.main()
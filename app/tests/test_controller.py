@@ -1,13 +1,20 @@
 import unittest
 from app import app, db
 from app.models.project import Project
-from app.models.tag import Tag
+from app.models.tag import Tag, project_tags
 from app.models.description import Description
+from app.controller.auth import token_cache
+from app.controller import controller
+from app.controller.cache import response_cache, catalog_version, catalog_sync
+from app.models.catalog import catalog_changes
+from app.controller.search import search_index
+from app.controller.tag_index import tag_index
+from app.controller.pagination import encode_cursor
 from requests import Response
 from unittest.mock import patch, MagicMock
 import requests
 from os import environ
-from sqlalchemy import select
+from sqlalchemy import select, event, update, insert
 from datetime import date
 import json
 # Define the JWT token as a constant outside the test class
@@ -21,8 +28,12 @@ class AuthTestCase(unittest.TestCase):
         app.config['TESTING'] = True
         app.config['SECRET_KEY'] = 'sekrit!'
         
-        # Create a mock function for requests.get
-        self.mock_get = patch.object(requests, 'get', side_effect=self._mocked_get).start()
+        # Create a mock function for the pooled session used to verify tokens
+        self.mock_get = patch.object(requests.Session, 'get', side_effect=self._mocked_get).start()
+        token_cache.clear()
+        response_cache.clear()
+        search_index.reset()
+        tag_index.reset()
 
         with app.app_context():
             # Create the database tables
@@ -108,6 +119,108 @@ class AuthTestCase(unittest.TestCase):
             self.assertIn('tag1', [tag.name for tag in tags])
             self.assertIn('tag2', [tag.name for tag in tags])
 
+            # Test with dates that aren't real days or strings (Bad Request)
+            for start_date in ("2021-13", "2021-02-30", "soon", 2021, ["2021-01"]):
+                response = http_method(endpoint, json={'title': 'Dated', 'overview': 'Test overview', 'start_date': start_date},
+                                       headers={'Authorization': f'Bearer {JWT_TOKEN_GOOD}'})
+                self.assertEqual(response.status_code, 400, start_date)
+                self.assertEqual(response.get_json(), {"message": "start_date must look like yyyy-mm or yyyy-mm-dd"})
+            response = self.app.put(f"projects/{project.id}", json={'end_date': '2021-00'},
+                                    headers={'Authorization': f'Bearer {JWT_TOKEN_GOOD}'})
+            self.assertEqual(response.status_code, 400)
+            response = self.app.post("projects/bulk", json=[{'title': 'Dated', 'overview': 'Test overview', 'end_date': '2021-02-30'}],
+                                     headers={'Authorization': f'Bearer {JWT_TOKEN_GOOD}'})
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.get_json()["errors"][0]["message"], "end_date must look like yyyy-mm or yyyy-mm-dd")
+
+            # Test with titles that aren't non-empty strings (Bad Request)
+            for title in (5, ["Title"], "   "):
+                response = http_method(endpoint, json={'title': title, 'overview': 'Test overview'},
+                                       headers={'Authorization': f'Bearer {JWT_TOKEN_GOOD}'})
+                self.assertEqual(response.status_code, 400, title)
+                self.assertEqual(response.get_json(), {"message": "Title and overview must be non-empty strings"})
+            for title in (None, 5, ""):
+                response = self.app.put(f"projects/{project.id}", json={'title': title},
+                                        headers={'Authorization': f'Bearer {JWT_TOKEN_GOOD}'})
+                self.assertEqual(response.status_code, 400, title)
+            response = self.app.post("projects/bulk", json=[{'title': 5, 'overview': 'Test overview'}],
+                                     headers={'Authorization': f'Bearer {JWT_TOKEN_GOOD}'})
+            self.assertEqual(response.get_json()["errors"][0]["message"], "Title and overview must be non-empty strings")
+
+            # Test with tags that aren't lists of non-empty strings (Bad Request)
+            for tags in ([1], ["ok", ""], "tag", [None]):
+                response = http_method(endpoint, json={'title': 'Tagged', 'overview': 'Test overview', 'tags': tags},
+                                       headers={'Authorization': f'Bearer {JWT_TOKEN_GOOD}'})
+                self.assertEqual(response.status_code, 400, tags)
+                self.assertEqual(response.get_json(), {"message": "tags must be a list of strings"})
+                response = self.app.put(f"projects/{project.id}", json={'tags': tags},
+                                        headers={'Authorization': f'Bearer {JWT_TOKEN_GOOD}'})
+                self.assertEqual(response.status_code, 400, tags)
+            self.assertEqual(db.session.get(Project, project.id).title, 'Test title1')
+
+    def test_bulk_create_endpoint(self):
+        with app.app_context():
+            http_method = self.app.post
+            endpoint = "projects/bulk"
+            auth = {'Authorization': f'Bearer {JWT_TOKEN_GOOD}'}
+            Tag(name="existing").save()
+
+            # Test with bad permissions (Unauthorized)
+            response = http_method(endpoint, json=[], headers={'Authorization': f'Bearer {JWT_TOKEN_BAD}'})
+            self.assertEqual(response.status_code, 401)
+
+            # Test with a body that isn't a list (Bad Request)
+            response = http_method(endpoint, json={'title': 'Test title'}, headers=auth)
+            self.assertEqual(response.status_code, 400)
+
+            commits = []
+            def count_commit(session):
+                commits.append(session)
+            event.listen(db.session, "after_commit", count_commit)
+            try:
+                items = [{
+                    'title': f'Bulk {x}',
+                    'overview': 'Test overview',
+                    'tags': ['existing', f'new {x % 2}', 'existing'],
+                    'description': [f'description {x}', 'shared'],
+                } for x in range(10)]
+                items.insert(3, {'title': 'No overview'})
+                items.insert(5, {'title': 'Bad tags', 'overview': 'Test overview', 'tags': 'not a list'})
+                response = http_method(endpoint, json=items, headers=auth)
+            finally:
+                event.remove(db.session, "after_commit", count_commit)
+            self.assertEqual(response.status_code, 207)
+            data = response.get_json()
+            self.assertEqual([error["index"] for error in data["errors"]], [3, 5])
+            self.assertEqual(len(data["created"]), 10)
+            self.assertEqual(len(commits), 1)
+
+            self.assertEqual(Project.query.count(), 10)
+            self.assertEqual(Tag.query.count(), 3)
+            self.assertEqual(Description.query.count(), 20)
+            project = db.session.get(Project, data["created"][0]["id"])
+            self.assertEqual(project.title, "Bulk 0")
+            self.assertEqual(sorted(tag.name for tag in project.tags), ["existing", "new 0"])
+            self.assertEqual(sorted(d.description for d in project.descriptions), ["description 0", "shared"])
+
+            # Test with an NDJSON stream, including a line that isn't JSON
+            body = "\n".join([
+                json.dumps({'title': 'Stream 1', 'overview': 'Test overview', 'tags': ['new 1']}),
+                "{not json",
+                json.dumps({'title': 'Stream 2', 'overview': 'Test overview'}),
+            ])
+            response = http_method(endpoint, data=body, content_type='application/x-ndjson', headers=auth)
+            self.assertEqual(response.status_code, 207)
+            data = response.get_json()
+            self.assertEqual([item["title"] for item in data["created"]], ["Stream 1", "Stream 2"])
+            self.assertEqual([error["index"] for error in data["errors"]], [1])
+            self.assertEqual(Tag.query.count(), 3)
+
+            # Test when every item is invalid
+            response = http_method(endpoint, json=[{}], headers=auth)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(Project.query.count(), 12)
+
     def test_get_projects(self):
         with app.app_context():
             http_method = self.app.get
@@ -148,6 +261,269 @@ class AuthTestCase(unittest.TestCase):
             self.assertEqual(len(data), 4)
             # You can also check the details of the projects if needed
 
+    def test_get_projects_query_count(self):
+        with app.app_context():
+            http_method = self.app.get
+            endpoint = "projects/"
+
+            def add_projects(start, count):
+                for x in range(start, start + count):
+                    project = Project(title=f"Project {x}", overview=f"Overview {x}",
+                        tags=[f"Tag {x % 3}", f"Group {x % 5}"], descriptions=[f"Description {x}", "Shared"])
+                    project.save()
+
+            statements = []
+            def count_statement(*args):
+                statements.append(args[2])
+
+            add_projects(0, 3)
+            event.listen(db.engine, "before_cursor_execute", count_statement)
+            try:
+                response = http_method(endpoint)
+                small_count = len(statements)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.get_json()), 3)
+
+                # The batched read path must produce the same payload as serializing each project lazily
+                db.session.expire_all()
+                expected = [project.serialize() for project in Project.query.all()]
+                self.assertEqual(response.get_json(), json.loads(json.dumps(expected)))
+
+                add_projects(3, 20)
+                del statements[:]
+                response = http_method(endpoint)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.get_json()), 23)
+                self.assertEqual(len(statements), small_count)
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count_statement)
+
+    def test_pagination(self):
+        with app.app_context():
+            http_method = self.app.get
+            for x in range(7):
+                project = Project(title=f"Project {x}", overview=f"Overview {x}", tags=["Tag even" if x % 2 == 0 else "Tag odd"])
+                project.save()
+
+            # Walk every page and make sure each project shows up exactly once, in id order
+            def walk(endpoint, limit):
+                seen, cursor, pages = [], None, 0
+                while True:
+                    query = f"?limit={limit}" + (f"&cursor={cursor}" if cursor else "")
+                    response = http_method(endpoint + query)
+                    self.assertEqual(response.status_code, 200)
+                    data = response.get_json()
+                    self.assertLessEqual(len(data["items"]), limit)
+                    seen += data["items"]
+                    pages += 1
+                    cursor = data["next"]
+                    if not cursor:
+                        return seen, pages
+
+            projects, pages = walk("projects/", 3)
+            self.assertEqual(pages, 3)
+            self.assertEqual([p["title"] for p in projects], [f"Project {x}" for x in range(7)])
+            ids = [p["id"] for p in projects]
+            self.assertEqual(ids, sorted(ids))
+
+            projects, pages = walk("projects/tag/Tag_even", 2)
+            self.assertEqual([p["title"] for p in projects], [f"Project {x}" for x in range(0, 7, 2)])
+
+            tags, pages = walk("projects/tags", 1)
+            self.assertEqual([t["name"] for t in tags], ["Tag even", "Tag odd"])
+
+            # Unpaginated requests keep returning a plain list
+            response = http_method("projects/")
+            self.assertEqual(len(response.get_json()), 7)
+
+            # Bad parameters are rejected
+            self.assertEqual(http_method("projects/?limit=abc").status_code, 400)
+            self.assertEqual(http_method("projects/?limit=0").status_code, 400)
+            self.assertEqual(http_method("projects/?cursor=not-a-cursor").status_code, 400)
+            for last_id in (-1, True, 2 ** 63, 10 ** 30):
+                cursor = encode_cursor(last_id)
+                self.assertEqual(http_method(f"projects/?cursor={cursor}").status_code, 400)
+                self.assertEqual(http_method(f"projects/tags?cursor={cursor}").status_code, 400)
+                self.assertEqual(http_method(f"projects/tags/query?all=Tag_even&cursor={cursor}").status_code, 400)
+
+    def test_response_cache(self):
+        with app.app_context():
+            http_method = self.app.get
+            endpoint = "projects/"
+            auth = {'Authorization': f'Bearer {JWT_TOKEN_GOOD}'}
+            project = Project(title="Cached", overview="Overview", tags=["Tag 1"])
+            project.save()
+
+            statements = []
+            def count_statement(*args):
+                statements.append(args[2])
+
+            response = http_method(endpoint)
+            self.assertEqual(response.status_code, 200)
+            etag = response.headers["ETag"]
+
+            # A repeat read is answered from the cache without touching the database
+            event.listen(db.engine, "before_cursor_execute", count_statement)
+            try:
+                response = http_method(endpoint)
+                self.assertEqual(response.headers["ETag"], etag)
+                self.assertEqual(len(response.get_json()), 1)
+
+                response = http_method(endpoint, headers={"If-None-Match": etag})
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.data, b"")
+                self.assertEqual(len(statements), 0)
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count_statement)
+
+            # Query parameters are part of the key
+            response = http_method(endpoint + "?limit=1")
+            self.assertNotEqual(response.headers["ETag"], etag)
+
+            # Every write route invalidates the cached reads
+            response = self.app.post(endpoint, json={'title': 'Second', 'overview': 'Overview'}, headers=auth)
+            self.assertEqual(response.status_code, 201)
+            response = http_method(endpoint, headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.get_json()), 2)
+            etag = response.headers["ETag"]
+
+            response = self.app.put(f"projects/tag/{project.tags[0].id}", json={'name': 'Renamed'}, headers=auth)
+            self.assertEqual(response.status_code, 200)
+            response = http_method(endpoint, headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("Renamed", [tag["name"] for tag in response.get_json()[0]["tags"]])
+
+            # Misses aren't cached
+            self.assertEqual(http_method("projects/find/Nothing").status_code, 404)
+            Project(title="Nothing", overview="Overview").save()
+            self.assertEqual(http_method("projects/find/Nothing").status_code, 200)
+
+            # Commits that wrote nothing keep the cache; Core writes the flush didn't see clear it
+            version = catalog_version.value
+            db.session.commit()
+            self.assertEqual(catalog_version.value, version)
+            db.session.execute(update(Project).where(Project.title == "Nothing").values(overview="Changed"))
+            db.session.commit()
+            self.assertEqual(catalog_version.value, version + 1)
+            self.assertIsNone(catalog_version.changes_since(version))
+
+    def test_search_endpoint(self):
+        with app.app_context():
+            http_method = self.app.get
+            endpoint = "projects/search"
+            auth = {'Authorization': f'Bearer {JWT_TOKEN_GOOD}'}
+            Project(title="Flask API", overview="A REST service written in Python", descriptions=["Uses SQLAlchemy"]).save()
+            Project(title="Data pipeline", overview="Python jobs that feed the <flask> API", descriptions=["Runs nightly"]).save()
+            Project(title="Game", overview="A browser game", descriptions=["Written in TypeScript, no python"]).save()
+            Project(title="Unrelated", overview="Nothing to see").save()
+
+            self.assertEqual(http_method(endpoint).status_code, 400)
+            self.assertEqual(http_method(endpoint + "?q=%20!!").status_code, 400)
+
+            # Title matches outrank body matches
+            response = http_method(endpoint + "?q=flask")
+            self.assertEqual(response.status_code, 200)
+            data = response.get_json()
+            self.assertEqual(data["total"], 2)
+            self.assertEqual([item["project"]["title"] for item in data["items"]], ["Flask API", "Data pipeline"])
+            self.assertEqual(data["items"][0]["highlights"]["title"], "<mark>Flask</mark> API")
+            # Highlighted text is HTML-escaped
+            self.assertIn("&lt;<mark>flask</mark>&gt;", data["items"][1]["highlights"]["overview"])
+
+            # Descriptions are searched too, and results can be paged
+            response = http_method(endpoint + "?q=python&limit=2")
+            data = response.get_json()
+            self.assertEqual(data["total"], 3)
+            self.assertEqual(len(data["items"]), 2)
+            response = http_method(endpoint + f"?q=python&limit=2&cursor={data['next']}")
+            data = response.get_json()
+            self.assertEqual([item["project"]["title"] for item in data["items"]], ["Game"])
+            self.assertEqual(data["items"][0]["highlights"]["description"], ["Written in TypeScript, no <mark>python</mark>"])
+            self.assertIsNone(data["next"])
+
+            # Writes are picked up by the index
+            project_id = Project.query.filter_by(title="Unrelated").first().id
+            response = self.app.put(f"projects/{project_id}", json={'descriptions': ['Now with Flask']}, headers=auth)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(http_method(endpoint + "?q=flask").get_json()["total"], 3)
+            response = self.app.delete(f"projects/{project_id}", headers=auth)
+            self.assertEqual(response.status_code, 204)
+            self.assertEqual(http_method(endpoint + "?q=flask").get_json()["total"], 2)
+            self.assertEqual(len(search_index), 3)
+
+    def test_sparse_fieldsets(self):
+        with app.app_context():
+            http_method = self.app.get
+            for x in range(3):
+                Project(title=f"Project {x}", overview=f"Overview {x}", tags=["Tag 1"], descriptions=["Description"]).save()
+
+            statements = []
+            def count_statement(*args):
+                statements.append(args[2])
+
+            # Only the title column is read and no relationship is loaded
+            event.listen(db.engine, "before_cursor_execute", count_statement)
+            try:
+                response = http_method("projects/?fields=id,title")
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count_statement)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.get_json()[0], {"id": 1, "title": "Project 0"})
+            self.assertEqual(len(statements), 1)
+            self.assertNotIn("overview", statements[0])
+
+            # Tags come without their project lists unless included
+            data = http_method("projects/find/project_1?fields=title,tags").get_json()
+            self.assertEqual(data, {"title": "Project 1", "tags": [{"id": 1, "name": "Tag 1"}]})
+            data = http_method("projects/tag/Tag_1?fields=tags&include=tags.projects").get_json()
+            self.assertEqual(data[0]["tags"][0]["projects"], ["Project 0", "Project 1", "Project 2"])
+            data = http_method("projects/?include=tags.projects&limit=1").get_json()
+            self.assertEqual(set(data["items"][0]), set(Project.FIELDS))
+
+            # Other read routes honour fields too
+            data = http_method("projects/search?q=overview&fields=title").get_json()
+            self.assertEqual(data["items"][0]["project"], {"title": "Project 0"})
+            self.assertIn("overview", data["items"][0]["highlights"])
+            data = http_method("projects/tags/query?all=tag_1&fields=dates").get_json()
+            self.assertEqual(data, [{"dates": [None, None]}] * 3)
+            data = http_method("projects/tags?fields=name").get_json()
+            self.assertEqual(data, [{"name": "Tag 1"}])
+
+            # Without the parameters the payload is unchanged
+            self.assertEqual(set(http_method("projects/").get_json()[0]), set(Project.FIELDS))
+            self.assertEqual(http_method("projects/?fields=title,secret").status_code, 400)
+            self.assertEqual(http_method("projects/?fields=").status_code, 400)
+            self.assertEqual(http_method("projects/?include=owner").status_code, 400)
+
+    def test_streaming_listings(self):
+        with app.app_context():
+            http_method = self.app.get
+            for x in range(7):
+                Project(title=f"Project {x}", overview=f"Overview {x}", tags=["Tag 1"] if x % 2 else [],
+                    descriptions=[f"Description {x}"]).save()
+
+            with patch.object(controller, 'STREAM_BATCH_SIZE', 3):
+                response = http_method("projects/?stream=1")
+                self.assertTrue(response.is_streamed)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.get_json(), http_method("projects/").get_json())
+
+                response = http_method("projects/tag/Tag_1?stream=1&fields=title")
+                self.assertEqual(response.get_json(), [{"title": f"Project {x}"} for x in (1, 3, 5)])
+
+                # Streams aren't cached and keep the empty-result semantics of each route
+                Tag(name="Empty").save()
+                self.assertEqual(http_method("projects/tag/Empty?stream=1").status_code, 404)
+                self.assertEqual(http_method("projects/?stream=1&limit=2").status_code, 400)
+
+                db.session.execute(Description.__table__.delete())
+                db.session.execute(project_tags.delete())
+                db.session.execute(Project.__table__.delete())
+                db.session.commit()
+                response = http_method("projects/?stream=1")
+                self.assertEqual(response.get_json(), [])
+
     def test_get_project_by_title(self):
         with app.app_context():
             http_method = self.app.get
@@ -195,6 +571,51 @@ class AuthTestCase(unittest.TestCase):
             self.assertEqual(data["overview"], basic_overview)
 
 
+    def test_project_slugs(self):
+        with app.app_context():
+            auth = {'Authorization': f'Bearer {JWT_TOKEN_GOOD}'}
+            project = Project(title="  My  Cool__Project ", overview="Overview")
+            project.save()
+            self.assertEqual(project.slug, "my_cool_project")
+
+            # Lookups go through the slug, whatever the casing or underscores in the URL
+            for url_title in ["my_cool_project", "My_Cool_Project", "MY___COOL_PROJECT"]:
+                response = self.app.get("projects/find/" + url_title)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.get_json()["id"], project.id)
+            # "_" is no longer a wildcard
+            self.assertEqual(self.app.get("projects/find/my_cool_projec_").status_code, 404)
+
+            # Titles that map to a taken slug are rejected
+            response = self.app.post("projects/", json={'title': 'my cool project', 'overview': 'Overview'}, headers=auth)
+            self.assertEqual(response.status_code, 409)
+            other = Project(title="Other", overview="Overview")
+            other.save()
+            response = self.app.put(f"projects/{other.id}", json={'title': 'MY COOL PROJECT'}, headers=auth)
+            self.assertEqual(response.status_code, 409)
+            response = self.app.post("projects/bulk", json=[
+                {'title': 'New one', 'overview': 'Overview'},
+                {'title': 'new_one', 'overview': 'Overview'},
+                {'title': 'Other', 'overview': 'Overview'},
+            ], headers=auth)
+            self.assertEqual(response.status_code, 207)
+            self.assertEqual([error["index"] for error in response.get_json()["errors"]], [1, 2])
+
+            # Renaming keeps the slug in sync
+            response = self.app.put(f"projects/{other.id}", json={'title': 'Renamed Project'}, headers=auth)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.app.get("projects/find/renamed_project").get_json()["id"], other.id)
+
+            # Rows written before the column existed are backfilled, colliding slugs get the id appended
+            db.session.execute(Project.__table__.update().values(slug=None))
+            db.session.execute(Project.__table__.insert().values(title="renamed project", overview="Overview"))
+            db.session.commit()
+            self.assertEqual(Project.backfill_slugs(batch_size=2), 4)
+            slugs = sorted(slug for (slug,) in db.session.query(Project.slug))
+            self.assertEqual(len(slugs), 4)
+            self.assertIn("renamed_project", slugs)
+            self.assertTrue(any(slug.startswith("renamed_project_") for slug in slugs))
+
     def test_tag_endpoints(self):
         with app.app_context():
             http_method = self.app.get
@@ -295,6 +716,76 @@ class AuthTestCase(unittest.TestCase):
             self.assertEqual(len(data), 4)
 
 
+    def test_tag_query_endpoint(self):
+        with app.app_context():
+            http_method = self.app.get
+            endpoint = "projects/tags/query"
+            auth = {'Authorization': f'Bearer {JWT_TOKEN_GOOD}'}
+            catalog = {
+                "Web app": ["python", "flask"],
+                "Old web app": ["python", "flask", "legacy"],
+                "CLI": ["python"],
+                "Site": ["javascript", "Web Design"],
+                "Untagged": [],
+            }
+            for title, tags in catalog.items():
+                Project(title=title, overview="Overview", tags=tags).save()
+
+            def titles(query):
+                response = http_method(endpoint + query)
+                self.assertEqual(response.status_code, 200)
+                return [project["title"] for project in response.get_json()]
+
+            self.assertEqual(http_method(endpoint).status_code, 400)
+            self.assertEqual(titles("?all=python,flask&none=legacy"), ["Web app"])
+            self.assertEqual(titles("?all=python&any=flask,legacy"), ["Web app", "Old web app"])
+            self.assertEqual(titles("?any=javascript,legacy"), ["Old web app", "Site"])
+            self.assertEqual(titles("?none=python"), ["Site", "Untagged"])
+            # Names match like the tag/<name> route: case-insensitive, "_" for spaces
+            self.assertEqual(titles("?all=web_design,JavaScript"), ["Site"])
+            self.assertEqual(titles("?all=python,unknown"), [])
+
+            # Paging walks the matches in id order
+            response = http_method(endpoint + "?any=python&limit=2")
+            data = response.get_json()
+            self.assertEqual([p["title"] for p in data["items"]], ["Web app", "Old web app"])
+            response = http_method(endpoint + f"?any=python&limit=2&cursor={data['next']}")
+            data = response.get_json()
+            self.assertEqual([p["title"] for p in data["items"]], ["CLI"])
+            self.assertIsNone(data["next"])
+
+            # The index follows writes, including tag renames and deletes
+            project_id = Project.query.filter_by(title="CLI").first().id
+            self.app.put(f"projects/{project_id}", json={'tags': ['python', 'flask']}, headers=auth)
+            self.assertEqual(titles("?all=python,flask&none=legacy"), ["Web app", "CLI"])
+            tag = Tag.query.filter_by(name="legacy").first()
+            self.app.put(f"projects/tag/{tag.id}", json={'name': 'archived'}, headers=auth)
+            self.assertEqual(titles("?all=archived"), ["Old web app"])
+            self.app.delete("projects/tag/flask", headers=auth)
+            self.assertEqual(titles("?any=flask"), [])
+            self.assertEqual(titles("?all=python&none=archived"), ["Web app", "CLI"])
+
+    def test_tag_writes_keep_search_index(self):
+        with app.app_context():
+            auth = {'Authorization': f'Bearer {JWT_TOKEN_GOOD}'}
+            Project(title="Cache layer", overview="Overview", tags=["python", "legacy"]).save()
+            self.assertEqual(self.app.get("projects/search?q=cache").get_json()["total"], 1)
+            self.assertEqual(len(self.app.get("projects/tags/query?all=legacy").get_json()), 1)
+
+            # Tags aren't searched, so renaming or deleting one doesn't rebuild the search index
+            version = catalog_version.value
+            tag = Tag.query.filter_by(name="legacy").first()
+            with patch.object(search_index, "_clear", wraps=search_index._clear) as clear:
+                self.assertEqual(self.app.put(f"projects/tag/{tag.id}", json={'name': 'archived'}, headers=auth).status_code, 200)
+                self.assertEqual(self.app.delete("projects/tag/python", headers=auth).status_code, 204)
+                self.assertEqual(self.app.get("projects/search?q=cache").get_json()["total"], 1)
+                clear.assert_not_called()
+            self.assertIsNone(catalog_version.changes_since(version))
+            self.assertIsNotNone(catalog_version.changes_since(version, tags=False))
+            # while the tag index still follows them
+            self.assertEqual(len(self.app.get("projects/tags/query?all=archived").get_json()), 1)
+            self.assertEqual(self.app.get("projects/tags/query?all=python").get_json(), [])
+
     def test_update_project_endpoint(self):
         with app.app_context():
             http_method = self.app.put
@@ -605,6 +1096,78 @@ class AuthTestCase(unittest.TestCase):
             response = http_method(endpoint + str(project.id), json=init_data, headers={'Authorization': f'Bearer {JWT_TOKEN_GOOD}'})
     
     
+    def test_writes_use_one_transaction(self):
+        with app.app_context():
+            auth = {'Authorization': f'Bearer {JWT_TOKEN_GOOD}'}
+            Tag(name="Tag 1").save()
+
+            commits = []
+            def count_commit(session):
+                commits.append(session)
+            event.listen(db.session, "after_commit", count_commit)
+            try:
+                response = self.app.post("projects/", json={
+                    'title': 'Test title',
+                    'overview': 'Test overview',
+                    'tags': ['Tag 1', 'Tag 2', 'Tag 3'],
+                    'description': ['description1', 'description2', 'description3'],
+                }, headers=auth)
+                self.assertEqual(response.status_code, 201)
+                self.assertEqual(len(commits), 1)
+                self.assertEqual(len(response.get_json()["description"]), 3)
+                project_id = response.get_json()["id"]
+
+                response = self.app.put(f"projects/{project_id}", json={
+                    'tags': ['Tag 3', 'Tag 4'],
+                    'descriptions': ['description4', 'description5'],
+                }, headers=auth)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(commits), 2)
+            finally:
+                event.remove(db.session, "after_commit", count_commit)
+
+            project = db.session.get(Project, project_id)
+            self.assertEqual(sorted(tag.name for tag in project.tags), ['Tag 3', 'Tag 4'])
+            self.assertEqual(sorted(d.description for d in project.descriptions), ['description4', 'description5'])
+            self.assertEqual(Description.query.count(), 2)
+            self.assertEqual(Tag.query.count(), 4)
+
+    def test_tag_resolve(self):
+        with app.app_context():
+            for name in ["Tag 1", "Tag 2"]:
+                Tag(name=name).save()
+            names = [f"Tag {x}" for x in range(20)] + ["Tag 1", "Tag 5"]
+
+            statements = []
+            def count_statement(*args):
+                statements.append(args[2])
+            event.listen(db.engine, "before_cursor_execute", count_statement)
+            try:
+                tags = Tag.resolve(names)
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count_statement)
+            db.session.commit()
+
+            # One lookup, one upsert, one read-back regardless of how many names there are
+            self.assertEqual(len(statements), 3)
+            self.assertEqual([tag.name for tag in tags], names)
+            self.assertIs(tags[1], tags[20])
+            self.assertIs(tags[5], tags[21])
+            self.assertEqual(Tag.query.count(), 20)
+            self.assertEqual(Tag.resolve([]), [])
+
+            # Inserting a name another writer already added doesn't raise
+            Tag._insert_missing(["Tag 3", "Tag 20"])
+            db.session.commit()
+            self.assertEqual(Tag.query.count(), 21)
+
+            # A name that only differs in case from one being resolved maps to the same tag
+            tags = Tag.resolve(["Tag 1", "TAG 1"])
+            db.session.commit()
+            self.assertIs(tags[0], tags[1])
+            self.assertEqual(tags[0].name, "Tag 1")
+            self.assertEqual(Tag.query.count(), 21)
+
     def test_update_tag_endpoint(self):
         with app.app_context():
 
@@ -717,5 +1280,202 @@ class AuthTestCase(unittest.TestCase):
             response = http_method(endpoint +  "not_real_tag", headers={'Authorization': f'Bearer {JWT_TOKEN_GOOD}'})
             self.assertEqual(response.status_code, 404)
 
+    def test_serializers(self):
+        with app.app_context():
+            for x in range(2):
+                project = Project(title=f"Project {x}", overview="Overview", tags=["Shared", f"Own {x}"], descriptions=["Description"])
+                project.save()
+            db.session.get(Project, 1).start_date = date(2021, 3, 9)
+            projects = Project.with_relations().order_by(Project.id).all()
+
+            data = Project.serialize_many(projects)
+            self.assertEqual(data[0], {
+                "id": 1, "title": "Project 0", "overview": "Overview", "description": ["Description"],
+                "githubLink": None, "dates": ["2021-03", None],
+                "tags": [{"id": 1, "name": "Shared", "projects": ["Project 0", "Project 1"]},
+                         {"id": 2, "name": "Own 0", "projects": ["Project 0"]}],
+            })
+            # A tag shared by both projects is serialized once
+            self.assertIs(data[0]["tags"][0], data[1]["tags"][0])
+            self.assertEqual(data, [project.serialize() for project in projects])
+            self.assertEqual(Project.serialize_many(projects, ("title", "tags"), False)[1],
+                             {"title": "Project 1", "tags": [{"id": 1, "name": "Shared"}, {"id": 3, "name": "Own 1"}]})
+            # One serializer per fieldset
+            self.assertIs(Project.serializer(("id",)), Project.serializer(("id",)))
+            self.assertEqual(Tag.serialize_many(Tag.query.order_by(Tag.id).limit(1), ("name",)), [{"name": "Shared"}])
+
+            # Whichever encoder is installed, the payload decodes the same
+            payload = {"b": [1, None, "é"], "a": date(2021, 3, 9)}
+            self.assertEqual(json.loads(app.json.dumps(payload)), {"a": "Tue, 09 Mar 2021 00:00:00 GMT", "b": [1, None, "é"]})
+            self.assertEqual(app.json.loads(app.json.dumps(payload)), json.loads(app.json.dumps(payload)))
+
+    def test_project_snapshots(self):
+        with app.app_context():
+            http_method = self.app.get
+            headers = {'Authorization': f'Bearer {JWT_TOKEN_GOOD}'}
+            for x in range(3):
+                Project(title=f"Project {x}", overview="Overview", tags=["Shared"] if x < 2 else ["Alone"],
+                        descriptions=["Description"]).save()
+
+            def snapshot(project_id):
+                db.session.expire_all()
+                project = db.session.get(Project, project_id)
+                data = json.loads(json.dumps(project.serialize(tag_projects=False)))
+                self.assertEqual(json.loads(project.snapshot), dict(data, tags=[tag["id"] for tag in data["tags"]]))
+                return json.loads(project.snapshot), project.snapshot_version
+
+            def listed(project_id):
+                return http_method(f"projects/find/{db.session.get(Project, project_id).slug}").get_json()
+
+            # Snapshots hold tag ids, so a write only rewrites its own project's
+            self.assertEqual(snapshot(1), ({"id": 1, "title": "Project 0", "overview": "Overview", "description": ["Description"],
+                                            "githubLink": None, "tags": [1], "dates": [None, None]}, 1))
+            self.assertEqual(listed(1)["tags"], [{"id": 1, "name": "Shared", "projects": ["Project 0", "Project 1"]}])
+
+            # Titles and tag names are joined in at read time
+            self.app.put("projects/2", json={"title": "Renamed"}, headers=headers)
+            self.assertEqual(snapshot(1)[1], 1)
+            self.assertEqual(listed(1)["tags"][0]["projects"], ["Project 0", "Renamed"])
+            self.app.put("projects/tag/1", json={"name": "Common"}, headers=headers)
+            self.assertEqual(listed(2)["tags"][0]["name"], "Common")
+            self.app.delete("projects/2", headers=headers)
+            self.assertEqual(listed(1)["tags"][0]["projects"], ["Project 0"])
+            self.app.delete("projects/tag/Common", headers=headers)
+            self.assertEqual(snapshot(1)[0]["tags"], [])
+            self.assertEqual(listed(1), db.session.get(Project, 1).serialize())
+
+            # Full listings read the project table, then the tags of the page in one
+            # query; missing snapshots are rendered on the fly
+            db.session.execute(update(Project).where(Project.id == 3).values(snapshot=None))
+            db.session.commit()
+            statements = []
+            def count_statement(*args):
+                statements.append(args[2])
+            event.listen(db.engine, "before_cursor_execute", count_statement)
+            try:
+                data = http_method("projects/").get_json()
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count_statement)
+            self.assertEqual([project["title"] for project in data], ["Project 0", "Project 2"])
+            self.assertEqual(data[1]["tags"][0]["name"], "Alone")
+            self.assertNotIn("JOIN", statements[0].upper())
+            self.assertEqual(http_method("projects/find/project_2").get_json(), data[1])
+
+            self.assertEqual(Project.backfill_snapshots(), 1)
+            self.assertEqual(snapshot(3)[0]["tags"], [data[1]["tags"][0]["id"]])
+            self.assertEqual(http_method("projects/find/project_2").get_json(), data[1])
+
+    def test_tags_in_one_query(self):
+        with app.app_context():
+            http_method = self.app.get
+            for x in range(6):
+                Project(title=f"Project {x}", overview="Overview", tags=[f"Tag {n}" for n in range(x % 4)]).save()
+            Tag(name="Unused").save()
+
+            statements = []
+            def count_statement(*args):
+                statements.append(args[2])
+            event.listen(db.engine, "before_cursor_execute", count_statement)
+            try:
+                data = http_method("projects/tags").get_json()
+                self.assertEqual(len(statements), 1)
+                page = http_method("projects/tags?limit=2&fields=name").get_json()
+                self.assertEqual(len(statements), 2)
+                facets = http_method("projects/tags/facets").get_json()
+                self.assertEqual(len(statements), 3)
+            finally:
+                event.remove(db.engine, "before_cursor_execute", count_statement)
+
+            self.assertEqual(data[0], {"id": 1, "name": "Tag 0", "projects": ["Project 1", "Project 2", "Project 3", "Project 5"]})
+            self.assertEqual([tag["name"] for tag in data], ["Tag 0", "Tag 1", "Tag 2"])
+            self.assertEqual(page["items"], [{"name": "Tag 0"}, {"name": "Tag 1"}])
+            self.assertEqual(http_method(f"projects/tags?limit=2&cursor={page['next']}").get_json()["next"], None)
+            self.assertEqual(facets, [{"id": 1, "name": "Tag 0", "count": 4},
+                                      {"id": 2, "name": "Tag 1", "count": 2},
+                                      {"id": 3, "name": "Tag 2", "count": 1}])
+
+    def test_request_timing(self):
+        with app.app_context():
+            for x in range(3):
+                Project(title=f"Project {x}", overview="Overview", tags=["Tag"]).save()
+        # Off by default
+        self.assertNotIn("Server-Timing", self.app.get("projects/?fields=title").headers)
+
+        app.config['REQUEST_TIMING'] = True
+        try:
+            with self.assertLogs("app.instrumentation", "INFO") as logs:
+                response = self.app.get("projects/?fields=title,tags")
+                admin = self.app.get("projects/admin", headers={"Authorization": f"Bearer {JWT_TOKEN_GOOD}"})
+        finally:
+            app.config['REQUEST_TIMING'] = False
+        metrics = {metric.split(";")[0]: metric for metric in response.headers["Server-Timing"].split(", ")}
+        self.assertEqual(set(metrics), {"db", "serialize", "total"})
+        self.assertIn('desc="1"', metrics["serialize"])
+        self.assertIn("auth", admin.headers["Server-Timing"])
+
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual((line["method"], line["path"], line["status"]), ("GET", "/projects/", 200))
+        self.assertEqual(line["endpoint"], "controller.get_projects")
+        self.assertGreaterEqual(line["db_count"], 1)
+        self.assertEqual(line["serialize_count"], 1)
+        self.assertEqual(json.loads(logs.records[1].getMessage())["auth_count"], 1)
+
+    def test_catalog_sync(self):
+        auth = {'Authorization': f'Bearer {JWT_TOKEN_GOOD}'}
+        catalog_sync.enabled, catalog_sync.interval = True, 0
+        try:
+            with app.app_context():
+                self.assertEqual(self.app.get("projects/").get_json(), [])
+                self.assertEqual(catalog_sync.synced, 0)
+
+                # A write is shared through the database in its own transaction
+                response = self.app.post("projects/", json={'title': 'Local', 'overview': 'Overview'}, headers=auth)
+                self.assertEqual(response.status_code, 201)
+                local_id = Project.query.filter_by(title="Local").one().id
+                self.assertEqual(db.session.execute(select(catalog_changes)).all(), [(1, f"[{local_id}]", False)])
+                # and not applied a second time by the process that made it
+                version = catalog_version.value
+                self.assertEqual(len(self.app.get("projects/").get_json()), 1)
+                self.assertEqual(catalog_version.value, version)
+                self.assertEqual(catalog_sync.synced, 1)
+
+                # Another process writes: this one's cache and indexes catch up with the ids it logged
+                self.assertEqual(self.app.get("projects/search?q=remote").get_json()["total"], 0)
+                with db.engine.begin() as connection:
+                    remote_id = connection.execute(insert(Project).values(
+                        title="Remote", slug="remote", overview="Overview")).inserted_primary_key[0]
+                    catalog_sync.record(connection, {remote_id})
+                self.assertEqual(len(self.app.get("projects/").get_json()), 2)
+                self.assertEqual(catalog_version.changes_since(version), {remote_id})
+                self.assertEqual(self.app.get("projects/search?q=remote").get_json()["total"], 1)
+
+                # A tag renamed elsewhere reaches the indexes that read tags
+                version = catalog_version.value
+                with db.engine.begin() as connection:
+                    catalog_sync.record(connection, set(), tags=True)
+                self.app.get("projects/")
+                self.assertIsNone(catalog_version.changes_since(version))
+                self.assertEqual(catalog_version.changes_since(version, tags=False), set())
+
+                # Within CATALOG_SYNC_INTERVAL the shared version isn't looked at
+                catalog_sync.interval = 60
+                with db.engine.begin() as connection:
+                    later_id = connection.execute(insert(Project).values(
+                        title="Later", slug="later", overview="Overview")).inserted_primary_key[0]
+                    catalog_sync.record(connection, {later_id})
+                self.assertEqual(len(self.app.get("projects/").get_json()), 2)
+                catalog_sync.interval = 0
+                self.assertEqual(len(self.app.get("projects/").get_json()), 3)
+
+                # Unknown changes rebuild
+                with db.engine.begin() as connection:
+                    catalog_sync.record(connection, None)
+                version = catalog_version.value
+                self.app.get("projects/")
+                self.assertIsNone(catalog_version.changes_since(version))
+        finally:
+            catalog_sync.enabled, catalog_sync.interval = False, 1.0
+            catalog_sync.synced = catalog_sync._checked = None
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+import sys
+from subprocess import run
+from unittest.mock import patch
+from os import environ, path
+from tempfile import TemporaryDirectory
+from sqlalchemy import create_engine, text
+from app.database import generate_database_uri, engine_options, configure_engine, pool_status
+
+CREDENTIALS = {"DB_USERNAME": "user", "DB_PASSWORD": "p@ss", "DB_HOST": "db", "DB_NAME": "projects"}
+
+
+class DatabaseUriTestCase(unittest.TestCase):
+    def uri(self, **env):
+        with patch.dict(environ, {**CREDENTIALS, **env}):
+            for name in ("DATABASE_URL", "DB_BACKEND", "DB_DRIVER", "DB_CONNECT_PORT"):
+                if name not in env:
+                    environ.pop(name, None)
+            return generate_database_uri()
+
+    def test_backends(self):
+        self.assertEqual(self.uri(), "mysql+pymysql://user:p%40ss@db:3306/projects")
+        self.assertEqual(self.uri(DB_BACKEND="postgresql"), "postgresql+psycopg2://user:p%40ss@db:5432/projects")
+        self.assertEqual(self.uri(DB_DRIVER="mysqldb", DB_CONNECT_PORT="3307"), "mysql+mysqldb://user:p%40ss@db:3307/projects")
+        self.assertEqual(self.uri(DB_BACKEND="sqlite", DB_PATH="dev.db"), "sqlite:///dev.db")
+        self.assertEqual(self.uri(DATABASE_URL="sqlite://"), "sqlite://")
+        with self.assertRaises(ValueError):
+            self.uri(DB_BACKEND="oracle")
+
+
+class EngineOptionsTestCase(unittest.TestCase):
+    def test_pool_settings(self):
+        env = {"DB_POOL_SIZE": "3", "DB_MAX_OVERFLOW": "0", "DB_POOL_RECYCLE": "60", "DB_POOL_PRE_PING": "false"}
+        with patch.dict(environ, env):
+            options = engine_options("mysql+pymysql://u:p@db/projects")
+        self.assertEqual(options["pool_size"], 3)
+        self.assertEqual(options["max_overflow"], 0)
+        self.assertEqual(options["pool_recycle"], 60)
+        self.assertFalse(options["pool_pre_ping"])
+        self.assertEqual(engine_options("sqlite://"), {})
+
+    def test_statement_timeout(self):
+        with patch.dict(environ, {"DB_STATEMENT_TIMEOUT": "2500"}):
+            self.assertEqual(engine_options("postgresql://u:p@db/projects")["connect_args"],
+                             {"options": "-c statement_timeout=2500"})
+            self.assertNotIn("connect_args", engine_options("mysql+pymysql://u:p@db/projects"))
+
+    def test_sqlite_wal(self):
+        with TemporaryDirectory() as directory:
+            uri = f"sqlite:///{path.join(directory, 'test.db')}"
+            engine = create_engine(uri, **engine_options(uri))
+            configure_engine(engine)
+            with engine.connect() as connection:
+                self.assertEqual(connection.execute(text("PRAGMA journal_mode")).scalar(), "wal")
+            self.assertIn("pool=QueuePool, size=5", pool_status(engine))
+            engine.dispose()
+
+
+
+class DefaultAppTestCase(unittest.TestCase):
+    def test_build_errors_keep_their_cause(self):
+        # Without CORS_ORIGINS create_app() fails on None.split(); that used to
+        # come out of ``from app import app`` as an ImportError
+        env = {key: value for key, value in environ.items() if key != "CORS_ORIGINS"}
+        result = run([sys.executable, "-c", "from app import app"], env=env, capture_output=True, text=True,
+                     cwd=path.dirname(path.dirname(path.dirname(path.abspath(__file__)))))
+        self.assertIn("RuntimeError: create_app() failed", result.stderr)
+        self.assertIn("AttributeError", result.stderr)
+        self.assertNotIn("ImportError", result.stderr)
+
+
+if __name__ == '__main__':
+    unittest.main()
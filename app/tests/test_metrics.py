@@ -0,0 +1,112 @@
+import json
+import unittest
+from os import getpid, getppid
+from os.path import join
+from subprocess import Popen
+from sys import executable
+from tempfile import TemporaryDirectory
+from threading import Thread
+from app import app, db
+from app.models.project import Project
+from app.controller.cache import response_cache
+from app.metrics import Registry, registry, shared_metrics
+
+
+class RegistryTestCase(unittest.TestCase):
+    def test_threads_add_up(self):
+        metrics = Registry(buckets=(0.1, 1.0))
+
+        def record():
+            for _ in range(1000):
+                metrics.inc("requests", (("route", "a"),))
+                metrics.observe("latency", (), 0.5)
+
+        threads = [Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        metrics.observe("latency", (), 0.1)
+        metrics.observe("latency", (), 5)
+        counters, histograms = metrics.collect()
+        self.assertEqual(counters, {("requests", (("route", "a"),)): 4000})
+        # 0.1 goes into le="0.1", 0.5 into le="1.0" and 5 into +Inf
+        self.assertEqual(histograms[("latency", ())], [1, 4000, 1, 2005.1])
+
+
+class MetricsEndpointTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['METRICS'] = True
+        registry.clear()
+        response_cache.clear()
+        with app.app_context():
+            db.create_all()
+            Project(title="Project", overview="Overview", tags=["Tag"]).save()
+        self.app = app.test_client()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+        app.config['METRICS'] = False
+        app.config['METRICS_ALLOW'] = []
+        shared_metrics.configure(None)
+
+    def test_metrics(self):
+        hits = response_cache.hits
+        self.app.get("projects/")
+        self.app.get("projects/")
+        self.app.get("projects/find/missing")
+        response = self.app.get("metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith("text/plain; version=0.0.4"))
+        lines = response.get_data(as_text=True).splitlines()
+
+        self.assertIn('projects_http_requests_total{route="controller.get_projects",method="GET",status="200"} 2', lines)
+        self.assertIn('projects_http_requests_total{route="controller.get_project_by_title",method="GET",status="404"} 1', lines)
+        self.assertIn('projects_http_request_duration_seconds_count{route="controller.get_projects"} 2', lines)
+        self.assertIn('projects_http_request_duration_seconds_bucket{route="controller.get_projects",le="+Inf"} 2', lines)
+        # The second listing came from the response cache without a query
+        self.assertIn('projects_db_queries_total{route="controller.get_projects"} 2', lines)
+        self.assertIn(f"projects_response_cache_hits_total {hits + 1}", lines)
+        self.assertIn("# TYPE projects_http_request_duration_seconds histogram", lines)
+        # The scrape itself isn't counted
+        self.assertFalse([line for line in lines if 'route="metrics"' in line])
+
+        app.config['METRICS'] = False
+        self.assertEqual(self.app.get("metrics").status_code, 404)
+
+    def test_allow_list(self):
+        app.config['METRICS_ALLOW'] = ["10.0.0.0/8", "192.168.1.5"]
+        self.assertEqual(self.app.get("metrics").status_code, 403)
+        self.assertEqual(self.app.get("metrics", environ_base={"REMOTE_ADDR": "10.1.2.3"}).status_code, 200)
+        self.assertEqual(self.app.get("metrics", environ_base={"REMOTE_ADDR": "192.168.1.5"}).status_code, 200)
+
+    def test_workers_add_up(self):
+        # Another live worker and one that has exited left their series behind
+        exited = Popen([executable, "-c", ""])
+        exited.wait()
+        series = {"counters": [["projects_http_requests_total", [["route", "controller.get_projects"], ["method", "GET"], ["status", "200"]], 3]],
+                  "histograms": [],
+                  "gauges": [["projects_response_cache_entries", "gauge", "Responses held in the response cache.", [], 7],
+                             ["projects_response_cache_hits_total", "counter", "Response cache lookups that found a fresh entry.", [], 5]]}
+        with TemporaryDirectory() as directory:
+            for pid in (getppid(), exited.pid):
+                with open(join(directory, f"{pid}.json"), "w") as file:
+                    json.dump(series, file)
+            shared_metrics.configure(directory)
+            hits = response_cache.hits
+            self.app.get("projects/")
+            lines = self.app.get("metrics").get_data(as_text=True).splitlines()
+
+        self.assertIn('projects_http_requests_total{route="controller.get_projects",method="GET",status="200"} 7', lines)
+        self.assertIn(f"projects_response_cache_hits_total {hits + 10}", lines)
+        # Gauges are per live worker
+        self.assertIn(f'projects_response_cache_entries{{worker="{getppid()}"}} 7', lines)
+        self.assertIn(f'projects_response_cache_entries{{worker="{getpid()}"}} {len(response_cache)}', lines)
+        self.assertFalse([line for line in lines if f'worker="{exited.pid}"' in line])
+
+
+if __name__ == '__main__':
+    unittest.main()
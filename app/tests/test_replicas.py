@@ -0,0 +1,100 @@
+import unittest
+from unittest.mock import patch
+from os import environ, path
+from tempfile import TemporaryDirectory
+from sqlalchemy import create_engine, insert
+from app import app, db
+from app.database import ReplicaSet, replicas
+from app.models.project import Project
+from app.controller import controller, routing
+from app.controller.cache import response_cache
+from app.controller.routing import STICKY_COOKIE
+
+ADMIN = environ["ADMIN_LIST"].split(",")[0]
+
+
+class ReplicaSetTestCase(unittest.TestCase):
+    def test_round_robin_skips_failed_replicas(self):
+        first, second = create_engine("sqlite://"), create_engine("sqlite://")
+        replica_set = ReplicaSet([first, second])
+        self.assertEqual([replica_set.choose() for _ in range(3)], [first, second, first])
+        replica_set.mark_down(first)
+        self.assertEqual([replica_set.choose() for _ in range(2)], [second, second])
+        replica_set.mark_down(second)
+        self.assertIsNone(replica_set.choose())
+
+    def test_least_loaded(self):
+        with TemporaryDirectory() as directory:
+            busy, idle = (create_engine(f"sqlite:///{path.join(directory, name)}") for name in ("busy.db", "idle.db"))
+            replica_set = ReplicaSet([busy, idle], strategy="least_loaded")
+            with busy.connect():
+                self.assertIs(replica_set.choose(), idle)
+            busy.dispose()
+            idle.dispose()
+
+
+class ReplicaRoutingTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        response_cache.clear()
+        self.directory = TemporaryDirectory()
+        self.replica = create_engine(f"sqlite:///{path.join(self.directory.name, 'replica.db')}")
+        with app.app_context():
+            db.create_all()
+            Project(title="Primary project", overview="Overview").save()
+        # The replica holds a stale copy of the catalog
+        db.metadata.create_all(self.replica)
+        with self.replica.begin() as connection:
+            connection.execute(insert(Project), [{"title": "Replica project", "slug": "replica_project", "overview": "Overview"}])
+        self.patches = [
+            patch.object(replicas, 'engines', [self.replica]),
+            patch.object(replicas, '_down', {}),
+            patch.object(routing, '_last_write', [float("-inf")]),
+            patch.object(controller, 'verify_token', return_value=ADMIN),
+        ]
+        for active in self.patches:
+            active.start()
+        self.app = app.test_client()
+
+    def tearDown(self):
+        for active in self.patches:
+            active.stop()
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+        self.replica.dispose()
+        self.directory.cleanup()
+
+    def titles(self):
+        response_cache.clear()
+        return [project["title"] for project in self.app.get("projects/").get_json()]
+
+    def test_reads_go_to_the_replica(self):
+        self.assertEqual(self.titles(), ["Replica project"])
+        self.assertEqual(self.app.get("projects/find/replica_project").status_code, 200)
+        # Search keeps reading the primary, in step with its in-memory index
+        self.assertEqual(self.app.get("projects/search?q=primary").get_json()["total"], 1)
+
+    def test_read_your_writes(self):
+        response = self.app.post("projects/", json={"title": "New project", "overview": "Overview"})
+        self.assertEqual(response.status_code, 201)
+        self.assertIn(STICKY_COOKIE, response.headers["Set-Cookie"])
+        self.assertEqual(self.titles(), ["Primary project", "New project"])
+
+        # The cookie alone keeps the writer on the primary ...
+        routing._last_write[0] = float("-inf")
+        self.assertEqual(self.titles(), ["Primary project", "New project"])
+        # ... and other clients read the replica
+        self.app.delete_cookie(STICKY_COOKIE)
+        self.assertEqual(self.titles(), ["Replica project"])
+
+    def test_fallback_to_primary(self):
+        down = create_engine(f"sqlite:///{path.join(self.directory.name, 'missing', 'replica.db')}")
+        with patch.object(replicas, 'engines', [down]):
+            self.assertEqual(self.titles(), ["Primary project"])
+            self.assertIsNone(replicas.choose())
+            self.assertEqual(self.titles(), ["Primary project"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import json
+import unittest
+from app import app, db
+from app.models.project import Project
+from app.controller.cache import response_cache
+from unittest.mock import MagicMock
+from app.slow_queries import slow_query_log, explain
+
+
+class SlowQueryLogTestCase(unittest.TestCase):
+    def setUp(self):
+        app.config['TESTING'] = True
+        response_cache.clear()
+        with app.app_context():
+            db.create_all()
+            Project(title="Project", overview="Overview " * 100, tags=["Tag"]).save()
+        self.app = app.test_client()
+
+    def tearDown(self):
+        slow_query_log.configure(0)
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_logs_slow_statements_with_plan(self):
+        # Every statement counts as slow
+        slow_query_log.configure(0.000001)
+        with self.assertLogs("app.slow_queries", "WARNING") as logs:
+            self.assertEqual(self.app.get("projects/tag/Tag").status_code, 200)
+        lines = [json.loads(record.getMessage()) for record in logs.records]
+        lookup = next(line for line in lines if "LIKE" in line["statement"])
+        self.assertEqual(lookup["endpoint"], "controller.get_projects_by_tag")
+        self.assertEqual(lookup["path"], "/projects/tag/Tag")
+        self.assertIn("Tag", lookup["parameters"])
+        self.assertTrue(lookup["plan"] and isinstance(lookup["plan"], list))
+
+        # Outside a request, writes are logged without a plan and long values are cut
+        with app.app_context(), self.assertLogs("app.slow_queries", "WARNING") as logs:
+            Project(title="Other", overview="Overview " * 100).save()
+        insert = next(json.loads(record.getMessage()) for record in logs.records
+                      if json.loads(record.getMessage())["statement"].startswith("INSERT INTO project "))
+        self.assertNotIn("plan", insert)
+        self.assertNotIn("endpoint", insert)
+        self.assertLess(max(len(str(value)) for value in insert["parameters"]), 210)
+
+    def test_failed_explain_keeps_the_transaction(self):
+        # On PostgreSQL a failing EXPLAIN is rolled back to a savepoint
+        class Error(Exception):
+            pass
+        connection = MagicMock()
+        connection.dialect.name = "postgresql"
+        connection.dialect.dbapi.Error = Error
+        connection.connection.dbapi_connection.autocommit = False
+        cursor = connection.connection.dbapi_connection.cursor.return_value
+
+        def execute(sql, *args):
+            if sql.startswith("EXPLAIN"):
+                raise Error("boom")
+        cursor.execute.side_effect = execute
+        self.assertEqual(explain(connection, "SELECT 1", ()), "EXPLAIN failed: boom")
+        self.assertEqual([call.args[0] for call in cursor.execute.call_args_list],
+                         ["SAVEPOINT slow_query_explain", "EXPLAIN SELECT 1",
+                          "ROLLBACK TO SAVEPOINT slow_query_explain", "RELEASE SAVEPOINT slow_query_explain"])
+        cursor.close.assert_called_once()
+
+    def test_rate_limit(self):
+        slow_query_log.configure(0.000001, explain=False, per_minute=1)
+        with self.assertLogs("app.slow_queries", "WARNING") as logs:
+            for _ in range(3):
+                self.app.get("projects/find/missing")
+            self.assertEqual(len(logs.records), 1)
+            # Once a line is allowed again it says how many were dropped
+            slow_query_log._allowance = 1
+            self.app.get("projects/find/missing")
+        self.assertEqual(len(logs.records), 2)
+        self.assertGreaterEqual(json.loads(logs.records[1].getMessage())["suppressed"], 2)
+
+    def test_off_by_default(self):
+        self.assertFalse(slow_query_log)
+        with self.assertNoLogs("app.slow_queries"):
+            self.app.get("projects/")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+from unittest.mock import patch
+from app import app, db
+from app.models.project import Project
+from app.controller.cache import response_cache
+from app.controller.search import search_index
+from app.controller.tag_index import tag_index
+import wsgi
+
+
+class WarmupTestCase(unittest.TestCase):
+    def setUp(self):
+        response_cache.clear()
+        search_index.reset()
+        tag_index.reset()
+        with app.app_context():
+            db.create_all()
+            Project(title="Project 0", overview="Overview", tags=["Tag 1"]).save()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_warm_up(self):
+        wsgi.warm_indexes()
+        self.assertIsNotNone(search_index.version)
+        self.assertIsNotNone(tag_index.version)
+
+        with app.app_context():
+            engine = db.engine
+        wsgi.warm_pool()
+        # Only queue pools keep idle connections to count; sqlite:// uses a StaticPool
+        if hasattr(engine.pool, "checkedin"):
+            self.assertGreater(engine.pool.checkedin(), 0)
+
+        wsgi.warm_responses()
+        self.assertEqual(len(response_cache._entries), 1)
+
+    def test_after_fork_keeps_the_master_connections_open(self):
+        with app.app_context():
+            engine = db.engine
+        with patch.object(type(engine), "dispose") as dispose:
+            wsgi.after_fork()
+        dispose.assert_called_once_with(close=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
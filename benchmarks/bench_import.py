@@ -0,0 +1,73 @@
+"""Measure cold-start cost: importing the package, manage.py and run.py.
+
+    python benchmarks/bench_import.py [top] [repeat]
+
+Each target is imported in a fresh interpreter under ``python -X importtime``;
+the report shows the total import time and the slowest modules by cumulative
+time. Building the application with create_app() is timed separately, since
+importing no longer does it.
+"""
+import subprocess
+import sys
+from os import environ
+from os.path import abspath, dirname, join
+from timeit import repeat as timeit_repeat
+from dotenv import dotenv_values
+
+ROOT = abspath(join(dirname(__file__), ".."))
+TARGETS = {
+    "import app": "import app",
+    "manage.py": "import manage",
+    "run.py": "import run",
+}
+
+
+def child_environment():
+    # .env.testing fills in what the shell doesn't set
+    env = {key: value for key, value in dotenv_values(join(ROOT, ".env.testing")).items() if value is not None}
+    env.update(environ)
+    env["PYTHONPATH"] = ROOT
+    return env
+
+
+def import_times(code, env):
+    # [(cumulative_us, depth, module)] from one cold ``-X importtime`` run
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        times.append((int(cumulative), depth, name.strip()))
+    return times
+
+
+def report(label, code, env, top, repeat):
+    runs = [import_times(code, env) for _ in range(repeat)]
+    # The fastest run is the least disturbed by the rest of the machine
+    times = min(runs, key=lambda run: sum(cumulative for cumulative, depth, _ in run if depth == 0))
+    total = sum(cumulative for cumulative, depth, _ in times if depth == 0)
+    print(f"{label}: {total / 1000:8.1f} ms, {len(times)} modules")
+    for cumulative, _, name in sorted(times, reverse=True)[:top]:
+        print(f"  {name:<50} {cumulative / 1000:8.1f} ms")
+
+
+def time_create_app(env, repeat):
+    environ.update(env)
+    sys.path.insert(0, ROOT)
+    from app import create_app
+    create_app()  # the first build also pays for the lazy imports
+    return min(timeit_repeat(create_app, number=1, repeat=repeat)) * 1000
+
+
+def main(top=15, repeat=3):
+    env = child_environment()
+    for label, code in TARGETS.items():
+        report(label, code, env, top, repeat)
+    print(f"create_app(): {time_create_app(env, repeat):8.1f} ms (warm, best of {repeat})")
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,307 @@
+"""Measure every route of controller_bp against a seeded catalog.
+
+    python benchmarks/bench_routes.py [--projects 10000] [--requests 100] [--concurrency 1]
+        [--mode client|server] [--url URL --token TOKEN] [--routes list,find] [--cache]
+        [--output report.json]
+
+--mode client calls the app through Flask's test client; --mode server sends
+HTTP requests to a threaded server started here, or to a running one given
+with --url (start it with REQUEST_TIMING=1: query counts are read from the
+Server-Timing header). Reads run with the response cache off unless --cache
+is given, since a cached route answers without touching the database. The
+write routes create, update and delete their own projects and tags, leaving
+the catalog as it was; against --url they need an admin --token. SQLite
+serializes writers, so concurrent write numbers (and lock errors) only mean
+something against MySQL or PostgreSQL, given with --database-url.
+
+The report holds throughput, p50/p95/p99 latency and SQL statements per
+request for each route; compare two of them with compare.py. The process
+exits with 1 when a route runs more statements than its QUERY_BUDGETS entry.
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+from logging import getLogger, WARNING
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from os import environ
+from statistics import mean, median, quantiles
+from threading import Thread, local
+from time import perf_counter
+from urllib.parse import quote
+from seed import ROOT, catalog_url, project_title, tag_name
+
+import requests
+
+Route = namedtuple("Route", "name method path body expected")
+BENCH_USER = "bench"
+BENCH_TOKEN = f"Bearer {BENCH_USER}"
+# Each write route after create works on the projects and tags it made
+WRITE_CHAIN = ("create", "update", "update_tag", "delete", "delete_tag")
+
+# Most statements a request to each route may run; full payloads read the
+# stored snapshots, then the tags they list in one more query
+QUERY_BUDGETS = {
+    "list": 2,
+    "list_page": 2,
+    "list_sparse": 2,
+    "find": 2,
+    "search": 4,
+    "tag": 3,
+    "tag_page": 3,
+    "tags": 1,
+    "tags_page": 1,
+    "tag_facets": 1,
+    "tags_query": 2,
+    "admin": 0,
+    "create": 16,
+    "bulk_create": 12,
+    "update": 15,
+    "update_tag": 5,
+    "delete": 7,
+    "delete_tag": 9,
+}
+
+
+def read_routes(projects, tags):
+    # Parameters cycle through the catalog so consecutive requests differ
+    def popular(i):
+        return tag_name(i % min(tags, 10))
+    return [
+        Route("list", "GET", lambda i: "/projects/", None, 200),
+        Route("list_page", "GET", lambda i: "/projects/?limit=50", None, 200),
+        Route("list_sparse", "GET", lambda i: "/projects/?fields=title,tags&limit=50", None, 200),
+        Route("find", "GET", lambda i: "/projects/find/" + quote(project_title(i * 7919 % projects).lower().replace(" ", "_")), None, 200),
+        Route("search", "GET", lambda i: "/projects/search?q=" + ("cache", "replica latency", "python api")[i % 3], None, 200),
+        Route("tag", "GET", lambda i: "/projects/tag/" + quote(popular(i).replace(" ", "_")), None, 200),
+        Route("tag_page", "GET", lambda i: "/projects/tag/" + quote(popular(i).replace(" ", "_")) + "?limit=50", None, 200),
+        Route("tags", "GET", lambda i: "/projects/tags", None, 200),
+        Route("tags_page", "GET", lambda i: "/projects/tags?limit=50", None, 200),
+        Route("tag_facets", "GET", lambda i: "/projects/tags/facets", None, 200),
+        Route("tags_query", "GET", lambda i: f"/projects/tags/query?all={quote(popular(i))}&any={quote(popular(i + 1))},{quote(popular(i + 2))}&limit=50", None, 200),
+        Route("admin", "GET", lambda i: "/projects/admin", None, 204),
+    ]
+
+
+def write_routes(run, created):
+    # Run in this order; each one works on what the previous ones created.
+    # created maps a request index to the (project id, tag id) it made
+    def new_project(i):
+        return {"title": f"Bench {run} {i}", "overview": "Created by bench_routes.py", "tags": [f"Bench {run} {i}", tag_name(0)],
+                "description": ["One", "Two"], "start_date": "2024-01"}
+    return [
+        Route("create", "POST", lambda i: "/projects/", new_project, 201),
+        Route("bulk_create", "POST", lambda i: "/projects/bulk",
+              lambda i: [{**new_project(i), "title": f"Bench {run} {i}.{n}", "tags": [f"Bench {run} {i}"]} for n in range(10)], 201),
+        Route("update", "PUT", lambda i: f"/projects/{created[i][0]}", lambda i: {"overview": f"Updated {i}", "tags": [f"Bench {run} {i}", tag_name(1)]}, 200),
+        Route("update_tag", "PUT", lambda i: f"/projects/tag/{created[i][1]}", lambda i: {"name": f"Bench {run} {i} renamed"}, 200),
+        Route("delete", "DELETE", lambda i: f"/projects/{created[i][0]}", None, 204),
+        Route("delete_tag", "DELETE", lambda i: "/projects/tag/" + quote(f"Bench {run} {i} renamed"), None, 204),
+    ]
+
+
+class ClientRunner:
+    """Requests through Flask's test client, one client per thread."""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = local()
+
+    def request(self, method, path, body, headers):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, json=body, headers=headers)
+        return response.status_code, response.headers.get("Server-Timing"), response.get_json(silent=True)
+
+
+class HttpRunner:
+    """Requests over HTTP with a keep-alive session per thread."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self._local = local()
+
+    def request(self, method, path, body, headers):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        response = session.request(method, self.base_url + path, json=body, headers=headers)
+        try:
+            data = response.json()
+        except ValueError:
+            data = None
+        return response.status_code, response.headers.get("Server-Timing"), data
+
+
+def query_count(server_timing):
+    # The desc of the db metric app.instrumentation sends, None without one
+    for metric in (server_timing or "").split(","):
+        name, *params = metric.strip().split(";")
+        if name == "db":
+            return next(int(param[6:-1]) for param in params if param.startswith("desc="))
+    return 0 if server_timing else None
+
+
+def measure(runner, route, indexes, concurrency, headers, on_response=None):
+    def one(i):
+        body = route.body(i) if route.body else None
+        started = perf_counter()
+        status, server_timing, data = runner.request(route.method, route.path(i), body, headers)
+        elapsed = perf_counter() - started
+        if on_response is not None and status == route.expected:
+            on_response(i, data)
+        return elapsed, status, query_count(server_timing)
+
+    started = perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(one, indexes))
+    wall = perf_counter() - started
+    latencies = sorted(elapsed * 1000 for elapsed, _, _ in results)
+    queries = [count for _, _, count in results if count is not None]
+    cuts = quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    result = {
+        "method": route.method,
+        "path": route.path(indexes[0]),
+        "requests": len(results),
+        "errors": sum(status != route.expected for _, status, _ in results),
+        "throughput_rps": round(len(results) / wall, 1),
+        "mean_ms": round(mean(latencies), 3),
+        "p50_ms": round(cuts[49], 3),
+        "p95_ms": round(cuts[94], 3),
+        "p99_ms": round(cuts[98], 3),
+        "max_ms": round(latencies[-1], 3),
+        "queries": median(queries) if queries else None,
+        "max_queries": max(queries) if queries else None,
+    }
+    budget = QUERY_BUDGETS.get(route.name)
+    result["query_budget"] = budget
+    result["over_budget"] = bool(queries) and budget is not None and max(queries) > budget
+    return result
+
+
+def start_server(app):
+    from werkzeug.serving import make_server
+    getLogger("werkzeug").setLevel(WARNING)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--projects", type=int, default=10000, help="which seeded catalog to use")
+    parser.add_argument("--tags", type=int, help="tags of that catalog, as given to seed.py")
+    parser.add_argument("--database-url", help="defaults to benchmarks/catalog-<projects>.db")
+    parser.add_argument("--requests", type=int, default=100, help="per route")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--mode", choices=("client", "server"), default="client")
+    parser.add_argument("--url", help="benchmark a running server instead of this checkout")
+    parser.add_argument("--token", help="admin Authorization header for the write routes of --url")
+    parser.add_argument("--routes", help="comma-separated route names, all of them by default")
+    parser.add_argument("--cache", action="store_true", help="leave the response cache on")
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    args = parser.parse_args(argv)
+    tags = args.tags or max(50, args.projects // 20)
+
+    headers = {"Authorization": args.token or BENCH_TOKEN}
+    server = None
+    if args.url:
+        runner = HttpRunner(args.url)
+        mode = "server"
+    else:
+        environ["DATABASE_URL"] = catalog_url(args.projects, args.database_url)
+        from app import create_app
+        from app.controller.auth import token_cache
+        from app.controller.cache import response_cache
+        app = create_app({"REQUEST_TIMING": True})
+        # Only the Server-Timing header is wanted, not a log line per request
+        getLogger("app.instrumentation").setLevel(WARNING)
+        app.config["ADMIN_LIST"] = app.config["ADMIN_LIST"] | {BENCH_USER}
+        # Tokens stay in the cache for AUTH_CACHE_TTL; long runs need a longer one
+        token_cache.ttl = float("inf")
+        token_cache.set(BENCH_TOKEN, BENCH_USER)
+        if not args.cache:
+            response_cache.max_entries = 0
+        mode = args.mode
+        if mode == "server":
+            server, base_url = start_server(app)
+            runner = HttpRunner(base_url)
+        else:
+            runner = ClientRunner(app)
+
+    created, bulk_created = {}, []
+
+    def remember(i, data):
+        created[i] = (data["id"], next(tag["id"] for tag in data["tags"] if tag["name"].startswith("Bench")))
+
+    def remember_bulk(i, data):
+        bulk_created.extend(item["id"] for item in data["created"])
+
+    routes = read_routes(args.projects, tags)
+    if args.token or not args.url:
+        routes += write_routes(datetime.now().strftime("%H%M%S"), created)
+    wanted = set(args.routes.split(",")) if args.routes else None
+    if wanted and wanted & set(WRITE_CHAIN):
+        # Run all of it, so what create made is cleaned up again
+        wanted |= set(WRITE_CHAIN)
+    report = {
+        "meta": {
+            "commit": commit(),
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "mode": mode,
+            "url": args.url,
+            "projects": args.projects,
+            "tags": tags,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "cache": args.cache if not args.url else None,
+            "python": platform.python_version(),
+        },
+        "routes": {},
+    }
+    for route in routes:
+        if wanted and route.name not in wanted:
+            continue
+        if route.method == "GET":
+            # Builds the in-memory indexes and fills the pools before timing
+            runner.request(route.method, route.path(0), None, headers)
+        indexes = range(args.requests)
+        if route.name in WRITE_CHAIN[1:]:
+            # A failed create left nothing to work on for that index
+            indexes = sorted(created)
+            if not indexes:
+                print(f"{route.name:<12} skipped, no project was created", file=sys.stderr)
+                continue
+        on_response = {"create": remember, "bulk_create": remember_bulk}.get(route.name)
+        result = measure(runner, route, indexes, args.concurrency, headers, on_response)
+        report["routes"][route.name] = result
+        print(f"{route.name:<12} {result['throughput_rps']:>8} req/s  p50 {result['p50_ms']:>9.2f} ms  "
+              f"p95 {result['p95_ms']:>9.2f} ms  p99 {result['p99_ms']:>9.2f} ms  queries {result['queries']}"
+              f"{'  OVER BUDGET' if result['over_budget'] else ''}{'  errors ' + str(result['errors']) if result['errors'] else ''}",
+              file=sys.stderr)
+    for project_id in bulk_created:
+        runner.request("DELETE", f"/projects/{project_id}", None, headers)
+    if server is not None:
+        server.shutdown()
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+    print(text)
+    return 1 if any(result["over_budget"] for result in report["routes"].values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
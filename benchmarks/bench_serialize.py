@@ -0,0 +1,106 @@
+"""Time serializing and encoding a project listing, old path against new.
+
+    python benchmarks/bench_serialize.py [projects] [tags] [repeat]
+
+Builds transient projects (no database needed) and compares the previous
+per-row serialize() + Flask's stdlib provider with serialize_many() + the
+configured JSON provider.
+"""
+import sys
+from datetime import date
+from os.path import dirname, join
+from timeit import repeat as timeit_repeat
+from dotenv import load_dotenv
+
+ROOT = join(dirname(__file__), "..")
+sys.path.insert(0, ROOT)
+load_dotenv(join(ROOT, ".env.testing"))
+
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+from app import app  # noqa: E402
+from app.models.project import Project  # noqa: E402
+from app.models.tag import Tag  # noqa: E402
+from app.models.description import Description  # noqa: E402
+
+
+def legacy_tag(tag, fields=None):
+    fields = fields or Tag.FIELDS
+    data = {}
+    if "id" in fields:
+        data["id"] = tag.id
+    if "name" in fields:
+        data["name"] = tag.name
+    if "projects" in fields:
+        data["projects"] = [p.title for p in tag.projects]
+    return data
+
+
+def legacy_project(project, fields=None, tag_projects=True):
+    # serialize() as it was before the per-fieldset serializers
+    fields = fields or Project.FIELDS
+    data = {}
+    if 'id' in fields:
+        data['id'] = project.id
+    if 'title' in fields:
+        data['title'] = project.title
+    if 'overview' in fields:
+        data['overview'] = project.overview
+    if 'description' in fields:
+        data['description'] = [description.description for description in project.descriptions]
+    if 'githubLink' in fields:
+        data['githubLink'] = project.github_link
+    if 'tags' in fields:
+        tag_fields = None if tag_projects else ('id', 'name')
+        data['tags'] = [legacy_tag(tag, tag_fields) for tag in project.tags]
+    if 'dates' in fields:
+        data['dates'] = [
+            project.start_date.strftime('%Y-%m') if project.start_date else None,
+            project.end_date.strftime('%Y-%m') if project.end_date else None,
+        ]
+    return data
+
+
+def build(count, tag_count):
+    tags = []
+    for n in range(tag_count):
+        tag = Tag(f"Tag {n}")
+        tag.id = n + 1
+        tags.append(tag)
+    projects = []
+    for n in range(count):
+        project = Project(title=f"Project {n}", overview="Overview " * 20, github_link=f"https://example.com/{n}")
+        project.id = n + 1
+        # Dates are set after construction so no string parsing is involved
+        project.start_date = date(2015 + n % 8, n % 12 + 1, 1)
+        project.end_date = date(2016 + n % 8, (n + 5) % 12 + 1, 1) if n % 3 else None
+        project.descriptions = [Description(f"Description {n}.{d}", project) for d in range(3)]
+        project.tags = [tags[(n + k) % tag_count] for k in range(4)]
+        projects.append(project)
+    for tag in tags:
+        tag.projects = [project for project in projects if tag in project.tags]
+    return projects
+
+
+def best(statement, repeat):
+    return min(timeit_repeat(statement, number=1, repeat=repeat)) * 1000
+
+
+def main(count=2000, tag_count=40, repeat=5):
+    projects = build(count, tag_count)
+    stdlib = DefaultJSONProvider(app)
+    runs = {
+        "legacy serialize": lambda: [legacy_project(project) for project in projects],
+        "serialize_many": lambda: Project.serialize_many(projects),
+        "legacy serialize + stdlib json": lambda: stdlib.dumps([legacy_project(project) for project in projects]),
+        f"serialize_many + {type(app.json).__name__}": lambda: app.json.dumps(Project.serialize_many(projects)),
+        "legacy sparse (title,dates)": lambda: [legacy_project(project, ('title', 'dates')) for project in projects],
+        "serialize_many sparse (title,dates)": lambda: Project.serialize_many(projects, ('title', 'dates')),
+    }
+    assert [legacy_project(project) for project in projects] == Project.serialize_many(projects)
+    print(f"{count} projects, {tag_count} tags, best of {repeat}")
+    for name, run in runs.items():
+        print(f"  {name:<45} {best(run, repeat):8.2f} ms")
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
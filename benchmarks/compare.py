@@ -0,0 +1,87 @@
+"""Compare two bench_routes.py reports.
+
+    python benchmarks/compare.py base.json head.json [--threshold 10]
+
+Prints each route's p50/p95/p99 latency, throughput and statements per
+request side by side with the relative change. A route regressed when its
+p95 latency or throughput got worse by more than --threshold percent, or
+when it runs more statements than before; the process then exits with 1.
+Reports of different catalogs, modes or concurrency aren't comparable and
+are refused unless --force is given.
+"""
+import argparse
+import json
+import sys
+
+COMPARABLE = ("projects", "tags", "mode", "concurrency", "cache")
+# (key, label, True when higher is better)
+METRICS = (("p50_ms", "p50 ms", False), ("p95_ms", "p95 ms", False), ("p99_ms", "p99 ms", False),
+           ("throughput_rps", "req/s", True), ("queries", "queries", False))
+
+
+def change(base, head):
+    if base is None or head is None:
+        return None
+    if base == 0:
+        return 0.0 if head == 0 else float("inf")
+    return (head - base) / base * 100
+
+
+def regressions(base, head, threshold):
+    # Reasons a route got worse, empty when it didn't
+    reasons = []
+    p95 = change(base["p95_ms"], head["p95_ms"])
+    if p95 is not None and p95 > threshold:
+        reasons.append(f"p95 +{p95:.0f}%")
+    throughput = change(base["throughput_rps"], head["throughput_rps"])
+    if throughput is not None and throughput < -threshold:
+        reasons.append(f"throughput {throughput:.0f}%")
+    if base.get("queries") is not None and head.get("queries") is not None and head["queries"] > base["queries"]:
+        reasons.append(f"queries {base['queries']:g} -> {head['queries']:g}")
+    if head.get("errors", 0) > base.get("errors", 0):
+        reasons.append(f"errors {base.get('errors', 0)} -> {head['errors']}")
+    return reasons
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument("--threshold", type=float, default=10, help="percent, default 10")
+    parser.add_argument("--force", action="store_true", help="compare reports of different setups")
+    args = parser.parse_args(argv)
+    with open(args.base) as base_file, open(args.head) as head_file:
+        base, head = json.load(base_file), json.load(head_file)
+
+    different = [key for key in COMPARABLE if base["meta"].get(key) != head["meta"].get(key)]
+    if different and not args.force:
+        print("Reports differ in " + ", ".join(f"{key} ({base['meta'].get(key)} vs {head['meta'].get(key)})" for key in different)
+              + "; use --force to compare anyway", file=sys.stderr)
+        return 2
+
+    print(f"{base['meta'].get('commit')} -> {head['meta'].get('commit')}, {head['meta']['projects']} projects, "
+          f"{head['meta']['mode']} mode, concurrency {head['meta']['concurrency']}")
+    print(f"{'route':<12} " + " ".join(f"{label:>26}" for _, label, _ in METRICS))
+    regressed = {}
+    for name in list(dict.fromkeys([*base["routes"], *head["routes"]])):
+        if name not in base["routes"] or name not in head["routes"]:
+            print(f"{name:<12} only in {'head' if name in head['routes'] else 'base'}")
+            continue
+        old, new = base["routes"][name], head["routes"][name]
+        cells = []
+        for key, _, _ in METRICS:
+            delta = change(old.get(key), new.get(key))
+            values = f"{old.get(key)} -> {new.get(key)}"
+            cells.append(f"{values:>18} {delta:+6.1f}%" if delta is not None and delta != float("inf") else f"{values:>26}")
+        reasons = regressions(old, new, args.threshold)
+        if reasons:
+            regressed[name] = reasons
+        print(f"{name:<12} " + " ".join(cells) + ("  REGRESSED" if reasons else ""))
+
+    for name, reasons in regressed.items():
+        print(f"{name}: {', '.join(reasons)}", file=sys.stderr)
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
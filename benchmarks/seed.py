@@ -0,0 +1,129 @@
+"""Seed a benchmark catalog into a local database.
+
+    python benchmarks/seed.py [--projects 10000] [--tags N] [--skew 1.0] [--database-url URL [--force]]
+
+Each project gets 2 to 6 tags drawn with a Zipf-like long tail (a few tags
+are on many projects, most on a handful), 1 to 4 descriptions and overviews
+of a realistic length. The same arguments always produce the same catalog.
+Without --database-url the catalog is written to the SQLite file
+benchmarks/catalog-<projects>.db, which bench_routes.py picks up. Seeding
+drops every table first, so a --database-url other than SQLite is refused
+unless --force is given.
+"""
+import argparse
+import sys
+from os import environ
+from os.path import abspath, dirname, join
+from datetime import date
+from itertools import islice
+from random import Random
+from time import perf_counter
+from dotenv import load_dotenv
+from sqlalchemy import insert, select
+from sqlalchemy.engine import make_url
+
+HERE = abspath(dirname(__file__))
+ROOT = dirname(HERE)
+sys.path.insert(0, ROOT)
+load_dotenv(join(ROOT, ".env.testing"))
+
+WORDS = ("python flask api cache index query latency service worker queue stream schema replica pool "
+         "token search vector graph cloud docker build deploy metrics tracing storage backup network "
+         "frontend backend mobile data pipeline model training batch realtime secure scalable").split()
+TAG_WORDS = ("Python Flask React Docker Kubernetes MySQL PostgreSQL Redis GraphQL Rust Go TypeScript "
+             "AWS Terraform Kafka Spark Pandas PyTorch Android iOS Linux Nginx Celery Elasticsearch "
+             "WebSockets OAuth CI Testing Security Performance").split()
+BATCH_SIZE = 1000
+
+
+def catalog_url(projects, database_url=None):
+    return database_url or f"sqlite:///{join(HERE, f'catalog-{projects}.db')}"
+
+
+def tag_name(index):
+    word = TAG_WORDS[index % len(TAG_WORDS)]
+    return word if index < len(TAG_WORDS) else f"{word} {index // len(TAG_WORDS)}"
+
+
+def project_title(index):
+    # find/project_<index> is the slug
+    return f"Project {index}"
+
+
+def catalog(projects, tags, skew=1.0, seed=0):
+    # The create_project payloads of the catalog, in order
+    rng = Random(seed)
+    names = [tag_name(index) for index in range(tags)]
+    weights = [1 / (rank + 1) ** skew for rank in range(tags)]
+    for index in range(projects):
+        start_year = rng.randrange(2010, 2024)
+        ends = rng.random() < 0.6
+        yield {
+            "title": project_title(index),
+            "overview": " ".join(rng.choices(WORDS, k=rng.randrange(20, 60))).capitalize() + ".",
+            "github_link": f"https://github.com/example/project-{index}",
+            "start_date": date(start_year, rng.randrange(1, 13), 1),
+            "end_date": date(start_year + rng.randrange(1, 3), rng.randrange(1, 13), 1) if ends else None,
+            "tags": list(dict.fromkeys(rng.choices(names, weights, k=rng.randrange(2, 7)))),
+            "description": [" ".join(rng.choices(WORDS, k=rng.randrange(8, 30))) for _ in range(rng.randrange(1, 5))],
+        }
+
+
+def seed(projects, tags, skew=1.0, database_url=None, force=False):
+    # Rows go in with multi-row inserts, then the snapshots are rendered once
+    # by backfill_snapshots()
+    url = catalog_url(projects, database_url)
+    if make_url(url).get_backend_name() != "sqlite" and not force:
+        raise ValueError(f"Seeding drops every table of {make_url(url).render_as_string()}; use --force to seed it anyway")
+    environ["DATABASE_URL"] = url
+    from app import create_app, db
+    from app.models.project import Project
+    from app.models.tag import Tag, project_tags
+    from app.models.description import Description
+    app = create_app()
+    started = perf_counter()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.execute(insert(Tag), [{"name": tag_name(index)} for index in range(tags)])
+        tag_ids = dict(db.session.execute(select(Tag.name, Tag.id)).all())
+        rows = iter(catalog(projects, tags, skew))
+        while True:
+            batch = list(islice(rows, BATCH_SIZE))
+            if not batch:
+                break
+            db.session.execute(insert(Project), [
+                {"title": row["title"], "slug": Project.slugify(row["title"]), "overview": row["overview"],
+                 "github_link": row["github_link"], "start_date": row["start_date"], "end_date": row["end_date"]}
+                for row in batch])
+            slugs = [Project.slugify(row["title"]) for row in batch]
+            ids = dict(db.session.execute(select(Project.slug, Project.id).where(Project.slug.in_(slugs))).all())
+            db.session.execute(insert(project_tags), [
+                {"project_id": ids[slug], "tag_id": tag_ids[name]} for slug, row in zip(slugs, batch) for name in row["tags"]])
+            db.session.execute(insert(Description), [
+                {"project_id": ids[slug], "description": text} for slug, row in zip(slugs, batch) for text in row["description"]])
+            db.session.commit()
+        Project.backfill_snapshots()
+        db.session.remove()
+    return perf_counter() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--projects", type=int, default=10000)
+    parser.add_argument("--tags", type=int, help="defaults to one tag for every 20 projects, at least 50")
+    parser.add_argument("--skew", type=float, default=1.0, help="Zipf exponent of tag popularity, 0 for uniform")
+    parser.add_argument("--database-url", help="defaults to benchmarks/catalog-<projects>.db")
+    parser.add_argument("--force", action="store_true", help="seed a database other than SQLite, dropping its tables")
+    args = parser.parse_args(argv)
+    args.tags = args.tags or max(50, args.projects // 20)
+    try:
+        elapsed = seed(args.projects, args.tags, args.skew, args.database_url, args.force)
+    except ValueError as error:
+        parser.error(str(error))
+    print(f"Seeded {args.projects} projects and {args.tags} tags into "
+          f"{catalog_url(args.projects, args.database_url)} in {elapsed:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+# gunicorn settings for production: gunicorn -c gunicorn.conf.py
+from multiprocessing import cpu_count
+from os import environ
+from tempfile import mkdtemp
+from app.database import env_flag
+
+environment = environ
+
+wsgi_app = "wsgi:application"
+bind = f"0.0.0.0:{environment.get('PORT', 5000)}"
+workers = int(environment.get("WEB_WORKERS", cpu_count() * 2 + 1))
+# Each worker keeps its own caches and indexes; with several, share catalog
+# versions through the database so writes reach every worker, within
+# CATALOG_SYNC_INTERVAL seconds (1 by default)
+environment.setdefault("CATALOG_SYNC", "1" if workers > 1 else "0")
+# and add up their metrics through files in a shared directory
+if workers > 1 and env_flag("METRICS", False) and not environment.get("METRICS_DIR"):
+    environment["METRICS_DIR"] = mkdtemp(prefix="projects-metrics-")
+# Threads per worker; keep workers * threads * DB pool (size + overflow) under the server's connection limit
+threads = int(environment.get("WEB_THREADS", 4))
+worker_class = "gthread"
+timeout = int(environment.get("WEB_TIMEOUT", 30))
+graceful_timeout = int(environment.get("WEB_GRACEFUL_TIMEOUT", 30))
+keepalive = int(environment.get("WEB_KEEPALIVE", 5))
+# Recycle workers now and then, staggered so they don't all restart together
+max_requests = int(environment.get("WEB_MAX_REQUESTS", 10000))
+max_requests_jitter = int(environment.get("WEB_MAX_REQUESTS_JITTER", 1000))
+# Import the app once in the master; workers fork from it and share its memory
+preload_app = True
+accesslog = environment.get("WEB_ACCESS_LOG", "-")
+
+
+def on_starting(server):
+    # Series left over from an earlier run would be added to this one's
+    from app.metrics import shared_metrics
+    if shared_metrics:
+        shared_metrics.clear()
+
+
+def when_ready(server):
+    from wsgi import warm_indexes
+    warm_indexes()
+
+
+def post_fork(server, worker):
+    from wsgi import after_fork
+    after_fork()
+
+
+def post_worker_init(worker):
+    # Runs before the worker accepts connections
+    from wsgi import warm_pool, warm_responses
+    warm_pool()
+    warm_responses()
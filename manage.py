@@ -1,10 +1,10 @@
 from flask.cli import FlaskGroup
-from app import app
+from app import create_app
 from flask_migrate import init, migrate, upgrade
-from app.models.description import Description
-from app.models.project import Project
 from app.models.tag import Tag
-cli = FlaskGroup(app)
+from app.models.project import Project
+from app.models.description import Description
+cli = FlaskGroup(create_app=create_app)
 
 # Add Flask-Migrate commands
 
@@ -24,5 +24,15 @@ def db_upgrade():
     upgrade()
 
 
+@cli.command('db_backfill_slugs')
+def db_backfill_slugs():
+    print(f"Backfilled {Project.backfill_slugs()} project slugs")
+
+
+@cli.command('db_backfill_snapshots')
+def db_backfill_snapshots():
+    print(f"Backfilled {Project.backfill_snapshots()} project snapshots")
+
+
 if __name__ == '__main__':
     cli()
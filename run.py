@@ -1,8 +1,5 @@
-from app import create_app, db
-from flask_migrate import Migrate
-import ssl
+from app import create_app
 
-app = create_app()
 if __name__ == '__main__':
-    migrate = Migrate(app, db)
-    app.run(host='0.0.0.0', port=5001)
+    # Development server; production runs gunicorn (see gunicorn.conf.py)
+    create_app().run(host='0.0.0.0', port=5001)
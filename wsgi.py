@@ -0,0 +1,68 @@
+# Production WSGI entry point, served by gunicorn with the settings in
+# gunicorn.conf.py:
+#
+#     gunicorn -c gunicorn.conf.py
+from os import environ
+from logging import warning
+from sqlalchemy.pool import StaticPool
+from app import app, db
+from app.database import replicas
+
+environment = environ
+application = app
+# GET routes requested once per worker so its response cache starts warm
+WARMUP_URLS = [url for url in environment.get("WARMUP_URLS", "/projects/").split(",") if url.strip()]
+
+
+def _engines():
+    with app.app_context():
+        return [db.engine, *replicas.engines]
+
+
+def after_fork():
+    # Pooled connections inherited from the master belong to its sockets;
+    # forget them without closing so the master's connections stay intact
+    for engine in _engines():
+        engine.dispose(close=False)
+
+
+def warm_indexes():
+    # Build the in-memory indexes in the master so forked workers share them
+    from app.controller.cache import catalog_sync
+    from app.controller.search import search_index
+    from app.controller.tag_index import tag_index
+    try:
+        with app.app_context():
+            # Workers start from the shared version the indexes were built at
+            catalog_sync.sync()
+            search_index.refresh()
+            tag_index.refresh()
+    except Exception as error:
+        warning(f"Skipping index warm-up: {error}")
+    finally:
+        for engine in _engines():
+            # An in-memory database only lives as long as its one connection
+            if not isinstance(engine.pool, StaticPool):
+                engine.dispose()
+
+
+def warm_pool():
+    # Open each engine's connections up front instead of on the first requests
+    size = int(environment.get("DB_POOL_WARM", environment.get("DB_POOL_SIZE", 5)))
+    for engine in _engines():
+        connections = []
+        try:
+            for _ in range(min(size, engine.pool.size()) if hasattr(engine.pool, "size") else 1):
+                connections.append(engine.connect())
+        except Exception as error:
+            warning(f"Pool warm-up for {engine.url.render_as_string(hide_password=True)} stopped: {error}")
+        for connection in connections:
+            connection.close()
+
+
+def warm_responses():
+    client = app.test_client()
+    for url in WARMUP_URLS:
+        response = client.get(url.strip())
+        if response.status_code >= 500:
+            warning(f"Warm-up request {url} failed with {response.status_code}")